@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import User, Team, Activity, Leaderboard, Workout
+from .models import (
+    User, Team, Activity, ActivityDailyRollup, Leaderboard, LeaderboardPeriod, TeamLeaderboard, Tombstone, Workout
+)
 
 
 @admin.register(User)
@@ -26,12 +28,34 @@ class ActivityAdmin(admin.ModelAdmin):
     ordering = ['-date']
 
 
+@admin.register(ActivityDailyRollup)
+class ActivityDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user_id', 'day', 'activity_type', 'total_activities', 'total_calories', 'total_duration']
+    search_fields = ['user_id', 'activity_type']
+    list_filter = ['activity_type', 'day']
+    ordering = ['-day']
+
+
 @admin.register(Leaderboard)
 class LeaderboardAdmin(admin.ModelAdmin):
-    list_display = ['id', 'user_id', 'team_id', 'total_activities', 'total_calories', 'total_duration', 'rank']
+    list_display = ['id', 'user_id', 'team_id', 'total_activities', 'total_calories', 'total_duration']
     search_fields = ['user_id', 'team_id']
-    list_filter = ['rank']
-    ordering = ['rank']
+    ordering = ['-total_calories']
+
+
+@admin.register(LeaderboardPeriod)
+class LeaderboardPeriodAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user_id', 'period', 'start', 'total_activities', 'total_calories']
+    list_filter = ['period', 'start']
+    search_fields = ['user_id']
+    ordering = ['-start', '-total_calories']
+
+
+@admin.register(TeamLeaderboard)
+class TeamLeaderboardAdmin(admin.ModelAdmin):
+    list_display = ['id', 'team_id', 'total_activities', 'total_calories', 'total_duration', 'total_distance']
+    search_fields = ['team_id']
+    ordering = ['-total_calories']
 
 
 @admin.register(Workout)
@@ -40,3 +64,11 @@ class WorkoutAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     list_filter = ['difficulty']
     ordering = ['name']
+
+
+@admin.register(Tombstone)
+class TombstoneAdmin(admin.ModelAdmin):
+    list_display = ['id', 'resource', 'object_id', 'deleted_at']
+    list_filter = ['resource']
+    search_fields = ['object_id']
+    ordering = ['-deleted_at']
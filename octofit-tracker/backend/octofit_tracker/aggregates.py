@@ -0,0 +1,512 @@
+"""
+Incremental maintenance of the totals derived from activities and users.
+
+Writes that go through the API call `record_activities`, `retract_activities`
+or `replace_activity` instead of recomputing the leaderboard. The change is
+folded into one delta per user and applied with F-expressions, so every
+write costs a single update per affected user no matter how many activities
+that user already has. The same pass keeps the per-user, per-day
+`ActivityDailyRollup` documents, the weekly and monthly `LeaderboardPeriod`
+buckets behind the windowed leaderboards and the per-team `TeamLeaderboard`
+totals current. Team membership changes adjust `Team.member_count` and move the
+user's totals between team aggregates through `move_member`. Every applied
+change also publishes the affected users' new ranks, see events.py.
+"""
+import heapq
+from collections import defaultdict
+from datetime import timedelta
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+
+from . import mongo
+from .cache import response_cache
+from .events import broadcaster, publish_rank_changes
+from .metrics import TOTAL_FIELDS, coefficients, estimate_distance
+from .models import (
+    Activity, ActivityDailyRollup, Leaderboard, LeaderboardPeriod, Team, TeamLeaderboard, Tombstone, User
+)
+from .ranking import leaderboard_ranks
+
+
+def activity_day(activity):
+    """Calendar day (in the project time zone) an activity counts towards"""
+    if timezone.is_aware(activity.date):
+        return timezone.localtime(activity.date).date()
+    return activity.date.date()
+
+
+def _new_delta():
+    return dict.fromkeys(TOTAL_FIELDS, 0)
+
+
+def _add(delta, activity, sign):
+    delta['total_activities'] += sign
+    delta['total_calories'] += sign * activity.calories_burned
+    delta['total_duration'] += sign * activity.duration
+    delta['total_distance'] += sign * estimate_distance(activity.activity_type, activity.duration)
+
+
+class _Changes:
+    """Signed activity changes folded into per-user, per-day and per-period deltas"""
+
+    def __init__(self):
+        self.totals = defaultdict(_new_delta)
+        self.daily = defaultdict(_new_delta)
+        self.periods = defaultdict(_new_delta)
+        self.cutoffs = period_cutoffs()
+
+    def add(self, activities, sign):
+        for activity in activities:
+            user_id = str(activity.user_id)
+            day = activity_day(activity)
+            _add(self.totals[user_id], activity, sign)
+            _add(self.daily[(user_id, day, activity.activity_type)], activity, sign)
+            for period in LeaderboardPeriod.PERIODS:
+                start = _bucket_start(day, period)
+                # Backdated activities must not resurrect expired buckets
+                if start >= self.cutoffs[period]:
+                    _add(self.periods[(user_id, period, start)], activity, sign)
+        return self
+
+    def apply(self):
+        # Standings before and after feed the live leaderboard events; they
+        # may load the rank index, so only work them out for listeners
+        publish = bool(self.totals) and broadcaster.listening
+        previous = leaderboard_ranks.standings(self.totals) if publish else None
+        self._apply_totals()
+        self._apply_teams()
+        self._apply_daily()
+        self._apply_periods()
+        response_cache.bump('leaderboard')
+        if publish:
+            publish_rank_changes(previous, leaderboard_ranks.standings(self.totals))
+
+    def _apply_totals(self):
+        """One Leaderboard update per user"""
+        for user_id, delta in self.totals.items():
+            if not any(delta.values()):
+                continue
+            if not _update_counters(Leaderboard, {'user_id': user_id}, delta):
+                _create_entry(user_id)
+                _update_counters(Leaderboard, {'user_id': user_id}, delta)
+        leaderboard_ranks.refresh(self.totals.keys())
+
+    def _apply_teams(self):
+        """One TeamLeaderboard update per team, teams read from the users' entries"""
+        teams = defaultdict(_new_delta)
+        memberships = Leaderboard.objects.filter(user_id__in=list(self.totals)).values_list('user_id', 'team_id')
+        for user_id, team_id in memberships:
+            if team_id:
+                _merge(teams[team_id], self.totals[user_id])
+        for team_id, delta in teams.items():
+            _increment(TeamLeaderboard, {'team_id': team_id}, delta)
+
+    def _apply_daily(self):
+        """One rollup update per (user, day, activity type)"""
+        for (user_id, day, activity_type), delta in self.daily.items():
+            _increment(ActivityDailyRollup, {'user_id': user_id, 'day': day, 'activity_type': activity_type}, delta)
+
+    def _apply_periods(self):
+        """One bucket update per (user, week) and (user, month)"""
+        for (user_id, period, start), delta in self.periods.items():
+            _increment(LeaderboardPeriod, {'user_id': user_id, 'period': period, 'start': start}, delta)
+
+
+def _merge(target, delta, sign=1):
+    for field, value in delta.items():
+        target[field] += sign * value
+
+
+def _db_values(model, values):
+    """Field values as the database stores them, e.g. DateFields as datetimes on MongoDB"""
+    connection = connections[model.objects.db]
+    return {name: model._meta.get_field(name).get_db_prep_value(value, connection) for name, value in values.items()}
+
+
+def _update_counters(model, lookup, delta):
+    """
+    Add `delta` to the row matching `lookup` in one atomic write; False when there is none.
+
+    djongo cannot translate the `SET col = col + %s` that F() expressions
+    compile to, so on MongoDB this is a native `$inc`. Models with an
+    `updated_at` get it set too, since update() skips auto_now and delta
+    syncs read it.
+    """
+    changes = {field: value for field, value in delta.items() if value}
+    stamp = {'updated_at': timezone.now()} if any(f.name == 'updated_at' for f in model._meta.concrete_fields) else {}
+    if not mongo.uses_mongo(model.objects.db):
+        return bool(model.objects.filter(**lookup).update(**_f_changes(changes), **stamp))
+    update = {'$inc': changes}
+    if stamp:
+        update['$set'] = _db_values(model, stamp)
+    result = mongo.collection(model._meta.db_table, model.objects.db).update_one(_db_values(model, lookup), update)
+    return result.matched_count > 0
+
+
+def _f_changes(delta):
+    return {field: F(field) + value for field, value in delta.items() if value}
+
+
+def _increment(model, lookup, delta):
+    """Add a delta to the row matching `lookup`, creating it on first use"""
+    if not any(delta.values()):
+        return
+    if not _update_counters(model, lookup, delta):
+        model.objects.get_or_create(**lookup)
+        _update_counters(model, lookup, delta)
+
+
+def _create_entry(user_id):
+    team_id = None
+    if user_id.isdigit():
+        team_id = User.objects.filter(id=user_id).values_list('team_id', flat=True).first()
+    Leaderboard.objects.get_or_create(user_id=user_id, defaults={'team_id': team_id or ''})
+
+
+def record_activities(activities):
+    """Add newly created activities to their users' totals"""
+    _Changes().add(activities, 1).apply()
+
+
+def retract_activities(activities):
+    """Remove deleted activities from their users' totals"""
+    _Changes().add(activities, -1).apply()
+
+
+def replace_activity(previous, current):
+    """Swap an activity's old values for its updated ones in a single pass"""
+    _Changes().add([previous], -1).add([current], 1).apply()
+
+
+def build_daily_rollups(activities):
+    """Unsaved ActivityDailyRollup rows summarizing the given activities"""
+    daily = defaultdict(_new_delta)
+    for activity in activities:
+        _add(daily[(str(activity.user_id), activity_day(activity), activity.activity_type)], activity, 1)
+    return [
+        ActivityDailyRollup(user_id=user_id, day=day, activity_type=activity_type, **delta)
+        for (user_id, day, activity_type), delta in daily.items()
+    ]
+
+
+def rebuild_daily_rollups(chunk_size=2000):
+    """Recompute every daily rollup from the activities collection"""
+    activities = Activity.objects.only('user_id', 'activity_type', 'duration', 'calories_burned', 'date')
+    rollups = build_daily_rollups(activities.iterator(chunk_size=chunk_size))
+    truncate(ActivityDailyRollup)
+    ActivityDailyRollup.objects.bulk_create(rollups, batch_size=chunk_size)
+
+
+def raw_delete(queryset):
+    """
+    Delete the rows matched by a queryset without loading them first.
+
+    QuerySet.delete() fetches and signals each row when delete receivers are
+    connected, which is far too slow for load-test sized collections. Callers
+    are responsible for any cache invalidation.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def truncate(model):
+    """Delete every row of a model, see `raw_delete`"""
+    raw_delete(model.objects.all())
+
+
+def bulk_insert(model, objs, batch_size):
+    """bulk_create from any iterable without materializing it all at once"""
+    objs = iter(objs)
+    created = 0
+    while True:
+        batch = list(islice(objs, batch_size))
+        if not batch:
+            return created
+        model.objects.bulk_create(batch)
+        created += len(batch)
+
+
+def grouped_user_totals(activities=None):
+    """
+    Per-user totals from one aggregation grouped by (user_id, activity_type).
+
+    The grouping runs on the database server; distances are derived from the
+    per-type duration sums, so Python only sees one row per user and type.
+    """
+    activities = Activity.objects.all() if activities is None else activities
+    grouped = activities.order_by().values('user_id', 'activity_type').annotate(
+        # An alias named like a collection ("activities") breaks djongo's SQL parser
+        activity_count=Count('id'), calories=Sum('calories_burned'), duration=Sum('duration')
+    )
+    totals = defaultdict(_new_delta)
+    for row in grouped.iterator():
+        delta = totals[str(row['user_id'])]
+        delta['total_activities'] += row['activity_count']
+        delta['total_calories'] += row['calories']
+        delta['total_duration'] += row['duration']
+        delta['total_distance'] += row['duration'] * coefficients(row['activity_type']).km_per_minute
+    for delta in totals.values():
+        delta['total_distance'] = round(delta['total_distance'], 2)
+    return totals
+
+
+def users_changed_since(since):
+    """
+    Distinct user_ids with activities written or deleted at or after `since`.
+
+    Keyed on when activities reached the database (`updated_at`, tombstones),
+    not on their user-supplied date, so backdated ingests are included.
+    Raw deletes leave no tombstone and are not seen.
+    """
+    changed = Activity.objects.filter(updated_at__gte=since).order_by().values_list('user_id', flat=True).distinct()
+    deleted = Tombstone.objects.filter(resource=Activity._meta.db_table, deleted_at__gte=since)
+    return {
+        str(user_id) for user_id in chain(changed, deleted.values_list('user_id', flat=True).distinct()) if user_id
+    }
+
+
+def rebuild_leaderboard(user_ids=None, batch_size=1000):
+    """
+    Recompute Leaderboard rows from one aggregation and upsert them in bulk.
+
+    With `user_ids` only those users are reprocessed; otherwise every user
+    (and every user_id that has activities) is, rows for users that no
+    longer exist and have no activities are removed, and the windowed
+    buckets are rebuilt from the daily rollups. Existing rows keep their
+    id, so rank tie-breaks and pagination cursors stay stable, and each
+    batch is replaced in one transaction. Removed rows get Tombstones.
+    Returns the number of rows written.
+    """
+    if user_ids is None:
+        rebuild_leaderboard_periods()
+        totals = grouped_user_totals()
+        teams = {str(pk): team_id for pk, team_id in User.objects.values_list('id', 'team_id').iterator()}
+        targets = set(teams) | set(totals)
+        # Diffed in Python: an exclude(user_id__in=...) of every user exceeds Mongo's 16MB command limit
+        stale = [
+            (pk, user_id) for pk, user_id in Leaderboard.objects.values_list('id', 'user_id').iterator(chunk_size=batch_size)
+            if user_id not in targets
+        ]
+        for start in range(0, len(stale), batch_size):
+            chunk = stale[start:start + batch_size]
+            with transaction.atomic():
+                raw_delete(Leaderboard.objects.filter(id__in=[pk for pk, _ in chunk]))
+                # raw_delete skips the post_delete signal; delta syncs still need to see these go
+                Tombstone.objects.bulk_create([
+                    Tombstone(resource=Leaderboard._meta.db_table, object_id=pk, user_id=user_id) for pk, user_id in chunk
+                ])
+    else:
+        targets = {str(user_id) for user_id in user_ids}
+        totals = grouped_user_totals(Activity.objects.filter(user_id__in=list(targets)))
+        pks = [int(user_id) for user_id in targets if user_id.isdigit()]
+        teams = {str(pk): team_id for pk, team_id in User.objects.filter(id__in=pks).values_list('id', 'team_id')}
+
+    written = 0
+    targets = sorted(targets)
+    for start in range(0, len(targets), batch_size):
+        batch = targets[start:start + batch_size]
+        existing = Leaderboard.objects.filter(user_id__in=batch)
+        current = {user_id: (pk, team_id) for pk, user_id, team_id in existing.values_list('id', 'user_id', 'team_id')}
+        entries = []
+        for user_id in batch:
+            pk, team_id = current.get(user_id, (None, ''))
+            entries.append(Leaderboard(
+                id=pk,
+                user_id=user_id,
+                team_id=teams.get(user_id) or team_id or '',
+                **totals.get(user_id, _new_delta())
+            ))
+        # Readers and concurrent increments never see a user's row missing
+        with transaction.atomic():
+            raw_delete(existing)
+            Leaderboard.objects.bulk_create(entries)
+        written += len(entries)
+
+    rebuild_team_leaderboard()
+    # Ranks are computed on read; the next read reloads the index in one pass
+    leaderboard_ranks.invalidate()
+    response_cache.bump('leaderboard')
+    return written
+
+
+def rebuild_team_leaderboard():
+    """Recompute every TeamLeaderboard row from one aggregation over Leaderboard"""
+    grouped = Leaderboard.objects.exclude(team_id='').order_by().values('team_id').annotate(
+        **{field: Sum(field) for field in TOTAL_FIELDS}
+    )
+    rows = [TeamLeaderboard(**{**row, 'total_distance': round(row['total_distance'] or 0, 2)}) for row in grouped]
+    truncate(TeamLeaderboard)
+    TeamLeaderboard.objects.bulk_create(rows)
+    response_cache.bump('leaderboard')
+
+
+BUCKETS = ('day', 'week', 'month')
+
+
+def _bucket_start(day, bucket):
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def period_cutoffs(today=None):
+    """Earliest bucket start kept for each period under the retention settings"""
+    today = today or timezone.localdate()
+    week = _bucket_start(today, 'week') - timedelta(weeks=settings.OCTOFIT_WINDOW_RETENTION_WEEKS)
+    month = _bucket_start(today, 'month')
+    for _ in range(settings.OCTOFIT_WINDOW_RETENTION_MONTHS):
+        month = _bucket_start(month - timedelta(days=1), 'month')
+    return {'week': week, 'month': month}
+
+
+WINDOWS = ('week', 'month', '30d')
+
+
+def window_bounds(window, today=None):
+    """First and last day (inclusive) of the window ending `today`"""
+    today = today or timezone.localdate()
+    if window == '30d':
+        return today - timedelta(days=29), today
+    return _bucket_start(today, window), today
+
+
+def windowed_leaderboard(window, limit, today=None):
+    """
+    The top `limit` users of a window as LeaderboardPeriod rows.
+
+    `week` and `month` read the current bucket through its index. The rolling
+    `30d` window merges at most 30 daily rollups per user and type in one
+    grouped query and returns unsaved rows; neither touches the activities.
+    """
+    start, end = window_bounds(window, today)
+    if window in LeaderboardPeriod.PERIODS:
+        buckets = LeaderboardPeriod.objects.filter(period=window, start=start, total_activities__gt=0)
+        return start, end, list(buckets.order_by('-total_calories', 'id')[:limit])
+
+    grouped = ActivityDailyRollup.objects.filter(day__gte=start, day__lte=end).order_by().values('user_id').annotate(
+        **{field: Sum(field) for field in TOTAL_FIELDS}
+    )
+    rows = heapq.nsmallest(
+        limit, (row for row in grouped if row['total_activities'] > 0),
+        key=lambda row: (-row['total_calories'], row['user_id'])
+    )
+    for row in rows:
+        row['total_distance'] = round(row['total_distance'], 2)
+    return start, end, [LeaderboardPeriod(period=window, start=start, **row) for row in rows]
+
+
+def rebuild_leaderboard_periods(chunk_size=2000):
+    """Recompute the retained weekly and monthly buckets from the daily rollups"""
+    cutoffs = period_cutoffs()
+    buckets = defaultdict(_new_delta)
+    rollups = ActivityDailyRollup.objects.filter(day__gte=min(cutoffs.values()))
+    for row in rollups.values('user_id', 'day', *TOTAL_FIELDS).iterator(chunk_size=chunk_size):
+        user_id, day = row.pop('user_id'), row.pop('day')
+        for period in LeaderboardPeriod.PERIODS:
+            start = _bucket_start(day, period)
+            if start >= cutoffs[period]:
+                _merge(buckets[(user_id, period, start)], row)
+    truncate(LeaderboardPeriod)
+    LeaderboardPeriod.objects.bulk_create([
+        LeaderboardPeriod(user_id=user_id, period=period, start=start, **delta)
+        for (user_id, period, start), delta in buckets.items()
+    ], batch_size=chunk_size)
+    response_cache.bump('leaderboard')
+
+
+def expire_leaderboard_periods(today=None):
+    """Delete buckets older than the retention settings; returns how many were removed"""
+    expired = 0
+    for period, cutoff in period_cutoffs(today).items():
+        expired += raw_delete(LeaderboardPeriod.objects.filter(period=period, start__lt=cutoff))
+    if expired:
+        response_cache.bump('leaderboard')
+    return expired
+
+
+def activity_stats(user_id, start, end, bucket='day', activity_type=None):
+    """
+    Per-bucket totals for one user between two dates (inclusive).
+
+    Reads only the daily rollups, so the cost grows with the number of days in
+    the range rather than with the number of activities.
+    """
+    rollups = ActivityDailyRollup.objects.filter(user_id=str(user_id), day__gte=start, day__lte=end)
+    if activity_type:
+        rollups = rollups.filter(activity_type=activity_type)
+    buckets = defaultdict(_new_delta)
+    for row in rollups.values('day', *TOTAL_FIELDS):
+        delta = buckets[_bucket_start(row.pop('day'), bucket)]
+        for field, value in row.items():
+            delta[field] += value
+    results = []
+    for period, delta in sorted(buckets.items()):
+        if delta['total_activities']:
+            delta['total_distance'] = round(delta['total_distance'], 2)
+            results.append({'period': period, **delta})
+    return results
+
+
+def _adjust_member_count(team_id, amount):
+    if team_id and str(team_id).isdigit():
+        _update_counters(Team, {'id': team_id}, {'member_count': amount})
+
+
+def move_member(previous_team_id, team_id, user_id=None):
+    """
+    Move one user between teams; either side may be empty.
+
+    Adjusts both teams' member counters and, when `user_id` is given, moves
+    the user's leaderboard totals from the old team aggregate to the new one.
+    """
+    if previous_team_id == team_id:
+        return
+    _adjust_member_count(previous_team_id, -1)
+    _adjust_member_count(team_id, 1)
+    entry = Leaderboard.objects.filter(user_id=str(user_id)).first() if user_id is not None else None
+    if entry is not None:
+        totals = {field: getattr(entry, field) for field in TOTAL_FIELDS}
+        if entry.team_id:
+            _increment(TeamLeaderboard, {'team_id': entry.team_id}, {k: -v for k, v in totals.items()})
+        if team_id:
+            _increment(TeamLeaderboard, {'team_id': team_id}, totals)
+        Leaderboard.objects.filter(id=entry.id).update(team_id=team_id or '', updated_at=timezone.now())
+        response_cache.bump('leaderboard')
+    response_cache.bump('teams')
+
+
+def disband_team(team_id):
+    """Drop a deleted team's aggregate and detach its members and their leaderboard entries"""
+    team_id = str(team_id)
+    now = timezone.now()
+    TeamLeaderboard.objects.filter(team_id=team_id).delete()
+    User.objects.filter(team_id=team_id).update(team_id='', updated_at=now)
+    Leaderboard.objects.filter(team_id=team_id).update(team_id='', updated_at=now)
+    response_cache.bump('leaderboard', 'teams')
+
+
+def reconcile_member_counts(dry_run=False):
+    """
+    Recount team members with one grouped query and fix drifted counters.
+
+    Returns a list of (team, stored_count, actual_count) for every team that
+    had drifted.
+    """
+    actual = dict(
+        User.objects.exclude(team_id=None).values_list('team_id').annotate(members=Count('id'))
+    )
+    drifted = []
+    for team in Team.objects.only('id', 'name', 'member_count'):
+        members = actual.get(str(team.id), 0)
+        if team.member_count != members:
+            drifted.append((team, team.member_count, members))
+            if not dry_run:
+                Team.objects.filter(id=team.id).update(member_count=members, updated_at=timezone.now())
+    if drifted and not dry_run:
+        response_cache.bump('teams')
+    return drifted
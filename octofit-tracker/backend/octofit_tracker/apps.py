@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class OctofitTrackerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'octofit_tracker'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from pymongo import monitoring
+        from . import signals  # noqa: F401
+        from .instrumentation import instrument_connection
+        from .mongo import pool_stats
+        connection_created.connect(instrument_connection)
+        # Before any MongoClient exists, so every pool in the process reports to it
+        monitoring.register(pool_stats)
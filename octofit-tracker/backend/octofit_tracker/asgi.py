@@ -2,6 +2,11 @@
 ASGI config for octofit_tracker project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Serve it with an ASGI server so the async /api/async/ views run on the event
+loop instead of a thread per request, and so /api/leaderboard/events/ (live
+rank changes over Server-Sent Events, see events.py) is available at all:
+
+    uvicorn octofit_tracker.asgi:application --host 0.0.0.0 --port 8000 --workers 4
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.1/howto/deployment/asgi/
@@ -13,4 +18,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from octofit_tracker.events import sse_router  # noqa: E402
+from octofit_tracker.mongo import startup_probe  # noqa: E402
+
+# Ping MongoDB once per worker, see OCTOFIT_MONGO_STARTUP_PROBE
+startup_probe()
+
+# The SSE stream is a raw ASGI route in front of Django
+application = sse_router(django_application)
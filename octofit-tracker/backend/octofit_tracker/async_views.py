@@ -0,0 +1,193 @@
+"""
+Async read-only endpoints for activities, leaderboard and workouts.
+
+Served under /api/async/ with the same representations as the DRF viewsets.
+Documents are read off the ORM through `mongo.py` and rendered by the existing
+serializers, which get the user/team names and ranks through their context
+instead of querying the ORM. Run the project under an ASGI server, e.g.
+
+    uvicorn octofit_tracker.asgi:application --workers 4
+
+Lists are paginated forward-only with a keyset cursor over the same orderings
+as the DRF cursor pagination; `?page_size=` is capped by OCTOFIT_MAX_PAGE_SIZE.
+"""
+import base64
+import json
+from datetime import datetime
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from . import filters, mongo
+from .models import Activity, Leaderboard, Workout
+from .ranking import leaderboard_ranks
+from .serializers import ActivitySerializer, LeaderboardSerializer, WorkoutSerializer
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _json(data, status=200):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get('page_size', api_settings.PAGE_SIZE))
+    except ValueError:
+        raise _BadRequest({'page_size': 'Must be an integer.'})
+    return max(1, min(size, settings.OCTOFIT_MAX_PAGE_SIZE))
+
+
+def _encode_cursor(values):
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(request):
+    token = request.GET.get('cursor')
+    if not token:
+        return None
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        cursor = None
+    if not isinstance(cursor, list):
+        raise _BadRequest({'cursor': 'Invalid cursor.'})
+    return cursor
+
+
+async def _get(model, pk):
+    doc = await mongo.find_one(model._meta.db_table, {'id': pk}, mongo.fields_of(model))
+    return None if doc is None else model(**doc)
+
+
+async def _names(collection, ids):
+    pks = [int(value) for value in ids if value and str(value).isdigit()]
+    if not pks:
+        return {}
+    docs = await mongo.find(collection, {'id': {'$in': pks}}, {'_id': 0, 'id': 1, 'name': 1}, [('id', 1)], len(pks))
+    return {str(doc['id']): doc['name'] for doc in docs}
+
+
+async def _page(request, model, sort, cursor_fields, after, query=None):
+    """One keyset page; `after(cursor)` is the filter for rows past the decoded cursor"""
+    size = _page_size(request)
+    cursor = _decode_cursor(request)
+    query = dict(query or {})
+    if cursor:
+        try:
+            query.update(after(cursor))
+        except (TypeError, ValueError):
+            raise _BadRequest({'cursor': 'Invalid cursor.'})
+    docs = await mongo.find(
+        model._meta.db_table, query, mongo.fields_of(model), sort, size + 1,
+        read_preference=settings.OCTOFIT_MONGO_LIST_READ_PREFERENCE
+    )
+    next_url = None
+    if len(docs) > size:
+        docs = docs[:size]
+        token = _encode_cursor([docs[-1][field] for field in cursor_fields])
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', token)
+    return [model(**doc) for doc in docs], next_url
+
+
+def _paginated(results, next_url):
+    return {'next': next_url, 'previous': None, 'results': results}
+
+
+def _handle_bad_request(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except _BadRequest as error:
+            return _json(error.args[0], status=400)
+        except ValidationError as error:
+            return _json(error.detail, status=400)
+    return wrapper
+
+
+def _not_found():
+    return _json({'detail': 'Not found.'}, status=404)
+
+
+@_handle_bad_request
+async def activity_list(request):
+    """Activities, newest first; `?user_id=` filters to one user"""
+    query = {'user_id': request.GET['user_id']} if request.GET.get('user_id') else {}
+
+    def after(cursor):
+        date, pk = datetime.fromisoformat(cursor[0]), cursor[1]
+        return {'$or': [{'date': {'$lt': date}}, {'date': date, 'id': {'$lt': pk}}]}
+
+    activities, next_url = await _page(request, Activity, [('date', -1), ('id', -1)], ('date', 'id'), after, query)
+    names = {'users': await _names('users', {activity.user_id for activity in activities})}
+    data = ActivitySerializer(activities, many=True, context={'request': request, 'identity_names': names}).data
+    return _json(_paginated(data, next_url))
+
+
+@_handle_bad_request
+async def activity_detail(request, pk):
+    activity = await _get(Activity, pk)
+    if activity is None:
+        return _not_found()
+    names = {'users': await _names('users', [activity.user_id])}
+    return _json(ActivitySerializer(activity, context={'request': request, 'identity_names': names}).data)
+
+
+async def _leaderboard_context(request, entries, metric):
+    names = {
+        'users': await _names('users', {entry.user_id for entry in entries}),
+        'teams': await _names('teams', {entry.team_id for entry in entries}),
+    }
+    # The rank index lives in this process; it may reload through the ORM
+    ranks = await sync_to_async(
+        lambda: {entry.user_id: leaderboard_ranks.rank_of(entry, metric) for entry in entries}
+    )()
+    return {'request': request, 'identity_names': names, 'ranks': ranks, 'sort_by': metric}
+
+
+@_handle_bad_request
+async def leaderboard_list(request):
+    """Leaderboard entries by `?sort_by=` (default total calories), highest first"""
+    metric = filters.sort_metric(request.GET, Leaderboard.METRICS)
+
+    def after(cursor):
+        score, pk = cursor
+        return {'$or': [{metric: {'$lt': score}}, {metric: score, 'id': {'$gt': pk}}]}
+
+    entries, next_url = await _page(request, Leaderboard, [(metric, -1), ('id', 1)], (metric, 'id'), after)
+    context = await _leaderboard_context(request, entries, metric)
+    return _json(_paginated(LeaderboardSerializer(entries, many=True, context=context).data, next_url))
+
+
+@_handle_bad_request
+async def leaderboard_detail(request, pk):
+    entry = await _get(Leaderboard, pk)
+    if entry is None:
+        return _not_found()
+    context = await _leaderboard_context(request, [entry], filters.sort_metric(request.GET, Leaderboard.METRICS))
+    return _json(LeaderboardSerializer(entry, context=context).data)
+
+
+@_handle_bad_request
+async def workout_list(request):
+    """Workouts, newest first"""
+    workouts, next_url = await _page(request, Workout, [('id', -1)], ('id',), lambda cursor: {'id': {'$lt': cursor[0]}})
+    return _json(_paginated(WorkoutSerializer(workouts, many=True, context={'request': request}).data, next_url))
+
+
+@_handle_bad_request
+async def workout_detail(request, pk):
+    workout = await _get(Workout, pk)
+    if workout is None:
+        return _not_found()
+    return _json(WorkoutSerializer(workout, context={'request': request}).data)
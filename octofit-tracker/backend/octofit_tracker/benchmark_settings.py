@@ -0,0 +1,22 @@
+"""
+Settings overlay for running the API benchmarks offline against SQLite.
+
+    python manage.py benchmark_api --settings=octofit_tracker.benchmark_settings
+
+The schema is created straight from the models, so no MongoDB server is
+needed. Set OCTOFIT_BENCHMARK_DB to a file path to inspect the last seeded
+dataset after a run.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import os
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('OCTOFIT_BENCHMARK_DB', ':memory:'),
+    }
+}
+
+MIGRATION_MODULES = {'octofit_tracker': None}
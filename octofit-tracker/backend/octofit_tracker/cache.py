@@ -0,0 +1,191 @@
+"""
+Versioned read-through cache for list responses.
+
+Every cached scope ("leaderboard", "teams") has a version counter. Writes that
+affect a scope bump its version instead of deleting keys, so all pages cached
+under the old version simply stop being read and age out of the backend.
+
+The version is also folded into the response ETag, which lets clients
+revalidate with If-None-Match and receive a 304 without the server touching
+the database at all.
+
+Backends are configured with OCTOFIT_RESPONSE_CACHE:
+
+    {'BACKEND': 'lru', 'MAX_ENTRIES': 256, 'TIMEOUT': 300}   # per-process (default)
+    {'BACKEND': 'django', 'ALIAS': 'default'}                # shared Django cache
+    {'BACKEND': None}                                        # disabled
+
+The in-process LRU only sees version bumps made by its own process, so its
+versions also roll over every TIMEOUT seconds: with several workers a write
+shows up in the other workers' responses and ETags within TIMEOUT. Use the
+Django backend (e.g. Redis or memcached) for immediate invalidation across
+workers.
+
+Keys include the absolute request URI, since cached pages carry absolute
+`next`/`previous` links.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class LRUBackend:
+    """Bounded in-process cache; version counters are kept outside the LRU"""
+
+    def __init__(self, max_entries=256, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                return None
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, scope):
+        with self._lock:
+            counter = self._versions.get(scope, 0)
+        if not self.timeout:
+            return counter
+        # Bumps in other processes are invisible here; expire with the clock instead
+        return f'{counter}.{int(time.time() // self.timeout)}'
+
+    def bump(self, scope):
+        with self._lock:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class DjangoCacheBackend:
+    """Shared cache through a configured Django cache alias"""
+
+    def __init__(self, alias='default', timeout=300):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def _version_key(self, scope):
+        return f'octofit:version:{scope}'
+
+    def version(self, scope):
+        key = self._version_key(scope)
+        # Seed missing counters with the clock so an evicted counter can never
+        # fall back to a value whose pages are still cached
+        self.cache.add(key, time.time_ns(), None)
+        return self.cache.get(key)
+
+    def bump(self, scope):
+        key = self._version_key(scope)
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.add(key, time.time_ns(), None)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class ResponseCache:
+    """Builds the configured backend lazily and rebuilds it when settings change"""
+
+    def __init__(self):
+        self._config = None
+        self._backend = None
+
+    @property
+    def backend(self):
+        config = getattr(settings, 'OCTOFIT_RESPONSE_CACHE', {'BACKEND': 'lru'})
+        if config is not self._config:
+            self._config = config
+            kind = config.get('BACKEND')
+            if kind == 'lru':
+                self._backend = LRUBackend(config.get('MAX_ENTRIES', 256), config.get('TIMEOUT', 300))
+            elif kind == 'django':
+                self._backend = DjangoCacheBackend(config.get('ALIAS', 'default'), config.get('TIMEOUT', 300))
+            else:
+                self._backend = None
+        return self._backend
+
+    def bump(self, *scopes):
+        backend = self.backend
+        if backend is not None:
+            for scope in scopes:
+                backend.bump(scope)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def _etag_matches(header, etag):
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    return '*' in candidates or etag in candidates
+
+
+class CachedListMixin:
+    """
+    Serves `list` from the response cache, keyed by scope version and URL.
+
+    Serialized data (not rendered bytes) is cached, so content negotiation
+    still happens per request.
+    """
+    cache_scope = None
+
+    def uncached_list(self, request, *args, **kwargs):
+        """Builds the response on a cache miss; override to vary the list"""
+        return super().list(request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        backend = response_cache.backend
+        if backend is None:
+            return self.uncached_list(request, *args, **kwargs)
+
+        version = backend.version(self.cache_scope)
+        uri = request.build_absolute_uri()
+        digest = hashlib.sha1(f'{version}:{request.accepted_media_type}:{uri}'.encode()).hexdigest()
+        etag = f'W/"{self.cache_scope}-{digest}"'
+        if _etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        key = f'octofit:{self.cache_scope}:{version}:{uri}'
+        data = backend.get(key)
+        if data is not None:
+            return Response(data, headers={'ETag': etag})
+
+        response = self.uncached_list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            backend.set(key, response.data)
+            response['ETag'] = etag
+        return response
@@ -0,0 +1,290 @@
+"""
+Live leaderboard events over Server-Sent Events.
+
+Activity writes publish one compact `rank` event per user whose totals
+changed (see `_Changes.apply` in aggregates.py):
+
+    event: rank
+    data: {"user_id":"7","rank":3,"previous_rank":5,"total_calories":4200}
+
+`broadcaster` hands events to the configured pub/sub backend, which delivers
+them back to every process with subscribers; each process then fans them
+out to its own SSE connections. OCTOFIT_EVENTS picks the backend:
+
+    {'BACKEND': ''}                                       # 'memory' under sse_router, else 'off' (default)
+    {'BACKEND': 'memory'}                                 # this process only
+    {'BACKEND': 'redis', 'URL': 'redis://...', 'CHANNEL': 'octofit:events'}
+    {'BACKEND': 'myapp.events.Backend'}                   # any class with start/publish/stop
+    {'BACKEND': 'off'}                                    # publish nothing
+
+The in-memory backend only reaches clients of the worker that handled the
+write; use redis (redis-py) when running several workers. Writes only work
+out ranks for events when someone can receive them: with the in-memory
+backend, while this process has subscribers; with a backend whose `local`
+is False, always.
+
+`/api/leaderboard/events/` is served by `sse_router` in front of Django in
+asgi.py, since Django 4.1 cannot stream from async views. Every connection is
+an idle coroutine waiting on a small queue, so one worker holds thousands of
+them. Clients that fall OCTOFIT_SSE_QUEUE_SIZE events behind are disconnected
+and should reconnect (EventSource does so by itself) and refetch the list.
+"""
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+EVENTS_PATH = '/api/leaderboard/events/'
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class MemoryBackend:
+    """Delivers every published message straight back to this process"""
+    local = True
+
+    def __init__(self, **options):
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def publish(self, message):
+        if self._deliver is not None:
+            self._deliver(message)
+
+    def stop(self):
+        self._deliver = None
+
+
+class RedisBackend:
+    """Publishes to a Redis channel; a listener thread delivers what every process published"""
+    local = False
+
+    def __init__(self, URL='redis://localhost:6379/0', CHANNEL='octofit:events', **options):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("OCTOFIT_EVENTS BACKEND 'redis' needs the redis package")
+        self._client = redis.Redis.from_url(URL)
+        self._channel = CHANNEL
+        self._pubsub = None
+        self._listener = None
+
+    def start(self, deliver):
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(**{self._channel: lambda item: deliver(item['data'].decode())})
+        self._listener = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def publish(self, message):
+        self._client.publish(self._channel, message)
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+
+
+BACKENDS = {'memory': MemoryBackend, 'redis': RedisBackend}
+
+
+class Broadcaster:
+    """
+    Fans published events out to the SSE subscribers of this process.
+
+    Publishing is thread-safe and never blocks on subscribers: each event
+    loop with subscribers gets one call_soon_threadsafe per message, and the
+    loop then puts it on every subscriber's queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._config = None
+        self._backend = None
+        self._subscribers = {}  # event loop -> set of queues
+        self._mounted = False
+
+    def mount(self):
+        """Called by sse_router: a process that serves the stream defaults to the memory backend"""
+        with self._lock:
+            self._mounted = True
+            self._config = None
+
+    @property
+    def backend(self):
+        config = getattr(settings, 'OCTOFIT_EVENTS', {'BACKEND': ''})
+        if config is not self._config:
+            with self._lock:
+                if config is self._config:
+                    return self._backend
+                if self._backend is not None:
+                    self._backend.stop()
+                self._config = config
+                kind = config.get('BACKEND') or ('memory' if self._mounted else 'off')
+                options = {key: value for key, value in config.items() if key != 'BACKEND'}
+                if kind == 'off':
+                    self._backend = None
+                else:
+                    self._backend = (BACKENDS.get(kind) or import_string(kind))(**options)
+                    self._backend.start(self._deliver)
+        return self._backend
+
+    @property
+    def enabled(self):
+        return self.backend is not None
+
+    @property
+    def listening(self):
+        """Whether a published event can reach anyone, see the module docstring"""
+        backend = self.backend
+        if backend is None:
+            return False
+        return not getattr(backend, 'local', False) or self.subscriber_count() > 0
+
+    def publish(self, event, data):
+        backend = self.backend
+        if backend is not None:
+            backend.publish(format_event(event, data))
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self):
+        """A queue of formatted events for the running loop, or None when the process is full"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if sum(len(queues) for queues in self._subscribers.values()) >= settings.OCTOFIT_SSE_MAX_CLIENTS:
+                return None
+            queue = asyncio.Queue(maxsize=settings.OCTOFIT_SSE_QUEUE_SIZE)
+            self._subscribers.setdefault(loop, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            for loop, queues in list(self._subscribers.items()):
+                queues.discard(queue)
+                if not queues:
+                    del self._subscribers[loop]
+
+    def _deliver(self, message):
+        with self._lock:
+            loops = list(self._subscribers)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._fan_out, loop, message)
+            except RuntimeError:
+                # The loop is closed; its subscribers are gone
+                with self._lock:
+                    self._subscribers.pop(loop, None)
+
+    def _fan_out(self, loop, message):
+        with self._lock:
+            queues = list(self._subscribers.get(loop, ()))
+        for queue in queues:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too slow to keep up: drop the backlog and end the stream
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                self.unsubscribe(queue)
+
+
+broadcaster = Broadcaster()
+
+
+def publish_rank_changes(previous, current):
+    """One `rank` event per user whose calories total moved; both args map user_id -> (rank, score)"""
+    for user_id, (rank, score) in current.items():
+        previous_rank, previous_score = previous.get(user_id, (None, None))
+        if score is None or score == previous_score:
+            continue
+        broadcaster.publish('rank', {
+            'user_id': user_id, 'rank': rank, 'previous_rank': previous_rank, 'total_calories': score,
+        })
+
+
+def _cors_headers(scope):
+    origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+    if origin and (getattr(settings, 'CORS_ALLOW_ALL_ORIGINS', False) or origin in settings.CORS_ALLOWED_ORIGINS):
+        return [(b'access-control-allow-origin', origin.encode('latin-1')), (b'vary', b'origin')]
+    return []
+
+
+async def _plain(send, status, body, headers=()):
+    await send({
+        'type': 'http.response.start', 'status': status,
+        'headers': [(b'content-type', b'text/plain'), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def leaderboard_events(scope, receive, send):
+    """The SSE stream: rank events plus a comment line every OCTOFIT_SSE_HEARTBEAT_SECONDS"""
+    if scope['method'] != 'GET':
+        return await _plain(send, 405, b'Method not allowed', [(b'allow', b'GET')])
+    if not broadcaster.enabled:
+        return await _plain(send, 404, b'Live events are disabled')
+    queue = broadcaster.subscribe()
+    if queue is None:
+        return await _plain(send, 503, b'Too many live connections', [(b'retry-after', b'30')])
+
+    disconnected = asyncio.ensure_future(_disconnected(receive))
+    try:
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),  # no proxy buffering (nginx)
+                *_cors_headers(scope),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+        while True:
+            message = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {message, disconnected}, timeout=settings.OCTOFIT_SSE_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if message not in done:
+                message.cancel()
+                if disconnected in done:
+                    break
+                chunk = b': keep-alive\n\n'
+            elif message.result() is None:
+                break
+            else:
+                chunk = message.result().encode()
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        if not disconnected.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        broadcaster.unsubscribe(queue)
+        disconnected.cancel()
+
+
+def sse_router(django_application):
+    """ASGI application serving EVENTS_PATH itself and everything else through Django"""
+    broadcaster.mount()
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+            return await leaderboard_events(scope, receive, send)
+        return await django_application(scope, receive, send)
+    return application
@@ -0,0 +1,43 @@
+"""
+Streaming exports.
+
+Rows are read with `QuerySet.iterator(chunk_size=...)` and serialized one
+chunk at a time, so an export holds at most one chunk in memory no matter how
+many rows it covers. The list serializer still resolves user/team names once
+per chunk.
+"""
+import csv
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def serialize_in_chunks(queryset, make_serializer, chunk_size):
+    """Yield serialized rows, serializing `chunk_size` instances at a time"""
+    chunk = []
+    for instance in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(instance)
+        if len(chunk) >= chunk_size:
+            yield from make_serializer(chunk).data
+            chunk = []
+    if chunk:
+        yield from make_serializer(chunk).data
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=JSONEncoder) + '\n'
+
+
+class _Echo:
+    """File-like object whose write() returns the value instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fields):
+    writer = csv.DictWriter(_Echo(), fieldnames=fields, extrasaction='ignore')
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
@@ -0,0 +1,149 @@
+"""
+Server-side list filters that always run as indexed queries.
+
+Viewsets declare `index_filters`, a mapping of query parameter to `Filter`.
+A filter with an `index` can select rows through that index on its own; one
+without only narrows rows an indexed filter has already selected. Requests
+that use unindexed filters alone, or filter on a model field that has no
+declared filter, are rejected with a 400 instead of scanning the collection.
+A range filter's index is ordered by its field, so `sorted_by` marks it as
+indexed only while the list is sorted by that field too.
+
+    index_filters = {
+        'user_id': Filter(exact('user_id'), index='activity_user_date_idx'),
+        'min_calories': Filter(at_least('calories_burned')),
+    }
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .models import User
+
+
+class Filter:
+    """One query parameter; `parse` turns its value into ORM lookups or raises ValueError"""
+
+    def __init__(self, parse, index=None, sorted_by=None):
+        self.parse = parse
+        self.index = index
+        self.sorted_by = sorted_by
+
+    def indexed(self, queryset):
+        if self.index is None:
+            return False
+        if self.sorted_by is None:
+            return True
+        ordering = queryset.query.order_by
+        return bool(ordering) and ordering[0].lstrip('-') == self.sorted_by
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _date(value):
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError('Must be a date in YYYY-MM-DD format.')
+    return parsed
+
+
+def exact(field):
+    return lambda value: {field: value}
+
+
+def date_from(field):
+    """On or after the start of the given day"""
+    return lambda value: {f'{field}__gte': start_of_day(_date(value))}
+
+
+def date_until(field):
+    """Up to the end of the given day, inclusive"""
+    return lambda value: {f'{field}__lt': start_of_day(_date(value) + timedelta(days=1))}
+
+
+def at_least(field):
+    def parse(value):
+        try:
+            return {f'{field}__gte': int(value)}
+        except ValueError:
+            raise ValueError('Must be an integer.')
+    return parse
+
+
+def team_members(field):
+    """A team as the set of its members' ids, fetched once through user_team_idx"""
+    def parse(value):
+        member_ids = User.objects.filter(team_id=value).values_list('id', flat=True)
+        return {f'{field}__in': [str(pk) for pk in member_ids]}
+    return parse
+
+
+def filter_queryset(queryset, params, filters):
+    """
+    Apply the filters named in `params` to `queryset`.
+
+    Empty values are ignored. Raises ValidationError, keyed by parameter, for
+    invalid values, undeclared filters on model fields and combinations that
+    no index can serve.
+    """
+    model_fields = {field.name for field in queryset.model._meta.concrete_fields}
+    requested, lookups, errors = [], {}, {}
+    for param, value in params.items():
+        if param not in filters:
+            if param.split('__')[0] in model_fields:
+                errors[param] = 'Filtering on this field is not supported.'
+            continue
+        if not value:
+            continue
+        requested.append(param)
+        try:
+            lookups.update(filters[param].parse(value))
+        except ValueError as error:
+            errors[param] = str(error)
+
+    if requested and not any(filters[param].indexed(queryset) for param in requested):
+        indexed = ', '.join(param for param, declared in filters.items() if declared.indexed(queryset))
+        for param in requested:
+            errors.setdefault(param, f'Must be combined with one of: {indexed}.')
+    if errors:
+        raise ValidationError(errors)
+    return queryset.filter(**lookups)
+
+
+def sort_metric(params, metrics):
+    """The `?sort_by=` metric, defaulting to the first of `metrics`"""
+    metric = params.get('sort_by') or metrics[0]
+    if metric not in metrics:
+        raise ValidationError({'sort_by': f"Must be one of: {', '.join(metrics)}."})
+    return metric
+
+
+class MetricOrderingBackend:
+    """
+    Orders a list by the view's `get_sort_metric()`, highest first, ties by id.
+
+    Cursor pagination takes its ordering from here. List it before
+    IndexedFilterBackend, which checks range filters against the ordering.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        return (f'-{view.get_sort_metric()}', 'id')
+
+    def filter_queryset(self, request, queryset, view):
+        return queryset.order_by(*self.get_ordering(request, queryset, view))
+
+
+class IndexedFilterBackend:
+    """DRF filter backend applying the view's `index_filters` to list requests"""
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'detail', False):
+            return queryset
+        return filter_queryset(queryset, request.query_params, getattr(view, 'index_filters', {}))
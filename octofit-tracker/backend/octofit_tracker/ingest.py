@@ -0,0 +1,160 @@
+"""
+Write-behind ingestion for single activity creates.
+
+With OCTOFIT_WRITE_BEHIND on, `POST /api/activities/` validates the activity,
+puts it on a bounded in-process queue and answers 202 Accepted right away. A
+flusher thread writes the queue with bulk_create, a batch whenever
+OCTOFIT_WRITE_BEHIND_BATCH_SIZE activities are waiting or
+OCTOFIT_WRITE_BEHIND_FLUSH_MS after the first one arrived, and applies each
+batch to the derived totals once per user (`aggregates.record_activities`).
+
+When OCTOFIT_WRITE_BEHIND_QUEUE_SIZE activities are waiting, creates get a 503
+with Retry-After instead of growing the queue. At interpreter exit the queue is
+drained; activities still queued when a worker is killed outright, or in a
+batch the database rejects (logged and counted), are lost. Accepted
+activities show up in lists and totals after the next flush, and the 202
+response carries no id.
+
+Queue depth, flush latency and batch sizes are part of `/api/_metrics/`.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import aggregates
+from .instrumentation import DURATION_BUCKETS, Histogram
+from .models import Activity
+
+logger = logging.getLogger(__name__)
+
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 5000)
+# How often an idle flusher checks for shutdown, and how long exit waits for the drain
+POLL_SECONDS = 0.5
+DRAIN_TIMEOUT_SECONDS = 30
+RETRY_AFTER_SECONDS = 1
+
+
+class WriteBehindBuffer:
+    """A bounded queue of unsaved activities and the thread that writes them in batches"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._flusher = None
+        self._stopping = threading.Event()
+        self.flush_seconds = Histogram(DURATION_BUCKETS)
+        self.batch_sizes = Histogram(BATCH_BUCKETS)
+        self.flushed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, activity):
+        """Queue an unsaved activity; False when the buffer is full or shutting down"""
+        if self._stopping.is_set():
+            return False
+        self._ensure_flusher()
+        try:
+            self._queue.put_nowait(activity)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._queue = queue.Queue(maxsize=settings.OCTOFIT_WRITE_BEHIND_QUEUE_SIZE)
+            self._flusher = threading.Thread(target=self._run, name='octofit-write-behind', daemon=True)
+            self._flusher.start()
+            atexit.register(self.drain)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self.flush(batch)
+        close_old_connections()
+
+    def _take_batch(self):
+        """Up to a batch of activities, waiting at most the flush interval after the first"""
+        try:
+            batch = [self._queue.get(timeout=POLL_SECONDS)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + settings.OCTOFIT_WRITE_BEHIND_FLUSH_MS / 1000
+        while len(batch) < settings.OCTOFIT_WRITE_BEHIND_BATCH_SIZE:
+            remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                # Past the deadline, still take whatever is already queued
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def flush(self, batch):
+        """Insert a batch and update the derived totals once per user"""
+        start = time.perf_counter()
+        try:
+            Activity.objects.bulk_create(batch)
+            aggregates.record_activities(batch)
+        except Exception:
+            logger.exception('Write-behind flush of %d activities failed', len(batch))
+            failed = True
+        else:
+            failed = False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            if failed:
+                self.failed += len(batch)
+            else:
+                self.flushed += len(batch)
+            self.flush_seconds.observe(elapsed)
+            self.batch_sizes.observe(len(batch))
+
+    def drain(self, timeout=DRAIN_TIMEOUT_SECONDS):
+        """Stop accepting activities and wait for the queued ones to be written"""
+        self._stopping.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout)
+
+    def render(self):
+        """Prometheus text lines; empty unless write-behind is on"""
+        if not settings.OCTOFIT_WRITE_BEHIND:
+            return ''
+        lines = [
+            '# HELP octofit_write_behind_queue_depth Activities waiting to be written',
+            '# TYPE octofit_write_behind_queue_depth gauge',
+            f'octofit_write_behind_queue_depth {self.depth()}',
+        ]
+        with self._lock:
+            for name, help_text, value in (
+                ('flushed', 'Activities written by the flusher', self.flushed),
+                ('failed', 'Activities lost to failed flushes', self.failed),
+                ('rejected', 'Creates refused because the queue was full', self.rejected),
+            ):
+                lines.append(f'# HELP octofit_write_behind_{name}_total {help_text}')
+                lines.append(f'# TYPE octofit_write_behind_{name}_total counter')
+                lines.append(f'octofit_write_behind_{name}_total {value}')
+            for name, help_text, histogram in (
+                ('octofit_write_behind_flush_duration_seconds', 'Time to write one batch', self.flush_seconds),
+                ('octofit_write_behind_batch_size', 'Activities per flushed batch', self.batch_sizes),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                lines.extend(histogram.render(name))
+        return '\n'.join(lines) + '\n'
+
+
+write_behind = WriteBehindBuffer()
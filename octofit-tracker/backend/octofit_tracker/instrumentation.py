@@ -0,0 +1,242 @@
+"""
+Per-request performance instrumentation.
+
+`PerformanceMiddleware` measures every request's wall time, the number and
+duration of database round-trips (through an execute wrapper installed on
+every connection, so djongo's translated queries are included) and the time
+spent in serializer `to_representation`. Each response carries the numbers
+in a `Server-Timing` header, and they are aggregated per route name (`user-list`,
+`activity-list`, ...) into histograms served by `/api/_metrics/` in the
+Prometheus text format.
+
+Under ASGI the middleware runs natively async. The async views query MongoDB
+with a plain pymongo client on a thread pool (see mongo.py), bypassing the
+ORM and its execute wrapper; `mongo._run` wraps each of those round-trips in
+`timed_query` so they are counted as well.
+
+Streaming responses are measured up to the point the body starts streaming.
+Aggregates are per process; scrape every worker, as Prometheus does with
+one target per process.
+"""
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpResponse
+
+# Prometheus' default latency buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class RequestTimings:
+    """Counters for the request being handled"""
+
+    def __init__(self):
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self._depth = 0
+
+    @contextmanager
+    def query(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.db_queries += 1
+            self.db_seconds += time.perf_counter() - start
+
+
+_current = ContextVar('octofit_request_timings', default=None)
+
+
+@contextmanager
+def timed_query():
+    """Count a database round-trip for the current request, if there is one"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.query():
+        yield
+
+
+def _count_query(execute, sql, params, many, context):
+    with timed_query():
+        return execute(sql, params, many, context)
+
+
+def instrument_connection(connection, **kwargs):
+    """
+    Install the query counter on a database connection; idempotent.
+
+    Connected to `connection_created`. The request's timings travel in a
+    context variable, which asgiref copies into sync_to_async threads, so
+    queries of sync views served under ASGI are counted as well.
+    """
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+@contextmanager
+def timed_serialization():
+    """Add the enclosed time to the current request; nested serializers count once"""
+    timings = _current.get()
+    if timings is None or timings._depth:
+        yield
+        return
+    timings._depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings._depth -= 1
+        timings.serialize_seconds += time.perf_counter() - start
+
+
+class TimedRepresentationMixin:
+    """Serializer mixin that reports `to_representation` time to the middleware"""
+
+    def to_representation(self, instance):
+        with timed_serialization():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, name, labels=''):
+        """Bucket, sum and count lines; `labels` like 'route="x"'"""
+        prefix = f'{labels},' if labels else ''
+        suffix = f'{{{labels}}}' if labels else ''
+        lines = [f'{name}_bucket{{{prefix}le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{suffix} {self.sum:.6f}')
+        lines.append(f'{name}_count{suffix} {self.count}')
+        return lines
+
+
+# (name, help, bucket bounds, RequestTimings -> observed value)
+SERIES = (
+    ('octofit_request_duration_seconds', 'Request wall time', DURATION_BUCKETS, None),
+    ('octofit_db_duration_seconds', 'Time spent in database round-trips per request', DURATION_BUCKETS,
+     lambda timings: timings.db_seconds),
+    ('octofit_db_queries', 'Database round-trips per request', QUERY_BUCKETS,
+     lambda timings: timings.db_queries),
+    ('octofit_serialize_duration_seconds', 'Time spent serializing per request', DURATION_BUCKETS,
+     lambda timings: timings.serialize_seconds),
+)
+
+
+class RouteMetrics:
+    """Process-wide histograms keyed by (series, route)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, route, wall_seconds, timings):
+        with self._lock:
+            for name, _, buckets, value in SERIES:
+                histogram = self._histograms.get((name, route))
+                if histogram is None:
+                    histogram = self._histograms[(name, route)] = Histogram(buckets)
+                histogram.observe(wall_seconds if value is None else value(timings))
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """All series in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for name, help_text, _, _ in SERIES:
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} histogram')
+                for (series, route), histogram in sorted(self._histograms.items()):
+                    if series != name:
+                        continue
+                    lines.extend(histogram.render(name, f'route="{route}"'))
+        return '\n'.join(lines) + '\n'
+
+
+route_metrics = RouteMetrics()
+
+
+def _route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name if match else None) or 'unmatched'
+
+
+class PerformanceMiddleware:
+    """Times each request and publishes Server-Timing and per-route histograms"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'OCTOFIT_REQUEST_METRICS', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Mark the instance as a coroutine function, as Django's MiddlewareMixin does
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        for connection in connections.all():
+            instrument_connection(connection)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, time.perf_counter() - start, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, time.perf_counter() - start, timings)
+
+    def finish(self, request, response, wall, timings):
+        route_metrics.observe(_route_name(request), wall, timings)
+        response['Server-Timing'] = ', '.join([
+            f'total;dur={wall * 1000:.1f}',
+            f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.db_queries} queries"',
+            f'serialize;dur={timings.serialize_seconds * 1000:.1f}',
+        ])
+        return response
+
+
+def metrics_view(request):
+    """Aggregated request and write-behind metrics for Prometheus to scrape"""
+    from .ingest import write_behind  # ingest builds on this module
+    return HttpResponse(
+        route_metrics.render() + write_behind.render(), content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
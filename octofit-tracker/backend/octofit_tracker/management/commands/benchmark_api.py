@@ -0,0 +1,201 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from octofit_tracker.models import Activity, Leaderboard, Team
+from octofit_tracker.ranking import leaderboard_ranks
+
+ACTIVITIES_PER_USER = 20
+
+# (route name, model whose middle row is fetched by detail routes)
+ENDPOINTS = [
+    ('activity-list', None),
+    ('activity-detail', Activity),
+    ('leaderboard-list', None),
+    ('leaderboard-detail', Leaderboard),
+    ('team-list', None),
+    ('team-detail', Team),
+]
+
+
+def _percentile(samples, percent):
+    return statistics.quantiles(samples, n=100, method='inclusive')[percent - 1] if len(samples) > 1 else samples[0]
+
+
+class _QueryCounter:
+    """Counts database round-trips; connection.queries is reset by every request"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed datasets of increasing size and measure latency percentiles, query counts and '
+        'peak memory of the API list/detail endpoints. Deletes all existing data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+            help='Dataset sizes, in activities'
+        )
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint')
+        parser.add_argument('--seed', type=int, default=800, help='Random seed for the seeded datasets')
+        parser.add_argument(
+            '--with-cache', action='store_true',
+            help='Keep the response cache enabled (lists are then measured as cache hits)'
+        )
+        parser.add_argument('--output', help='Where to write the JSON results')
+        parser.add_argument('--baseline', help='Results file of an earlier run to compare against')
+        parser.add_argument(
+            '--threshold', type=float, default=20.0,
+            help='Percent p90 slowdown against --baseline that counts as a regression'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Allow running against a non-SQLite database (its data is deleted)'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' and not options['force']:
+            raise CommandError(
+                'Benchmarks delete all data; use --settings=octofit_tracker.benchmark_settings '
+                'or pass --force to run against this database.'
+            )
+        if Activity._meta.db_table not in connection.introspection.table_names():
+            call_command('migrate', run_syncdb=True, interactive=False, verbosity=0)
+
+        overrides = {'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver']}
+        if not options['with_cache']:
+            overrides['OCTOFIT_RESPONSE_CACHE'] = {'BACKEND': None}
+
+        results = {}
+        with override_settings(**overrides):
+            for size in options['sizes']:
+                self.seed(size, options['seed'])
+                results[str(size)] = self.measure(options['iterations'], options['warmup'])
+                self.report(size, results[str(size)])
+
+        report = {
+            'commit': _git_commit(),
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'response_cache': options['with_cache'],
+            'results': results,
+        }
+        output = Path(options['output'] or f"benchmark-{(report['commit'] or 'local')[:12]}.json")
+        output.write_text(json.dumps(report, indent=2) + '\n')
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+        if options['baseline']:
+            self.compare(json.loads(Path(options['baseline']).read_text()), report, options['threshold'])
+
+    def seed(self, size, seed):
+        users = max(1, size // ACTIVITIES_PER_USER)
+        self.stdout.write(f'Seeding {users * ACTIVITIES_PER_USER} activities ({users} users)...')
+        call_command(
+            'populate_db', users=users, activities_per_user=ACTIVITIES_PER_USER, teams=max(10, users // 50),
+            seed=seed, fast_hasher=True, stdout=StringIO()
+        )
+        leaderboard_ranks.invalidate()
+
+    def measure(self, iterations, warmup):
+        client = Client()
+        measured = {}
+        for route, model in ENDPOINTS:
+            if model is None:
+                url = reverse(route)
+            else:
+                ids = model.objects.order_by('id').values_list('id', flat=True)
+                url = reverse(route, args=[ids[ids.count() // 2]])
+
+            for _ in range(warmup):
+                client.get(url)
+
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                response = client.get(url)
+                samples.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise CommandError(f'{route} returned {response.status_code}')
+
+            queries = _QueryCounter()
+            with connection.execute_wrapper(queries):
+                client.get(url)
+
+            tracemalloc.start()
+            try:
+                client.get(url)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+            measured[route] = {
+                'p50_ms': round(_percentile(samples, 50), 3),
+                'p90_ms': round(_percentile(samples, 90), 3),
+                'p99_ms': round(_percentile(samples, 99), 3),
+                'mean_ms': round(statistics.fmean(samples), 3),
+                'queries': queries.count,
+                'peak_kib': round(peak / 1024, 1),
+                'bytes': len(response.content),
+            }
+        return measured
+
+    def report(self, size, measured):
+        self.stdout.write(f'\n{size} activities')
+        self.stdout.write(f"{'endpoint':<20}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'queries':>9}{'peak KiB':>11}")
+        for route, row in measured.items():
+            self.stdout.write(
+                f"{route:<20}{row['p50_ms']:>10}{row['p90_ms']:>10}{row['p99_ms']:>10}"
+                f"{row['queries']:>9}{row['peak_kib']:>11}"
+            )
+
+    def compare(self, baseline, report, threshold):
+        """Print p90 and query-count changes; fail on regressions past the threshold"""
+        self.stdout.write(f"\nCompared with {(baseline.get('commit') or 'baseline')[:12]}:")
+        regressions = []
+        for size, measured in report['results'].items():
+            for route, row in measured.items():
+                before = baseline.get('results', {}).get(size, {}).get(route)
+                if before is None:
+                    continue
+                change = (row['p90_ms'] - before['p90_ms']) / before['p90_ms'] * 100 if before['p90_ms'] else 0.0
+                queries = row['queries'] - before['queries']
+                line = f'{size:>8} {route:<20} p90 {change:+7.1f}%  queries {queries:+d}'
+                if change > threshold or queries > 0:
+                    regressions.append(line)
+                    line = self.style.ERROR(line)
+                self.stdout.write(line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against the baseline')
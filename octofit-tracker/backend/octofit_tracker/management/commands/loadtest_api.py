@@ -0,0 +1,128 @@
+import asyncio
+import json
+import ssl
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class _Connection:
+    """Minimal keep-alive HTTP/1.1 client, enough to replay GET requests"""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        path = parts.path or '/'
+        self.request = (
+            f'GET {path}{"?" + parts.query if parts.query else ""} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\nAccept: application/json\r\nConnection: keep-alive\r\n\r\n'
+        ).encode()
+        self.reader = self.writer = None
+
+    async def get(self):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        self.writer.write(self.request)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        else:
+            await self.reader.readexactly(int(headers.get('content-length', 0)))
+
+        if headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+async def _client(url, deadline, latencies, statuses):
+    connection = _Connection(url)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status = await connection.get()
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                statuses['error'] = statuses.get('error', 0) + 1
+                await connection.close()
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        await connection.close()
+
+
+async def _run(url, concurrency, duration):
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(url, deadline, latencies, statuses) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'throughput_rps': round(statuses.get(200, 0) / elapsed, 1),
+        'p50_ms': round(quantiles[49], 2) if quantiles else None,
+        'p90_ms': round(quantiles[89], 2) if quantiles else None,
+        'p99_ms': round(quantiles[98], 2) if quantiles else None,
+        'statuses': {str(status): count for status, count in statuses.items()},
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay GET requests against running servers with many concurrent keep-alive clients, '
+        'e.g. the WSGI /api/activities/ against the ASGI /api/async/activities/'
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Full URLs to load, measured one after another')
+        parser.add_argument(
+            '--concurrency', type=int, nargs='+', default=[100],
+            help='Concurrent clients; each level is measured separately'
+        )
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per URL and level')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        results = []
+        self.stdout.write(f"{'url':<50}{'clients':>8}{'req/s':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}  statuses")
+        for url in options['urls']:
+            if urlsplit(url).scheme not in ('http', 'https'):
+                raise CommandError(f'Expected an http(s) URL, got {url!r}')
+            for concurrency in options['concurrency']:
+                result = asyncio.run(_run(url, concurrency, options['duration']))
+                results.append(result)
+                self.stdout.write(
+                    f"{url[-50:]:<50}{concurrency:>8}{result['throughput_rps']:>10}{result['p50_ms']!s:>10}"
+                    f"{result['p90_ms']!s:>10}{result['p99_ms']!s:>10}  {result['statuses']}"
+                )
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
@@ -1,13 +1,99 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from django.contrib.auth.hashers import MD5PasswordHasher, make_password
 from django.core.management.base import BaseCommand
-from octofit_tracker.models import User, Team, Activity, Leaderboard, Workout
+from django.db import connections
+from django.utils import timezone
+from octofit_tracker.aggregates import (
+    build_daily_rollups,
+    bulk_insert,
+    rebuild_daily_rollups,
+    rebuild_leaderboard,
+    rebuild_leaderboard_periods,
+    rebuild_team_leaderboard,
+    reconcile_member_counts,
+    truncate,
+)
+from octofit_tracker.cache import response_cache
+from octofit_tracker.metrics import batch_calories, estimate_calories, user_totals
+from octofit_tracker.models import User, Team, Activity, ActivityDailyRollup, Leaderboard, Workout
+from octofit_tracker.ranking import leaderboard_ranks
 from datetime import datetime, timedelta
 import random
 
+ACTIVITY_TYPES = ['Running', 'Weightlifting', 'Cycling', 'Swimming', 'Boxing', 'Yoga', 'HIIT']
+
+LOAD_TEST_PASSWORD = 'octofit_load_test'
+
+
+def generate_activities(job):
+    """
+    Generate and insert the activities and daily rollups for a slice of users.
+
+    Runs in the command's process or in a pool worker. Each slice draws from its
+    own seeded RNG stream, so the data is identical for any worker count.
+    """
+    user_ids, per_user, seed, slice_index, batch_size, now = job
+    rng = np.random.default_rng([seed, slice_index])
+    count = len(user_ids) * per_user
+    owners = np.repeat(np.asarray(user_ids, dtype=str), per_user)
+    types = np.asarray(ACTIVITY_TYPES)[rng.integers(len(ACTIVITY_TYPES), size=count)]
+    durations = rng.integers(20, 91, size=count)
+    # MET estimates for body weights between 50 and 100 kg
+    calories = batch_calories(types, durations, rng.integers(50, 101, size=count)).astype(int)
+    seconds_ago = rng.integers(0, 30 * 24 * 3600, size=count)
+    activities = [
+        Activity(
+            user_id=user_id,
+            activity_type=activity_type,
+            duration=duration,
+            calories_burned=calories_burned,
+            date=now - timedelta(seconds=offset),
+            notes=''
+        )
+        for user_id, activity_type, duration, calories_burned, offset in zip(
+            owners.tolist(), types.tolist(), durations.tolist(), calories.tolist(), seconds_ago.tolist()
+        )
+    ]
+    bulk_insert(Activity, activities, batch_size)
+    bulk_insert(ActivityDailyRollup, build_daily_rollups(activities), batch_size)
+    return count
+
 
 class Command(BaseCommand):
     help = 'Populate the octofit_db database with test data'
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=0,
+            help='Generate this many synthetic users in bulk instead of the superhero dataset'
+        )
+        parser.add_argument('--activities-per-user', type=int, default=10)
+        parser.add_argument('--teams', type=int, default=10, help='Number of synthetic teams')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Documents per bulk insert')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Generate activities in a process pool of this size (needs a server database)'
+        )
+        parser.add_argument(
+            '--fast-hasher',
+            action='store_true',
+            help='Hash the shared password with MD5 (only verifiable if MD5PasswordHasher is enabled)'
+        )
+
+    def handle(self, *args, **options):
+        if options['seed'] is not None:
+            random.seed(options['seed'])
+        if options['users']:
+            return self.populate_load_test(options)
+
         self.stdout.write(self.style.SUCCESS('Starting database population...'))
         
         # Delete existing data
@@ -72,10 +158,11 @@ class Command(BaseCommand):
             dc_users.append(user)
         
         all_users = marvel_users + dc_users
+        reconcile_member_counts()
         
         # Create Activities
         self.stdout.write('Creating activities...')
-        activity_types = ['Running', 'Weightlifting', 'Cycling', 'Swimming', 'Boxing', 'Yoga', 'HIIT']
+        activity_types = ACTIVITY_TYPES
         
         for user in all_users:
             # Create 5-10 activities per user
@@ -83,7 +170,7 @@ class Command(BaseCommand):
             for i in range(num_activities):
                 activity_type = random.choice(activity_types)
                 duration = random.randint(20, 90)
-                calories = duration * random.randint(5, 12)
+                calories = estimate_calories(activity_type, duration, random.randint(50, 100))
                 days_ago = random.randint(0, 30)
                 
                 Activity.objects.create(
@@ -95,40 +182,29 @@ class Command(BaseCommand):
                     notes=f'{activity_type} session by {user.name}'
                 )
         
-        # Create Leaderboard entries
+        rebuild_daily_rollups()
+        rebuild_leaderboard_periods()
+        
+        # Create Leaderboard entries from one read of the activity columns
         self.stdout.write('Creating leaderboard entries...')
+        columns = list(zip(*Activity.objects.values_list('user_id', 'activity_type', 'duration', 'calories_burned')))
+        totals = user_totals(*columns) if columns else {}
         for user in all_users:
-            activities = Activity.objects.filter(user_id=str(user.id))
-            total_activities = activities.count()
-            total_calories = sum(a.calories_burned for a in activities)
-            total_duration = sum(a.duration for a in activities)
-            
-            # Calculate total_distance based on activity types and duration
-            total_distance = 0.0
-            for activity in activities:
-                if activity.activity_type == 'Running':
-                    total_distance += activity.duration * 0.15  # ~9 km/h pace
-                elif activity.activity_type == 'Cycling':
-                    total_distance += activity.duration * 0.33  # ~20 km/h pace
-                elif activity.activity_type == 'Swimming':
-                    total_distance += activity.duration * 0.05  # ~3 km/h pace
-            
             Leaderboard.objects.create(
                 user_id=str(user.id),
                 team_id=user.team_id,
-                total_activities=total_activities,
-                total_calories=total_calories,
-                total_duration=total_duration,
-                total_distance=round(total_distance, 2),
-                rank=0  # Will be calculated based on sorting
+                **totals.get(str(user.id), {})
             )
         
-        # Update ranks
-        leaderboard_entries = Leaderboard.objects.all().order_by('-total_calories')
-        for index, entry in enumerate(leaderboard_entries, start=1):
-            entry.rank = index
-            entry.save()
+        rebuild_team_leaderboard()
+        
+        # Ranks are computed on read; drop any index built from the old rows
+        leaderboard_ranks.invalidate()
         
+        self.create_workouts()
+        self.print_summary('superhero test data')
+
+    def create_workouts(self):
         # Create Workouts
         self.stdout.write('Creating workout plans...')
         workouts = [
@@ -214,12 +290,78 @@ class Command(BaseCommand):
         
         for workout_data in workouts:
             Workout.objects.create(**workout_data)
-        
-        # Print summary
+
+    def print_summary(self, label):
         self.stdout.write(self.style.SUCCESS('\n=== Database Population Complete ==='))
         self.stdout.write(f'Teams created: {Team.objects.count()}')
         self.stdout.write(f'Users created: {User.objects.count()}')
         self.stdout.write(f'Activities created: {Activity.objects.count()}')
         self.stdout.write(f'Leaderboard entries: {Leaderboard.objects.count()}')
         self.stdout.write(f'Workouts created: {Workout.objects.count()}')
-        self.stdout.write(self.style.SUCCESS('\nDatabase successfully populated with superhero test data!'))
+        self.stdout.write(self.style.SUCCESS(f'\nDatabase successfully populated with {label}!'))
+
+    def load_test_password(self, fast):
+        """One hash shared by every generated user"""
+        if fast:
+            hasher = MD5PasswordHasher()
+            return hasher.encode(LOAD_TEST_PASSWORD, hasher.salt())
+        return make_password(LOAD_TEST_PASSWORD)
+
+    def populate_load_test(self, options):
+        """Generate a synthetic dataset with bulk inserts, for capacity testing"""
+        user_count = options['users']
+        per_user = options['activities_per_user']
+        batch_size = options['batch_size']
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 32)
+        self.stdout.write(self.style.SUCCESS(
+            f'Generating {user_count} users x {per_user} activities (seed {seed})...'
+        ))
+
+        self.stdout.write('Deleting existing data...')
+        for model in (User, Team, Activity, ActivityDailyRollup, Leaderboard, Workout):
+            truncate(model)
+
+        self.stdout.write('Creating teams...')
+        bulk_insert(Team, (
+            Team(name=f'Load Team {i + 1}', description='Generated load-test team')
+            for i in range(max(options['teams'], 1))
+        ), batch_size)
+        team_ids = [str(pk) for pk in Team.objects.order_by('id').values_list('id', flat=True)]
+
+        self.stdout.write('Creating users...')
+        password = self.load_test_password(options['fast_hasher'])
+        bulk_insert(User, (
+            User(
+                name=f'Load User {i}',
+                email=f'user{i}@loadtest.octofit.dev',
+                password=password,
+                team_id=team_ids[i % len(team_ids)]
+            )
+            for i in range(user_count)
+        ), batch_size)
+        user_ids = [str(pk) for pk in User.objects.order_by('id').values_list('id', flat=True).iterator()]
+
+        self.stdout.write('Creating activities and daily rollups...')
+        users_per_slice = max(1, batch_size // max(per_user, 1))
+        now = timezone.now()
+        jobs = [
+            (user_ids[start:start + users_per_slice], per_user, seed, index, batch_size, now)
+            for index, start in enumerate(range(0, len(user_ids), users_per_slice))
+        ]
+        if options['workers'] > 1:
+            # Workers are forked with their own database connections
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            with ProcessPoolExecutor(options['workers'], mp_context=context) as pool:
+                created = sum(pool.map(generate_activities, jobs))
+        else:
+            created = sum(map(generate_activities, jobs))
+        self.stdout.write(f'{created} activities inserted')
+
+        self.stdout.write('Computing team sizes and leaderboard totals...')
+        reconcile_member_counts()
+        rebuild_leaderboard(batch_size=batch_size)
+        response_cache.bump('teams', 'leaderboard')
+
+        self.create_workouts()
+        self.print_summary('load-test data')
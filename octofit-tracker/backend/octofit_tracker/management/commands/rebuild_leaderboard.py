@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from octofit_tracker.aggregates import expire_leaderboard_periods, rebuild_leaderboard, users_changed_since
+from datetime import datetime, time, timedelta
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute leaderboard totals from activities without touching other data, '
+        'and expire windowed leaderboard buckets past retention'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help=(
+                'Only reprocess users whose activities were written or deleted at or after this '
+                'ISO date/datetime (the watermark printed by the previous run)'
+            )
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows upserted per batch')
+
+    def parse_since(self, value):
+        since = parse_datetime(value)
+        if since is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f'--since must be an ISO date or datetime, got {value!r}')
+            since = datetime.combine(day, time.min)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+        return since
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        # Trails the clock so writes still in flight are picked up by the next run
+        watermark = now - timedelta(seconds=settings.OCTOFIT_SYNC_SKEW_SECONDS)
+        user_ids = None
+        if options['since']:
+            since = self.parse_since(options['since'])
+            if since < now - timedelta(days=settings.OCTOFIT_TOMBSTONE_RETENTION_DAYS):
+                # Tombstones of deletes that old may be pruned already
+                self.stdout.write('--since is older than the tombstone retention; rebuilding every user')
+            else:
+                user_ids = users_changed_since(since)
+                self.stdout.write(f'{len(user_ids)} user(s) with activity changes since {since.isoformat()}')
+
+        written = rebuild_leaderboard(user_ids=user_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} leaderboard entries'))
+        expired = expire_leaderboard_periods()
+        self.stdout.write(f'Expired {expired} weekly/monthly leaderboard bucket(s) past retention')
+        self.stdout.write(f'Watermark for the next --since run: {watermark.isoformat()}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from octofit_tracker.aggregates import reconcile_member_counts
+
+
+class Command(BaseCommand):
+    help = 'Recount team members and fix drifted Team.member_count values'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report drifted counters without updating them'
+        )
+
+    def handle(self, *args, **options):
+        drifted = reconcile_member_counts(dry_run=options['dry_run'])
+        for team, stored, actual in drifted:
+            self.stdout.write(f'{team.name} (id={team.id}): {stored} -> {actual}')
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(drifted)} drifted team counter(s)'))
@@ -0,0 +1,102 @@
+"""
+Per-activity-type coefficients and the estimates derived from them.
+
+Distances use an average pace per type. Calories use MET values:
+kcal = MET * body weight (kg) * hours; activities posted without calories
+get the estimate, and populate_db generates its calories with it. The
+scalar helpers serve single rows in the API. The batch helpers take whole
+columns of activities and compute with NumPy, so recomputing totals for
+many activities does not run a Python loop per row.
+"""
+from typing import NamedTuple
+
+import numpy as np
+
+DEFAULT_BODY_WEIGHT_KG = 70.0
+
+
+class Coefficients(NamedTuple):
+    km_per_minute: float
+    met: float
+
+
+COEFFICIENTS = {
+    'Running': Coefficients(0.15, 9.8),   # ~9 km/h pace
+    'Cycling': Coefficients(0.33, 7.5),   # ~20 km/h pace
+    'Swimming': Coefficients(0.05, 8.0),  # ~3 km/h pace
+    'Weightlifting': Coefficients(0.0, 5.0),
+    'Boxing': Coefficients(0.0, 7.8),
+    'Yoga': Coefficients(0.0, 2.5),
+    'HIIT': Coefficients(0.0, 8.0),
+}
+UNKNOWN_ACTIVITY = Coefficients(0.0, 4.0)
+
+TOTAL_FIELDS = ('total_activities', 'total_calories', 'total_duration', 'total_distance')
+
+
+def coefficients(activity_type):
+    return COEFFICIENTS.get(activity_type, UNKNOWN_ACTIVITY)
+
+
+def estimate_distance(activity_type, duration):
+    """Estimated distance in km for an activity of the given type and duration"""
+    return round(duration * coefficients(activity_type).km_per_minute, 2)
+
+
+def estimate_calories(activity_type, duration, weight_kg=DEFAULT_BODY_WEIGHT_KG):
+    """Estimated kcal burned for an activity of the given type and duration"""
+    return round(coefficients(activity_type).met * weight_kg * duration / 60)
+
+
+def _coefficient_columns(activity_types):
+    """Pace and MET arrays aligned with `activity_types`, one dict lookup per distinct type"""
+    types, inverse = np.unique(np.asarray(activity_types, dtype=str), return_inverse=True)
+    table = np.array([coefficients(activity_type) for activity_type in types], dtype=float).reshape(-1, 2)
+    return table[inverse, 0], table[inverse, 1]
+
+
+def batch_distances(activity_types, durations):
+    """Estimated distances (km) for whole columns of activities"""
+    if not len(durations):
+        return np.zeros(0)
+    pace, _ = _coefficient_columns(activity_types)
+    return np.round(np.asarray(durations, dtype=float) * pace, 2)
+
+
+def batch_calories(activity_types, durations, weight_kg=DEFAULT_BODY_WEIGHT_KG):
+    """Estimated kcal for whole columns of activities; `weight_kg` may be a column too"""
+    if not len(durations):
+        return np.zeros(0)
+    _, met = _coefficient_columns(activity_types)
+    return np.round(met * weight_kg * np.asarray(durations, dtype=float) / 60)
+
+
+def user_totals(user_ids, activity_types, durations, calories_burned):
+    """
+    Leaderboard totals per user from columns of activities.
+
+    Returns {user_id: {'total_activities': ..., 'total_calories': ...,
+    'total_duration': ..., 'total_distance': ...}} computed with one grouped
+    NumPy reduction per field.
+    """
+    if not len(user_ids):
+        return {}
+    users, inverse = np.unique(np.asarray(user_ids, dtype=str), return_inverse=True)
+    durations = np.asarray(durations, dtype=float)
+    columns = {
+        'total_activities': np.bincount(inverse, minlength=len(users)),
+        'total_calories': np.bincount(inverse, weights=np.asarray(calories_burned, dtype=float), minlength=len(users)),
+        'total_duration': np.bincount(inverse, weights=durations, minlength=len(users)),
+        'total_distance': np.bincount(
+            inverse, weights=batch_distances(activity_types, durations), minlength=len(users)
+        ),
+    }
+    return {
+        user_id: {
+            'total_activities': int(columns['total_activities'][i]),
+            'total_calories': int(columns['total_calories'][i]),
+            'total_duration': int(columns['total_duration'][i]),
+            'total_distance': round(float(columns['total_distance'][i]), 2),
+        }
+        for i, user_id in enumerate(users.tolist())
+    }
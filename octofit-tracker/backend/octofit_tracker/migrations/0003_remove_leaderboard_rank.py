@@ -0,0 +1,17 @@
+# Ranks are computed on read from the in-process rank index
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0002_add_total_distance'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='leaderboard',
+            name='rank',
+        ),
+    ]
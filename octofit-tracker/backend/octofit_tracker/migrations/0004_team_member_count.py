@@ -0,0 +1,27 @@
+# Denormalized member counter for teams, backfilled from users
+
+from django.db import migrations, models
+
+
+def backfill_member_counts(apps, schema_editor):
+    Team = apps.get_model('octofit_tracker', 'Team')
+    User = apps.get_model('octofit_tracker', 'User')
+    for team in Team.objects.all():
+        team.member_count = User.objects.filter(team_id=str(team.id)).count()
+        team.save(update_fields=['member_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0003_remove_leaderboard_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='team',
+            name='member_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_member_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Daily activity rollups backing /api/activities/stats/
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0004_team_member_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('activity_type', models.CharField(max_length=100)),
+                ('total_activities', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0.0)),
+            ],
+            options={
+                'db_table': 'activity_daily_rollups',
+                'unique_together': {('user_id', 'day', 'activity_type')},
+            },
+        ),
+    ]
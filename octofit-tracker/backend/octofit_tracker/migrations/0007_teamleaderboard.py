@@ -0,0 +1,42 @@
+# Per-team leaderboard aggregates, backfilled from the user leaderboard
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+TOTAL_FIELDS = ('total_activities', 'total_calories', 'total_duration', 'total_distance')
+
+
+def backfill_team_totals(apps, schema_editor):
+    Leaderboard = apps.get_model('octofit_tracker', 'Leaderboard')
+    TeamLeaderboard = apps.get_model('octofit_tracker', 'TeamLeaderboard')
+    grouped = Leaderboard.objects.exclude(team_id='').order_by().values('team_id').annotate(
+        **{field: Sum(field) for field in TOTAL_FIELDS}
+    )
+    TeamLeaderboard.objects.bulk_create([TeamLeaderboard(**row) for row in grouped])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0006_add_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamLeaderboard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('team_id', models.CharField(max_length=100, unique=True)),
+                ('total_activities', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0.0)),
+            ],
+            options={
+                'db_table': 'team_leaderboard',
+                'ordering': ['-total_calories'],
+                'indexes': [models.Index(fields=['-total_calories', 'id'], name='team_leaderboard_calories_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_team_totals, migrations.RunPython.noop),
+    ]
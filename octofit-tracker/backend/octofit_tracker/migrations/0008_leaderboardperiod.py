@@ -0,0 +1,53 @@
+# Weekly and monthly per-user leaderboard buckets, backfilled from the daily rollups
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import migrations, models
+
+TOTAL_FIELDS = ('total_activities', 'total_calories', 'total_duration', 'total_distance')
+
+
+def backfill_periods(apps, schema_editor):
+    ActivityDailyRollup = apps.get_model('octofit_tracker', 'ActivityDailyRollup')
+    LeaderboardPeriod = apps.get_model('octofit_tracker', 'LeaderboardPeriod')
+    buckets = defaultdict(lambda: dict.fromkeys(TOTAL_FIELDS, 0))
+    for row in ActivityDailyRollup.objects.values('user_id', 'day', *TOTAL_FIELDS).iterator():
+        user_id, day = row.pop('user_id'), row.pop('day')
+        for period, start in (('week', day - timedelta(days=day.weekday())), ('month', day.replace(day=1))):
+            totals = buckets[(user_id, period, start)]
+            for field, value in row.items():
+                totals[field] += value
+    LeaderboardPeriod.objects.bulk_create([
+        LeaderboardPeriod(user_id=user_id, period=period, start=start, **totals)
+        for (user_id, period, start), totals in buckets.items()
+    ], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0007_teamleaderboard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeaderboardPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(max_length=100)),
+                ('period', models.CharField(max_length=10)),
+                ('start', models.DateField()),
+                ('total_activities', models.IntegerField(default=0)),
+                ('total_calories', models.IntegerField(default=0)),
+                ('total_duration', models.IntegerField(default=0)),
+                ('total_distance', models.FloatField(default=0.0)),
+            ],
+            options={
+                'db_table': 'leaderboard_periods',
+                'unique_together': {('period', 'start', 'user_id')},
+                'indexes': [models.Index(fields=['period', 'start', '-total_calories', 'id'], name='leaderboard_period_rank_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_periods, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Indexes backing the ?activity_type= and ?team_id= list filters
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0008_leaderboardperiod'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['activity_type', '-date', '-id'], name='activity_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['team_id', '-total_calories', 'id'], name='leaderboard_team_idx'),
+        ),
+    ]
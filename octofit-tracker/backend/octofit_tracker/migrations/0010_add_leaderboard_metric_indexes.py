@@ -0,0 +1,25 @@
+# One index per ?sort_by= metric of the leaderboard, in rank order
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0009_add_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-total_duration', 'id'], name='leaderboard_duration_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-total_distance', 'id'], name='leaderboard_distance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='leaderboard',
+            index=models.Index(fields=['-total_activities', 'id'], name='leaderboard_activities_idx'),
+        ),
+    ]
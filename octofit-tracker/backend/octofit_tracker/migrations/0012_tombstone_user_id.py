@@ -0,0 +1,18 @@
+# Owner of deleted rows, so rebuild_leaderboard --since can find users with deleted activities
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('octofit_tracker', '0011_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='user_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
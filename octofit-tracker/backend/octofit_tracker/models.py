@@ -8,9 +8,14 @@ class User(models.Model):
     password = models.CharField(max_length=200)
     team_id = models.CharField(max_length=100, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # QuerySet.update() callers set it themselves
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            models.Index(fields=['team_id'], name='user_team_idx'),
+            models.Index(fields=['updated_at', 'id'], name='user_updated_idx'),
+        ]
         
     def save(self, *args, **kwargs):
         if not self.pk and self.password:
@@ -22,9 +27,14 @@ class Team(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    member_count = models.IntegerField(default=0)  # maintained by UserViewSet writes
+    updated_at = models.DateTimeField(auto_now=True)  # QuerySet.update() callers set it themselves
     
     class Meta:
         db_table = 'teams'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='team_updated_idx'),
+        ]
 
 
 class Activity(models.Model):
@@ -34,23 +44,93 @@ class Activity(models.Model):
     calories_burned = models.IntegerField()
     date = models.DateTimeField()
     notes = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)  # QuerySet.update() callers set it themselves
     
     class Meta:
         db_table = 'activities'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='activity_updated_idx'),
+            models.Index(fields=['user_id', '-date'], name='activity_user_date_idx'),
+            models.Index(fields=['-date', '-id'], name='activity_date_idx'),
+            models.Index(fields=['activity_type', '-date', '-id'], name='activity_type_date_idx'),
+        ]
+
+
+class ActivityDailyRollup(models.Model):
+    """Per-user, per-day, per-type activity totals maintained on every write"""
+    user_id = models.CharField(max_length=100)
+    day = models.DateField()
+    activity_type = models.CharField(max_length=100)
+    total_activities = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0.0)  # in kilometers
+
+    class Meta:
+        db_table = 'activity_daily_rollups'
+        unique_together = [('user_id', 'day', 'activity_type')]
 
 
 class Leaderboard(models.Model):
+    # Totals the list can be sorted and ranked by (?sort_by=)
+    METRICS = ('total_calories', 'total_duration', 'total_distance', 'total_activities')
+
     user_id = models.CharField(max_length=100)
     team_id = models.CharField(max_length=100)
     total_activities = models.IntegerField(default=0)
     total_calories = models.IntegerField(default=0)
     total_duration = models.IntegerField(default=0)  # in minutes
     total_distance = models.FloatField(default=0.0)  # in kilometers
-    rank = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)  # QuerySet.update() callers set it themselves
     
     class Meta:
         db_table = 'leaderboard'
         ordering = ['-total_calories']  # Order by total_calories descending
+        indexes = [
+            models.Index(fields=['-total_calories', 'id'], name='leaderboard_calories_idx'),
+            models.Index(fields=['user_id'], name='leaderboard_user_idx'),
+            models.Index(fields=['team_id', '-total_calories', 'id'], name='leaderboard_team_idx'),
+            models.Index(fields=['-total_duration', 'id'], name='leaderboard_duration_idx'),
+            models.Index(fields=['-total_distance', 'id'], name='leaderboard_distance_idx'),
+            models.Index(fields=['-total_activities', 'id'], name='leaderboard_activities_idx'),
+            models.Index(fields=['updated_at', 'id'], name='leaderboard_updated_idx'),
+        ]
+
+
+class TeamLeaderboard(models.Model):
+    """Sum of the members' Leaderboard totals, maintained on every write"""
+    team_id = models.CharField(max_length=100, unique=True)
+    total_activities = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0.0)  # in kilometers
+
+    class Meta:
+        db_table = 'team_leaderboard'
+        ordering = ['-total_calories']
+        indexes = [
+            models.Index(fields=['-total_calories', 'id'], name='team_leaderboard_calories_idx'),
+        ]
+
+
+class LeaderboardPeriod(models.Model):
+    """Per-user totals for one ISO week or calendar month, maintained on every write"""
+    PERIODS = ('week', 'month')
+
+    user_id = models.CharField(max_length=100)
+    period = models.CharField(max_length=10)  # 'week' or 'month'
+    start = models.DateField()  # Monday of the ISO week / first day of the month
+    total_activities = models.IntegerField(default=0)
+    total_calories = models.IntegerField(default=0)
+    total_duration = models.IntegerField(default=0)  # in minutes
+    total_distance = models.FloatField(default=0.0)  # in kilometers
+
+    class Meta:
+        db_table = 'leaderboard_periods'
+        unique_together = [('period', 'start', 'user_id')]
+        indexes = [
+            models.Index(fields=['period', 'start', '-total_calories', 'id'], name='leaderboard_period_rank_idx'),
+        ]
 
 
 class Workout(models.Model):
@@ -60,6 +140,24 @@ class Workout(models.Model):
     duration = models.IntegerField()  # in minutes
     calories_estimate = models.IntegerField()
     exercises = models.JSONField()
+    updated_at = models.DateTimeField(auto_now=True)  # QuerySet.update() callers set it themselves
     
     class Meta:
         db_table = 'workouts'
+        indexes = [
+            models.Index(fields=['updated_at', 'id'], name='workout_updated_idx'),
+        ]
+
+
+class Tombstone(models.Model):
+    """A deleted row, kept so that delta syncs (`?since=`) can report the delete"""
+    resource = models.CharField(max_length=50)  # db_table of the deleted row
+    object_id = models.BigIntegerField()
+    user_id = models.CharField(max_length=100, blank=True, default='')  # owner of the deleted row, if any
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'tombstones'
+        indexes = [
+            models.Index(fields=['resource', 'deleted_at'], name='tombstone_resource_idx'),
+        ]
@@ -0,0 +1,234 @@
+"""
+Async MongoDB access for the ASGI read path.
+
+The async views in `async_views.py` read the collections djongo writes without
+going through the synchronous ORM, so a slow query suspends a coroutine
+instead of holding one of Django's sync_to_async threads.
+
+djongo pins pymongo 3.x, which rules out motor 3 and pymongo's own async API,
+and motor 2 no longer imports on Python 3.11+. The queries therefore run the
+way motor 2 runs them: on a shared, thread-safe pymongo client (one
+connection pool per process) from a dedicated thread pool, awaited from the
+event loop. Connection settings come from `DATABASES['default']`, and the
+pool size from `OCTOFIT_ASYNC_MAX_POOL_SIZE`.
+
+Writes the SQL translation cannot express go through `collection`, djongo's
+own pymongo handle: djongo only turns `SET col = %s` into `$set`, so counter
+updates (`F(col) + n`) are issued as native `$inc` by aggregates.py.
+
+`pool_stats` is a pymongo ConnectionPoolListener registered at startup, so it
+sees the pools of every client in the process (djongo's and the async one);
+`/api/_pool/` reports them. `startup_probe` pings the server when a worker
+boots.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+from .instrumentation import timed_query
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_client = None
+_executor = None
+
+
+def client_options():
+    """pymongo keyword arguments equivalent to djongo's configuration"""
+    options = dict(settings.DATABASES['default'].get('CLIENT', {}))
+    options['maxPoolSize'] = settings.OCTOFIT_ASYNC_MAX_POOL_SIZE
+    options['tz_aware'] = True
+    return options
+
+
+def _resources():
+    global _client, _executor
+    with _lock:
+        if _client is None:
+            options = client_options()
+            _client = MongoClient(**options)
+            # One thread per pooled connection: more threads would only queue on the pool
+            _executor = ThreadPoolExecutor(max_workers=options['maxPoolSize'] or 100, thread_name_prefix='octofit-mongo')
+        return _client[settings.DATABASES['default']['NAME']], _executor
+
+
+async def _run(operation):
+    database, executor = _resources()
+    with timed_query():
+        return await asyncio.get_running_loop().run_in_executor(executor, partial(operation, database))
+
+
+def _read_preference(name):
+    return make_read_preference(read_pref_mode_from_name(name), None)
+
+
+async def find(collection, query, projection, sort, limit, read_preference=None):
+    """Documents of a collection as a list, optionally with their own read preference"""
+    def operation(db):
+        documents = db[collection]
+        if read_preference:
+            documents = documents.with_options(read_preference=_read_preference(read_preference))
+        return list(documents.find(query, projection).sort(sort).limit(limit))
+    return await _run(operation)
+
+
+async def find_one(collection, query, projection):
+    return await _run(lambda db: db[collection].find_one(query, projection))
+
+
+def uses_mongo(alias='default'):
+    return settings.DATABASES[alias]['ENGINE'] == 'djongo'
+
+
+def collection(name, alias='default'):
+    """A pymongo collection on djongo's connection, sharing its pool and write concern"""
+    connection = connections[alias]
+    connection.ensure_connection()
+    return connection.connection[name]
+
+
+def fields_of(model):
+    """Projection of a model's stored columns, without Mongo's _id"""
+    projection = {field.column: 1 for field in model._meta.concrete_fields}
+    projection['_id'] = 0
+    return projection
+
+
+def _new_pool():
+    return {
+        'max_pool_size': None, 'min_pool_size': None, 'open': 0, 'in_use': 0, 'peak_in_use': 0,
+        'waiting': 0, 'peak_waiting': 0, 'checkouts': 0, 'checkout_failures': defaultdict(int), 'cleared': 0,
+    }
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Per-address connection pool usage, summed over every client in the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = defaultdict(_new_pool)
+
+    def _update(self, event, **changes):
+        with self._lock:
+            pool = self._pools['%s:%s' % event.address]
+            for key, amount in changes.items():
+                pool[key] += amount
+            pool['peak_in_use'] = max(pool['peak_in_use'], pool['in_use'])
+            pool['peak_waiting'] = max(pool['peak_waiting'], pool['waiting'])
+            return pool
+
+    def pool_created(self, event):
+        pool = self._update(event)
+        with self._lock:
+            # Several clients may pool to one address; report the largest limits
+            pool['max_pool_size'] = max(pool['max_pool_size'] or 0, event.options.get('maxPoolSize') or 0)
+            pool['min_pool_size'] = max(pool['min_pool_size'] or 0, event.options.get('minPoolSize') or 0)
+
+    def pool_cleared(self, event):
+        self._update(event, cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._update(event, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._update(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        pool = self._update(event, waiting=-1)
+        with self._lock:
+            pool['checkout_failures'][event.reason] += 1
+
+    def connection_checked_out(self, event):
+        self._update(event, waiting=-1, in_use=1, checkouts=1)
+
+    def connection_checked_in(self, event):
+        self._update(event, in_use=-1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                address: {**pool, 'checkout_failures': dict(pool['checkout_failures'])}
+                for address, pool in self._pools.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._pools.clear()
+
+
+pool_stats = PoolStats()
+
+
+def pool_stats_view(request):
+    """Connection pool usage of this worker process"""
+    client = settings.DATABASES['default'].get('CLIENT', {})
+    return JsonResponse({
+        'pid': os.getpid(),
+        'configured': {
+            'maxPoolSize': client.get('maxPoolSize'),
+            'minPoolSize': client.get('minPoolSize'),
+            'asyncMaxPoolSize': settings.OCTOFIT_ASYNC_MAX_POOL_SIZE,
+            'readPreference': client.get('readPreference'),
+            'listReadPreference': settings.OCTOFIT_MONGO_LIST_READ_PREFERENCE,
+            'w': client.get('w'),
+        },
+        'pools': pool_stats.snapshot(),
+    })
+
+
+def probe(timeout_ms=None):
+    """
+    Ping the configured server with a short-lived client.
+
+    Returns (ok, detail). The client is closed again so that nothing is left
+    open in a process that gunicorn --preload forks afterwards.
+    """
+    options = dict(settings.DATABASES['default'].get('CLIENT', {}))
+    options['serverSelectionTimeoutMS'] = timeout_ms or settings.OCTOFIT_MONGO_PROBE_TIMEOUT_MS
+    options.update(maxPoolSize=1, minPoolSize=0)
+    start = time.perf_counter()
+    client = MongoClient(**options)
+    try:
+        client.admin.command('ping')
+    except PyMongoError as error:
+        return False, str(error)
+    finally:
+        client.close()
+    return True, f'ping {(time.perf_counter() - start) * 1000:.1f} ms'
+
+
+def startup_probe():
+    """Run `probe` as configured by OCTOFIT_MONGO_STARTUP_PROBE; 'fail' raises on error"""
+    mode = settings.OCTOFIT_MONGO_STARTUP_PROBE
+    if mode == 'off' or settings.DATABASES['default']['ENGINE'] != 'djongo':
+        return None
+    ok, detail = probe()
+    if ok:
+        logger.info('MongoDB reachable: %s', detail)
+    elif mode == 'fail':
+        raise RuntimeError(f'MongoDB startup probe failed: {detail}')
+    else:
+        logger.warning('MongoDB startup probe failed: %s', detail)
+    return ok
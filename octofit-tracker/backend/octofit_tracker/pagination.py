@@ -0,0 +1,27 @@
+"""
+Cursor pagination for the API.
+
+Cursors encode a position in the ordering instead of an offset, so fetching a
+deep page costs the same as fetching the first one, and pages stay stable
+while new documents are inserted.
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class OctofitCursorPagination(CursorPagination):
+    """Default pagination: newest first, `?page_size=` capped by OCTOFIT_MAX_PAGE_SIZE"""
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+
+    @property
+    def max_page_size(self):
+        return settings.OCTOFIT_MAX_PAGE_SIZE
+
+
+class ActivityCursorPagination(OctofitCursorPagination):
+    ordering = ('-date', '-id')
+
+
+class LeaderboardCursorPagination(OctofitCursorPagination):
+    ordering = ('-total_calories', 'id')
@@ -0,0 +1,63 @@
+"""
+Query plan checks used by the test suite to catch collection scans.
+
+SQL backends are inspected through `QuerySet.explain()`. djongo cannot explain
+a translated query, so on MongoDB the caller also passes the equivalent
+`(collection, filter, sort)` spec and the plan comes from pymongo's
+`Cursor.explain()`. Backends that support neither make the check skip rather
+than pass silently.
+"""
+import re
+
+from django.db import NotSupportedError, connection
+
+# Plan fragments that mean every row/document is visited or sorted in memory
+_SCAN_PATTERNS = [
+    re.compile(r'\bSCAN (?!.*\bUSING\b)\S+'),  # SQLite full table scan
+    re.compile(r'\bSeq Scan on\b'),           # PostgreSQL
+    re.compile(r'\bCOLLSCAN\b'),              # MongoDB
+]
+_SORT_PATTERNS = [
+    re.compile(r'\bUSE TEMP B-TREE FOR\b'),   # SQLite
+    re.compile(r'\bSort Key:'),               # PostgreSQL
+    re.compile(r"'stage': 'SORT'"),           # MongoDB
+]
+
+
+class PlanUnavailable(Exception):
+    """The current database cannot explain this query"""
+
+
+def explain(queryset, mongo=None):
+    """Return the query plan for a queryset as text"""
+    if connection.vendor == 'djongo':
+        if mongo is None:
+            raise PlanUnavailable('djongo needs an explicit (collection, filter, sort) spec')
+        collection, query, sort = mongo
+        cursor = connection.connection[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        return str(cursor.explain().get('queryPlanner', {}).get('winningPlan'))
+    try:
+        return queryset.explain()
+    except NotSupportedError as exc:
+        raise PlanUnavailable(str(exc))
+
+
+def plan_problems(plan, allow_sort=False):
+    """Lines of a plan that indicate a full scan (or an in-memory sort)"""
+    patterns = _SCAN_PATTERNS if allow_sort else _SCAN_PATTERNS + _SORT_PATTERNS
+    return [line for line in plan.splitlines() if any(p.search(line) for p in patterns)]
+
+
+class QueryPlanAssertionsMixin:
+    """TestCase mixin providing assertNoCollectionScan"""
+
+    def assertNoCollectionScan(self, queryset, mongo=None, allow_sort=False):
+        try:
+            plan = explain(queryset, mongo)
+        except PlanUnavailable as exc:
+            self.skipTest(f'Query plan unavailable: {exc}')
+        problems = plan_problems(plan, allow_sort=allow_sort)
+        if problems:
+            self.fail(f'Query scans or sorts the whole collection:\n{queryset.query}\n' + '\n'.join(problems))
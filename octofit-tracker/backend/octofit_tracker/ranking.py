@@ -0,0 +1,246 @@
+"""
+Order-statistics rank index for the leaderboard.
+
+`RankIndex` is an indexable skip list (the structure behind Redis sorted sets):
+every forward pointer also stores how many entries it skips, so the rank of a
+member, the member at a given rank and a window of neighbours are all found in
+O(log n) without touching the database.
+
+`leaderboard_ranks` holds the process-wide indexes, one per metric in
+`Leaderboard.METRICS`. Each is loaded lazily from the database the first time
+that metric is ranked, kept current by the write paths that change totals,
+and reloaded after `OCTOFIT_RANK_INDEX_TTL` seconds so that writes made by
+other worker processes are picked up within a bounded delay.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Leaderboard
+
+
+class _Node:
+    __slots__ = ('key', 'member', 'forward', 'span')
+
+    def __init__(self, key, member, level):
+        self.key = key
+        self.member = member
+        self.forward = [None] * level
+        self.span = [0] * level
+
+
+class RankIndex:
+    """
+    Members ordered by descending score, ties broken by ascending `tiebreak`.
+
+    Ranks are 1-based. Not thread-safe on its own; see `LeaderboardRanks`.
+    """
+    MAX_LEVEL = 32
+    BRANCHING = 4
+
+    def __init__(self):
+        self._head = _Node(None, None, self.MAX_LEVEL)
+        self._level = 1
+        self._length = 0
+        self._keys = {}
+        self._random = random.Random()
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, member):
+        return member in self._keys
+
+    def score(self, member):
+        key = self._keys.get(member)
+        return None if key is None else -key[0]
+
+    def update(self, member, score, tiebreak=None):
+        """Insert a member or move it to its new score"""
+        key = (-score, member if tiebreak is None else tiebreak, member)
+        previous = self._keys.get(member)
+        if previous == key:
+            return
+        if previous is not None:
+            self._delete(previous)
+        self._insert(key, member)
+        self._keys[member] = key
+
+    def remove(self, member):
+        key = self._keys.pop(member, None)
+        if key is not None:
+            self._delete(key)
+
+    def rank(self, member):
+        """1-based rank of a member, or None if it is not indexed"""
+        key = self._keys.get(member)
+        if key is None:
+            return None
+        rank = 0
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key <= key:
+                rank += node.span[i]
+                node = node.forward[i]
+            if node.key == key:
+                return rank
+        return None
+
+    def range(self, start, count):
+        """Up to `count` (rank, member, score) tuples starting at rank `start`"""
+        node = self._node_at(max(start, 1))
+        rank = max(start, 1)
+        result = []
+        while node is not None and len(result) < count:
+            result.append((rank, node.member, -node.key[0]))
+            node = node.forward[0]
+            rank += 1
+        return result
+
+    def top(self, k):
+        return self.range(1, k)
+
+    def around(self, member, radius):
+        """The member plus up to `radius` neighbours on each side"""
+        rank = self.rank(member)
+        if rank is None:
+            return []
+        start = max(1, rank - radius)
+        return self.range(start, rank - start + radius + 1)
+
+    def _random_level(self):
+        level = 1
+        while level < self.MAX_LEVEL and self._random.randrange(self.BRANCHING) == 0:
+            level += 1
+        return level
+
+    def _node_at(self, rank):
+        traversed = 0
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.forward[i] is not None and traversed + node.span[i] <= rank:
+                traversed += node.span[i]
+                node = node.forward[i]
+            if traversed == rank:
+                return node
+        return None
+
+    def _insert(self, key, member):
+        update = [None] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            rank[i] = 0 if i == self._level - 1 else rank[i + 1]
+            while node.forward[i] is not None and node.forward[i].key < key:
+                rank[i] += node.span[i]
+                node = node.forward[i]
+            update[i] = node
+
+        level = self._random_level()
+        if level > self._level:
+            for i in range(self._level, level):
+                rank[i] = 0
+                update[i] = self._head
+                update[i].span[i] = self._length
+            self._level = level
+
+        new = _Node(key, member, level)
+        for i in range(level):
+            new.forward[i] = update[i].forward[i]
+            update[i].forward[i] = new
+            new.span[i] = update[i].span[i] - (rank[0] - rank[i])
+            update[i].span[i] = (rank[0] - rank[i]) + 1
+        for i in range(level, self._level):
+            update[i].span[i] += 1
+        self._length += 1
+
+    def _delete(self, key):
+        update = [None] * self.MAX_LEVEL
+        node = self._head
+        for i in range(self._level - 1, -1, -1):
+            while node.forward[i] is not None and node.forward[i].key < key:
+                node = node.forward[i]
+            update[i] = node
+        node = node.forward[0]
+        for i in range(self._level):
+            if update[i].forward[i] is node:
+                update[i].span[i] += node.span[i] - 1
+                update[i].forward[i] = node.forward[i]
+            else:
+                update[i].span[i] -= 1
+        while self._level > 1 and self._head.forward[self._level - 1] is None:
+            self._level -= 1
+        self._length -= 1
+
+
+class LeaderboardRanks:
+    """Thread-safe, lazily loaded rank indexes, one per Leaderboard metric"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._indexes = {}
+        self._loaded_at = {}
+
+    def _ensure_loaded(self, metric):
+        ttl = getattr(settings, 'OCTOFIT_RANK_INDEX_TTL', 60)
+        index = self._indexes.get(metric)
+        if index is not None and time.monotonic() - self._loaded_at[metric] < ttl:
+            return index
+        index = RankIndex()
+        rows = Leaderboard.objects.values_list('user_id', metric, 'id')
+        for user_id, score, pk in rows.iterator():
+            index.update(user_id, score, pk)
+        self._indexes[metric] = index
+        self._loaded_at[metric] = time.monotonic()
+        return index
+
+    def invalidate(self):
+        """Drop every index; the next read of a metric reloads it from the database"""
+        with self._lock:
+            self._indexes.clear()
+
+    def sync(self, entries):
+        """Record the current totals of Leaderboard rows that just changed"""
+        with self._lock:
+            for metric, index in self._indexes.items():
+                for entry in entries:
+                    index.update(entry.user_id, getattr(entry, metric), entry.id)
+
+    def refresh(self, user_ids):
+        """Re-read the totals of the given users if any index is loaded"""
+        if self._indexes and user_ids:
+            entries = Leaderboard.objects.filter(user_id__in=list(user_ids))
+            self.sync(list(entries.only('id', 'user_id', *Leaderboard.METRICS)))
+
+    def discard(self, user_id):
+        with self._lock:
+            for index in self._indexes.values():
+                index.remove(user_id)
+
+    def rank_of(self, entry, metric='total_calories'):
+        """Rank for a Leaderboard row, healing the index if it lags behind the row"""
+        with self._lock:
+            index = self._ensure_loaded(metric)
+            score = getattr(entry, metric)
+            if index.score(entry.user_id) != score:
+                index.update(entry.user_id, score, entry.id)
+            return index.rank(entry.user_id)
+
+    def standings(self, user_ids, metric='total_calories'):
+        """{user_id: (rank, score)} for the given users, (None, None) when unranked"""
+        with self._lock:
+            index = self._ensure_loaded(metric)
+            return {user_id: (index.rank(user_id), index.score(user_id)) for user_id in user_ids}
+
+    def top(self, k, metric='total_calories'):
+        with self._lock:
+            return self._ensure_loaded(metric).top(k)
+
+    def around(self, user_id, radius, metric='total_calories'):
+        with self._lock:
+            return self._ensure_loaded(metric).around(user_id, radius)
+
+
+leaderboard_ranks = LeaderboardRanks()
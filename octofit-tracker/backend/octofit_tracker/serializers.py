@@ -1,92 +1,334 @@
+from django.db import models
 from rest_framework import serializers
-from .models import User, Team, Activity, Leaderboard, Workout
+from rest_framework.permissions import SAFE_METHODS
+from .instrumentation import TimedRepresentationMixin
+from .metrics import estimate_calories, estimate_distance
+from .models import User, Team, Activity, Leaderboard, LeaderboardPeriod, TeamLeaderboard, Workout
+from .ranking import leaderboard_ranks
 
 
-class UserSerializer(serializers.ModelSerializer):
+def _to_pk(value):
+    """Convert a stored string reference (user_id/team_id) into a primary key"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _field_names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+class SparseFieldsetMixin:
+    """
+    Narrows read responses to `?fields=` and drops `?exclude=` (comma-separated).
+
+    Unrequested fields are removed before any row is rendered, so their
+    SerializerMethodFields are never computed. `field_sources` lists the model
+    fields each computed field reads; `model_fields()` turns what is left into
+    the column list the views pass to `.only()`.
+    """
+    field_sources = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return
+        params = getattr(request, 'query_params', request.GET)
+        readable = [name for name, field in self.fields.items() if not field.write_only]
+        keep = set(readable)
+        for param in ('fields', 'exclude'):
+            if param not in params:
+                continue
+            names = _field_names(params[param])
+            unknown = [name for name in names if name not in readable]
+            if unknown:
+                raise serializers.ValidationError({param: f"Unknown field(s): {', '.join(unknown)}."})
+            keep = keep & set(names) if param == 'fields' else keep - set(names)
+        for name in readable:
+            if name not in keep:
+                self.fields.pop(name)
+
+    def model_fields(self):
+        """Model fields the remaining output fields read, always including the primary key"""
+        concrete = {field.name for field in self.Meta.model._meta.concrete_fields}
+        columns = {'id'}
+        for name, field in self.fields.items():
+            if field.write_only:
+                continue
+            columns.update(self.field_sources.get(name, ()))
+            if field.source in concrete:
+                columns.add(field.source)
+        return sorted(columns)
+
+
+def sparse_fieldset_requested(request):
+    params = getattr(request, 'query_params', request.GET)
+    return request.method in SAFE_METHODS and ('fields' in params or 'exclude' in params)
+
+
+class IdentityResolvingListSerializer(TimedRepresentationMixin, serializers.ListSerializer):
+    """
+    List serializer that resolves user and team names for a whole page at once.
+
+    Rows only store `user_id`/`team_id` strings, so the child serializer would
+    otherwise look up the referenced User/Team once per row. This collects
+    every referenced id first and fetches each model with a single `id__in`
+    query before the rows are rendered.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        self.child.prime_identities(items)
+        return [self.child.to_representation(item) for item in items]
+
+
+class IdentityResolverMixin:
+    """
+    Serves user/team names from a per-serializer cache.
+
+    `user_ref_field` and `team_ref_field` name the attributes holding the
+    references and `user_name_field`/`team_name_field` the output fields that
+    show the names; names are only fetched while those fields are rendered.
+    When the serializer is used on its own (retrieve/create) the cache is
+    primed lazily for that single object. Callers that resolved the names
+    themselves pass them as `identity_names` in the context.
+    """
+    user_ref_field = None
+    team_ref_field = None
+    user_name_field = None
+    team_name_field = None
+
+    _user_names = None
+    _team_names = None
+
+    def prime_identities(self, objs):
+        names = self.context.get('identity_names')
+        if names is not None:
+            self._user_names, self._team_names = names.get('users', {}), names.get('teams', {})
+            return
+        self._user_names = self._fetch_names(User, objs, self.user_ref_field, self.user_name_field in self.fields)
+        self._team_names = self._fetch_names(Team, objs, self.team_ref_field, self.team_name_field in self.fields)
+
+    @staticmethod
+    def _fetch_names(model, objs, ref_field, rendered=True):
+        if ref_field is None or not rendered:
+            return {}
+        pks = {_to_pk(getattr(obj, ref_field)) for obj in objs}
+        pks.discard(None)
+        if not pks:
+            return {}
+        rows = model.objects.filter(id__in=pks).values_list('id', 'name')
+        return {str(pk): name for pk, name in rows}
+
+    def resolve_user_name(self, obj):
+        if self._user_names is None:
+            self.prime_identities([obj])
+        return self._user_names.get(str(getattr(obj, self.user_ref_field)))
+
+    def resolve_team_name(self, obj):
+        if self._team_names is None:
+            self.prime_identities([obj])
+        return self._team_names.get(str(getattr(obj, self.team_ref_field)))
+
+    def to_representation(self, instance):
+        # A standalone serializer may be reused; only the list serializer
+        # keeps a page-wide cache across rows.
+        if not isinstance(self.parent, IdentityResolvingListSerializer):
+            self._user_names = self._team_names = None
+        return super().to_representation(instance)
+
+
+class UserSerializer(TimedRepresentationMixin, SparseFieldsetMixin, IdentityResolverMixin, serializers.ModelSerializer):
     team_name = serializers.SerializerMethodField()
+    team_ref_field = 'team_id'
+    team_name_field = 'team_name'
+    field_sources = {'team_name': ['team_id']}
     
     class Meta:
         model = User
-        fields = ['id', 'name', 'email', 'password', 'team_id', 'team_name', 'created_at']
+        fields = ['id', 'name', 'email', 'password', 'team_id', 'team_name', 'created_at', 'updated_at']
         extra_kwargs = {'password': {'write_only': True}}
+        list_serializer_class = IdentityResolvingListSerializer
     
     def get_team_name(self, obj):
         """Get the team name for the team_id"""
         if obj.team_id:
-            try:
-                team = Team.objects.get(id=obj.team_id)
-                return team.name
-            except Team.DoesNotExist:
-                return None
+            return self.resolve_team_name(obj)
         return None
 
 
-class TeamSerializer(serializers.ModelSerializer):
-    member_count = serializers.SerializerMethodField()
-    
+class TeamSerializer(TimedRepresentationMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Team
-        fields = ['id', 'name', 'description', 'created_at', 'member_count']
-    
-    def get_member_count(self, obj):
-        """Count the number of users assigned to this team"""
-        return User.objects.filter(team_id=str(obj.id)).count()
+        fields = ['id', 'name', 'description', 'created_at', 'member_count', 'updated_at']
+        read_only_fields = ['member_count']
 
 
-class ActivitySerializer(serializers.ModelSerializer):
+class ActivitySerializer(TimedRepresentationMixin, SparseFieldsetMixin, IdentityResolverMixin, serializers.ModelSerializer):
     user_username = serializers.SerializerMethodField()
     distance = serializers.SerializerMethodField()
+    user_ref_field = 'user_id'
+    user_name_field = 'user_username'
+    field_sources = {'user_username': ['user_id'], 'distance': ['activity_type', 'duration']}
     
     class Meta:
         model = Activity
-        fields = ['id', 'user_id', 'user_username', 'activity_type', 'duration', 'distance', 'calories_burned', 'date', 'notes']
+        fields = [
+            'id', 'user_id', 'user_username', 'activity_type', 'duration', 'distance', 'calories_burned', 'date', 'notes',
+            'updated_at'
+        ]
+        list_serializer_class = IdentityResolvingListSerializer
+        extra_kwargs = {'calories_burned': {'required': False}}
+
+    def validate(self, attrs):
+        # Activities logged without calories get the MET estimate, see metrics.py
+        if 'calories_burned' not in attrs and not self.partial:
+            attrs['calories_burned'] = estimate_calories(attrs['activity_type'], attrs['duration'])
+        return attrs
     
     def get_user_username(self, obj):
-        try:
-            user = User.objects.get(id=obj.user_id)
-            return user.name
-        except User.DoesNotExist:
-            return "Unknown User"
+        return self.resolve_user_name(obj) or "Unknown User"
     
     def get_distance(self, obj):
-        # Calculate estimated distance based on activity type and duration
-        # These are rough estimates
-        if obj.activity_type == 'Running':
-            return round(obj.duration * 0.15, 2)  # ~9 km/h pace
-        elif obj.activity_type == 'Cycling':
-            return round(obj.duration * 0.33, 2)  # ~20 km/h pace
-        elif obj.activity_type == 'Swimming':
-            return round(obj.duration * 0.05, 2)  # ~3 km/h pace
-        else:
-            return 0.0
-
-
-class LeaderboardSerializer(serializers.ModelSerializer):
+        # Estimated from the activity type's average pace, see metrics.py
+        return estimate_distance(obj.activity_type, obj.duration)
+
+
+class LeaderboardSerializer(TimedRepresentationMixin, SparseFieldsetMixin, IdentityResolverMixin, serializers.ModelSerializer):
     username = serializers.SerializerMethodField()
     team_name = serializers.SerializerMethodField()
+    rank = serializers.SerializerMethodField()
+    user_ref_field = 'user_id'
+    team_ref_field = 'team_id'
+    user_name_field = 'username'
+    team_name_field = 'team_name'
+    field_sources = {'username': ['user_id'], 'team_name': ['team_id'], 'rank': ['user_id']}
     
     class Meta:
         model = Leaderboard
-        fields = ['id', 'user_id', 'username', 'team_id', 'team_name', 'total_activities', 'total_calories', 'total_duration', 'total_distance', 'rank']
+        fields = [
+            'id', 'user_id', 'username', 'team_id', 'team_name', 'total_activities', 'total_calories', 'total_duration',
+            'total_distance', 'updated_at', 'rank'
+        ]
+        list_serializer_class = IdentityResolvingListSerializer
     
     def get_username(self, obj):
         """Get the username for the user_id"""
-        try:
-            user = User.objects.get(id=obj.user_id)
-            return user.name
-        except User.DoesNotExist:
-            return "Unknown User"
+        return self.resolve_user_name(obj) or "Unknown User"
     
     def get_team_name(self, obj):
         """Get the team name for the team_id"""
-        try:
-            team = Team.objects.get(id=obj.team_id)
-            return team.name
-        except Team.DoesNotExist:
-            return "No Team"
+        return self.resolve_team_name(obj) or "No Team"
+    
+    @property
+    def sort_metric(self):
+        return self.context.get('sort_by', 'total_calories')
+    
+    def model_fields(self):
+        columns = super().model_fields()
+        if 'rank' in self.fields and self.sort_metric not in columns:
+            columns.append(self.sort_metric)
+        return columns
+    
+    def get_rank(self, obj):
+        """Rank by the `sort_by` metric (default total_calories), computed on read from the rank index"""
+        ranks = self.context.get('ranks')
+        if ranks is not None:
+            return ranks.get(obj.user_id)
+        return leaderboard_ranks.rank_of(obj, self.sort_metric)
+
+
+class LeaderboardPeriodSerializer(TimedRepresentationMixin, SparseFieldsetMixin, IdentityResolverMixin, serializers.ModelSerializer):
+    username = serializers.SerializerMethodField()
+    rank = serializers.SerializerMethodField()
+    user_ref_field = 'user_id'
+    user_name_field = 'username'
+    field_sources = {'username': ['user_id'], 'rank': ['user_id']}
+    
+    class Meta:
+        model = LeaderboardPeriod
+        fields = ['user_id', 'username', 'total_activities', 'total_calories', 'total_duration', 'total_distance', 'rank']
+        list_serializer_class = IdentityResolvingListSerializer
+    
+    def get_username(self, obj):
+        """Get the username for the user_id"""
+        return self.resolve_user_name(obj) or "Unknown User"
+    
+    def get_rank(self, obj):
+        """Rank within the window, passed by the view as `ranks` in the context"""
+        return self.context.get('ranks', {}).get(obj.user_id)
+
+
+class TeamLeaderboardSerializer(TimedRepresentationMixin, SparseFieldsetMixin, serializers.ModelSerializer):
+    team_name = serializers.SerializerMethodField()
+    member_count = serializers.SerializerMethodField()
+    average_calories = serializers.SerializerMethodField()
+    average_duration = serializers.SerializerMethodField()
+    average_distance = serializers.SerializerMethodField()
+    rank = serializers.SerializerMethodField()
+    field_sources = {
+        'team_name': ['team_id'],
+        'member_count': ['team_id'],
+        'average_calories': ['team_id', 'total_calories'],
+        'average_duration': ['team_id', 'total_duration'],
+        'average_distance': ['team_id', 'total_distance'],
+        'rank': ['team_id'],
+    }
+    
+    class Meta:
+        model = TeamLeaderboard
+        fields = [
+            'team_id', 'team_name', 'member_count', 'total_activities', 'total_calories', 'total_duration',
+            'total_distance', 'average_calories', 'average_duration', 'average_distance', 'rank'
+        ]
+        list_serializer_class = IdentityResolvingListSerializer
+    
+    # Output fields that need the Team row
+    team_fields = ('team_name', 'member_count', 'average_calories', 'average_duration', 'average_distance')
+    _teams = None
+    
+    def prime_identities(self, objs):
+        """Fetch name and member_count for every team on the page in one query"""
+        if not self.fields.keys() & set(self.team_fields):
+            self._teams = {}
+            return
+        pks = {_to_pk(obj.team_id) for obj in objs}
+        pks.discard(None)
+        rows = Team.objects.filter(id__in=pks).values_list('id', 'name', 'member_count') if pks else []
+        self._teams = {str(pk): (name, member_count) for pk, name, member_count in rows}
+    
+    def _team(self, obj):
+        if self._teams is None or not isinstance(self.parent, IdentityResolvingListSerializer):
+            self.prime_identities([obj])
+        return self._teams.get(str(obj.team_id), ("No Team", 0))
+    
+    def _average(self, obj, field):
+        members = self._team(obj)[1]
+        return round(getattr(obj, field) / members, 2) if members else 0
+    
+    def get_team_name(self, obj):
+        return self._team(obj)[0]
+    
+    def get_member_count(self, obj):
+        return self._team(obj)[1]
+    
+    def get_average_calories(self, obj):
+        return self._average(obj, 'total_calories')
+    
+    def get_average_duration(self, obj):
+        return self._average(obj, 'total_duration')
+    
+    def get_average_distance(self, obj):
+        return self._average(obj, 'total_distance')
+    
+    def get_rank(self, obj):
+        """Standing, passed by the view as `ranks` (by team_id) in the context"""
+        return self.context.get('ranks', {}).get(obj.team_id)
 
 
-class WorkoutSerializer(serializers.ModelSerializer):
+class WorkoutSerializer(TimedRepresentationMixin, SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Workout
-        fields = ['id', 'name', 'description', 'difficulty', 'duration', 'calories_estimate', 'exercises']
+        fields = ['id', 'name', 'description', 'difficulty', 'duration', 'calories_estimate', 'exercises', 'updated_at']
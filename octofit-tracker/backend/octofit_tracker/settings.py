@@ -58,6 +58,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'octofit_tracker.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -92,18 +93,39 @@ WSGI_APPLICATION = 'octofit_tracker.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# CLIENT is passed to pymongo.MongoClient. Every process (each gunicorn
+# worker) builds its own client, so the server sees up to
+# workers x maxPoolSize connections, plus OCTOFIT_ASYNC_MAX_POOL_SIZE per
+# process serving /api/async/. The defaults are the driver's own; check
+# /api/_pool/ under load before changing them. A read preference other than
+# 'primary' also sends reads right after a write to possibly lagging
+# secondaries; OCTOFIT_MONGO_LIST_READ_PREFERENCE below only routes the async
+# list reads.
+MONGO_WRITE_CONCERN = os.environ.get('OCTOFIT_MONGO_WRITE_CONCERN', '1')
+
 DATABASES = {
     'default': {
         'ENGINE': 'djongo',
-        'NAME': 'octofit_db',
+        'NAME': os.environ.get('OCTOFIT_MONGO_DB', 'octofit_db'),
         'ENFORCE_SCHEMA': False,
         'CLIENT': {
-            'host': 'localhost',
-            'port': 27017,
+            'host': os.environ.get('OCTOFIT_MONGO_HOST', 'localhost'),
+            'port': int(os.environ.get('OCTOFIT_MONGO_PORT', 27017)),
+            'maxPoolSize': int(os.environ.get('OCTOFIT_MONGO_MAX_POOL_SIZE', 100)),
+            'minPoolSize': int(os.environ.get('OCTOFIT_MONGO_MIN_POOL_SIZE', 0)),
+            'serverSelectionTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000)),
+            'socketTimeoutMS': int(os.environ.get('OCTOFIT_MONGO_SOCKET_TIMEOUT_MS', 0)),  # 0: no timeout
+            'readPreference': os.environ.get('OCTOFIT_MONGO_READ_PREFERENCE', 'primary'),
+            'w': int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN,
         }
     }
 }
 
+# Ping MongoDB when a WSGI/ASGI worker starts: 'off', 'warn' (log and keep
+# booting) or 'fail' (refuse to start)
+OCTOFIT_MONGO_STARTUP_PROBE = os.environ.get('OCTOFIT_MONGO_STARTUP_PROBE', 'warn')
+OCTOFIT_MONGO_PROBE_TIMEOUT_MS = int(os.environ.get('OCTOFIT_MONGO_PROBE_TIMEOUT_MS', 2000))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -182,4 +204,80 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
 ]
+CORS_EXPOSE_HEADERS = ['etag', 'server-timing']
+
+# Django REST Framework
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.OctofitCursorPagination',
+    'PAGE_SIZE': int(os.environ.get('OCTOFIT_PAGE_SIZE', 50)),
+}
+
+# Upper bound for the ?page_size= query parameter
+OCTOFIT_MAX_PAGE_SIZE = int(os.environ.get('OCTOFIT_MAX_PAGE_SIZE', 500))
+
+# Delta sync (?since=): how far watermarks trail the clock, and how long
+# deletes are remembered (older watermarks must resync from scratch)
+OCTOFIT_SYNC_SKEW_SECONDS = int(os.environ.get('OCTOFIT_SYNC_SKEW_SECONDS', 5))
+OCTOFIT_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('OCTOFIT_TOMBSTONE_RETENTION_DAYS', 30))
+
+# Bulk activity ingest (/api/activities/bulk/)
+OCTOFIT_BULK_BATCH_SIZE = int(os.environ.get('OCTOFIT_BULK_BATCH_SIZE', 500))
+OCTOFIT_BULK_MAX_ITEMS = int(os.environ.get('OCTOFIT_BULK_MAX_ITEMS', 10000))
+
+# Write-behind activity creates, see ingest.py: POST /api/activities/ answers
+# 202 and a flusher thread writes batches of BATCH_SIZE or every FLUSH_MS;
+# creates get a 503 while QUEUE_SIZE activities are waiting
+OCTOFIT_WRITE_BEHIND = os.environ.get('OCTOFIT_WRITE_BEHIND', 'false').lower() == 'true'
+OCTOFIT_WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get('OCTOFIT_WRITE_BEHIND_QUEUE_SIZE', 10000))
+OCTOFIT_WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('OCTOFIT_WRITE_BEHIND_BATCH_SIZE', 500))
+OCTOFIT_WRITE_BEHIND_FLUSH_MS = int(os.environ.get('OCTOFIT_WRITE_BEHIND_FLUSH_MS', 200))
+
+# Rows serialized per chunk by streaming exports (/api/activities/export/)
+OCTOFIT_EXPORT_CHUNK_SIZE = int(os.environ.get('OCTOFIT_EXPORT_CHUNK_SIZE', 1000))
+
+# Versioned response cache for the leaderboard and teams lists. BACKEND is
+# 'lru' (per process), 'django' (the CACHES alias below) or 'off'. TIMEOUT
+# also bounds how long an LRU worker serves pages another worker invalidated.
+OCTOFIT_RESPONSE_CACHE = {
+    'BACKEND': os.environ.get('OCTOFIT_RESPONSE_CACHE_BACKEND', 'lru'),
+    'MAX_ENTRIES': int(os.environ.get('OCTOFIT_RESPONSE_CACHE_MAX_ENTRIES', 256)),
+    'ALIAS': 'default',
+    'TIMEOUT': int(os.environ.get('OCTOFIT_RESPONSE_CACHE_TIMEOUT', 300)),
+}
+
+# Live leaderboard events (/api/leaderboard/events/, ASGI only). BACKEND is
+# 'memory' (clients of the writing process), 'redis' (needs redis-py), a
+# dotted path to a backend class, or 'off'; empty means 'memory' in processes
+# started through asgi.py and 'off' elsewhere.
+OCTOFIT_EVENTS = {
+    'BACKEND': os.environ.get('OCTOFIT_EVENTS_BACKEND', ''),
+    'URL': os.environ.get('OCTOFIT_EVENTS_REDIS_URL', 'redis://localhost:6379/0'),
+    'CHANNEL': os.environ.get('OCTOFIT_EVENTS_CHANNEL', 'octofit:events'),
+}
+# Open SSE connections per worker, events buffered per connection before a
+# slow client is dropped, and seconds between keep-alive comments
+OCTOFIT_SSE_MAX_CLIENTS = int(os.environ.get('OCTOFIT_SSE_MAX_CLIENTS', 10000))
+OCTOFIT_SSE_QUEUE_SIZE = int(os.environ.get('OCTOFIT_SSE_QUEUE_SIZE', 100))
+OCTOFIT_SSE_HEARTBEAT_SECONDS = int(os.environ.get('OCTOFIT_SSE_HEARTBEAT_SECONDS', 15))
+
+# Leaderboard rank index: seconds before a worker reloads it from the database
+OCTOFIT_RANK_INDEX_TTL = int(os.environ.get('OCTOFIT_RANK_INDEX_TTL', 60))
+
+# Connection pool (and query thread pool) size behind the async /api/async/ views
+OCTOFIT_ASYNC_MAX_POOL_SIZE = int(
+    os.environ.get('OCTOFIT_ASYNC_MAX_POOL_SIZE', DATABASES['default']['CLIENT']['maxPoolSize'])
+)
+# Read preference of the async list endpoints, e.g. 'secondaryPreferred'
+OCTOFIT_MONGO_LIST_READ_PREFERENCE = os.environ.get(
+    'OCTOFIT_MONGO_LIST_READ_PREFERENCE', DATABASES['default']['CLIENT']['readPreference']
+)
+
+# Per-request Server-Timing headers and /api/_metrics/ histograms
+OCTOFIT_REQUEST_METRICS = os.environ.get('OCTOFIT_REQUEST_METRICS', 'true').lower() == 'true'
+
+# Windowed leaderboards (?window=week|month): how many past weekly and monthly
+# buckets are kept before rebuild_leaderboard expires them
+OCTOFIT_WINDOW_RETENTION_WEEKS = int(os.environ.get('OCTOFIT_WINDOW_RETENTION_WEEKS', 12))
+OCTOFIT_WINDOW_RETENTION_MONTHS = int(os.environ.get('OCTOFIT_WINDOW_RETENTION_MONTHS', 12))
@@ -0,0 +1,43 @@
+"""
+Invalidate cached list responses when the underlying models are saved, and
+record a Tombstone for every deleted row of a synced model.
+
+Covers every ORM write (API, admin, management commands). Bulk writes that
+bypass signals, such as the F-expression updates in aggregates.py, bump the
+versions themselves; raw deletes (`aggregates.raw_delete`) leave no
+tombstones.
+"""
+from django.db.models.signals import post_delete, post_save
+
+from .cache import response_cache
+from .models import Activity, Leaderboard, Team, Tombstone, User, Workout
+
+# Cached scopes whose responses embed data from each model
+CACHE_SCOPES = {
+    User: ('leaderboard', 'teams'),
+    Team: ('teams', 'leaderboard'),
+    Leaderboard: ('leaderboard',),
+}
+
+
+def bump_cache_versions(sender, **kwargs):
+    response_cache.bump(*CACHE_SCOPES[sender])
+
+
+for model in CACHE_SCOPES:
+    post_save.connect(bump_cache_versions, sender=model, dispatch_uid=f'cache-save-{model.__name__}')
+    post_delete.connect(bump_cache_versions, sender=model, dispatch_uid=f'cache-delete-{model.__name__}')
+
+
+# Models served with ?since= delta sync, see sync.py
+SYNCED_MODELS = (User, Team, Activity, Leaderboard, Workout)
+
+
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        resource=sender._meta.db_table, object_id=instance.pk, user_id=getattr(instance, 'user_id', '') or ''
+    )
+
+
+for model in SYNCED_MODELS:
+    post_delete.connect(record_tombstone, sender=model, dispatch_uid=f'tombstone-{model.__name__}')
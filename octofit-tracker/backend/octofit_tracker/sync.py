@@ -0,0 +1,111 @@
+"""
+Delta sync for the list endpoints: `?since=<watermark>`.
+
+Synced models carry an `updated_at` that moves on every write, and deletes
+leave a `Tombstone` (see signals.py). A list request with `?since=` returns
+only the rows changed after the watermark, oldest change first with cursor
+pagination, and adds two keys:
+
+    watermark   pass it as ?since= on the next sync
+    deleted     ids deleted since the watermark; sent on the last page only,
+                so deletes made while a client pages are not missed
+
+Start with `?since=0`. Watermarks trail the clock by OCTOFIT_SYNC_SKEW_SECONDS
+so that writes still in flight while a page was read are sent again next time
+instead of being skipped; clients apply rows and deletes idempotently.
+Tombstones are pruned after OCTOFIT_TOMBSTONE_RETENTION_DAYS and older
+watermarks get a 410, after which the client starts over from 0.
+
+Only stored fields are tracked: names resolved from other collections and
+leaderboard ranks are current as of the sync that returned the row.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from .models import Tombstone
+from .pagination import OctofitCursorPagination
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+# Query parameters that may accompany ?since=
+SYNC_PARAMS = {'since', 'cursor', 'page_size', 'fields', 'exclude', 'format'}
+
+
+def to_watermark(moment):
+    """Microseconds since the epoch, as an opaque integer token"""
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+
+def from_watermark(value):
+    try:
+        micros = int(value)
+    except ValueError:
+        micros = -1
+    if micros < 0:
+        raise ValidationError({'since': 'Must be 0 or a watermark returned by an earlier sync.'})
+    return EPOCH + timedelta(microseconds=micros)
+
+
+class SyncCursorPagination(OctofitCursorPagination):
+    """Oldest change first; ignores the view's own ordering"""
+    ordering = ('updated_at', 'id')
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+
+def prune_tombstones(now=None):
+    """Delete tombstones past retention; returns how many were removed"""
+    cutoff = (now or timezone.now()) - timedelta(days=settings.OCTOFIT_TOMBSTONE_RETENTION_DAYS)
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
+
+
+class DeltaSyncMixin:
+    """
+    Serves `list` as a delta sync when `?since=` is given.
+
+    List it before CachedListMixin: delta responses depend on the clock and
+    are never cached. Other filters and sorts cannot be combined with it.
+    """
+
+    def delta_requested(self):
+        return self.action == 'list' and 'since' in self.request.query_params
+
+    @property
+    def paginator(self):
+        if not self.delta_requested():
+            return super().paginator
+        if not hasattr(self, '_sync_paginator'):
+            self._sync_paginator = SyncCursorPagination()
+        return self._sync_paginator
+
+    def list(self, request, *args, **kwargs):
+        if not self.delta_requested():
+            return super().list(request, *args, **kwargs)
+        started = timezone.now()
+        since = from_watermark(request.query_params['since'])
+        unsupported = sorted(set(request.query_params) - SYNC_PARAMS)
+        if unsupported:
+            raise ValidationError({param: 'Cannot be combined with since.' for param in unsupported})
+        retention = timedelta(days=settings.OCTOFIT_TOMBSTONE_RETENTION_DAYS)
+        if EPOCH < since < started - retention:
+            return Response(
+                {'since': 'Watermark is older than the tombstone retention; sync again from 0.'},
+                status=status.HTTP_410_GONE
+            )
+
+        page = self.paginate_queryset(self.get_queryset().filter(updated_at__gt=since))
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        deleted = []
+        if response.data['next'] is None and since > EPOCH:
+            tombstones = Tombstone.objects.filter(resource=self.queryset.model._meta.db_table, deleted_at__gt=since)
+            deleted = list(tombstones.values_list('object_id', flat=True))
+        response.data['watermark'] = to_watermark(started - timedelta(seconds=settings.OCTOFIT_SYNC_SKEW_SECONDS))
+        response.data['deleted'] = deleted
+        return response
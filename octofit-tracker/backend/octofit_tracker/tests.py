@@ -1,9 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
-from datetime import datetime
+from .models import User, Team, Activity, ActivityDailyRollup, Leaderboard, TeamLeaderboard, Workout
+from .query_plans import QueryPlanAssertionsMixin, plan_problems
+from .serializers import ActivitySerializer
+from .ranking import RankIndex, leaderboard_ranks
+from datetime import datetime, timedelta
 
 
 class UserModelTest(TestCase):
@@ -57,14 +61,14 @@ class LeaderboardModelTest(TestCase):
             team_id="1",
             total_activities=10,
             total_calories=1000,
-            total_duration=300,
-            rank=1
+            total_duration=300
         )
+        leaderboard_ranks.invalidate()
 
     def test_leaderboard_creation(self):
         self.assertEqual(self.leaderboard.total_activities, 10)
         self.assertEqual(self.leaderboard.total_calories, 1000)
-        self.assertEqual(self.leaderboard.rank, 1)
+        self.assertEqual(leaderboard_ranks.rank_of(self.leaderboard), 1)
 
 
 class WorkoutModelTest(TestCase):
@@ -123,6 +127,15 @@ class ActivityAPITest(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_missing_calories_are_estimated(self):
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': '1', 'activity_type': 'Running', 'duration': 30, 'date': '2024-06-01T08:00:00Z', 'notes': ''
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['calories_burned'], 343)  # MET 9.8 * 70 kg * 0.5 h
+        url = reverse('activity-detail', args=[response.data['id']])
+        self.assertEqual(self.client.patch(url, {'duration': 60}, format='json').data['calories_burned'], 343)
+
 
 class LeaderboardAPITest(APITestCase):
     def test_get_leaderboard_list(self):
@@ -136,3 +149,1711 @@ class WorkoutAPITest(APITestCase):
         url = reverse('workout-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+@override_settings(OCTOFIT_RESPONSE_CACHE={'BACKEND': None})
+class IdentityResolutionQueryCountTest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Query Team", description="Counting queries")
+        self.seeded = 0
+        leaderboard_ranks.invalidate()
+
+    def _seed(self, rows):
+        for i in range(self.seeded, self.seeded + rows):
+            user = User.objects.create(
+                name=f"User {i}",
+                email=f"user{i}@example.com",
+                password="testpass123",
+                team_id=str(self.team.id)
+            )
+            Activity.objects.create(
+                user_id=str(user.id),
+                activity_type="Running",
+                duration=30,
+                calories_burned=300,
+                date=datetime.now(),
+                notes=""
+            )
+            Leaderboard.objects.create(user_id=str(user.id), team_id=str(self.team.id))
+        self.seeded += rows
+
+    def _count_queries(self, url_name):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        # Warm up process-wide state such as the rank index first
+        self.client.get(reverse(url_name))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(ctx.captured_queries)
+
+    def test_list_query_count_is_independent_of_page_size(self):
+        self._seed(1)
+        small = {name: self._count_queries(name) for name in ('activity-list', 'leaderboard-list', 'user-list')}
+        self._seed(20)
+        large = {name: self._count_queries(name) for name in ('activity-list', 'leaderboard-list', 'user-list')}
+        self.assertEqual(small, large)
+
+    def test_names_are_resolved(self):
+        self._seed(2)
+        response = self.client.get(reverse('leaderboard-list'))
+        self.assertEqual(
+            sorted(row['username'] for row in response.data['results']),
+            ["User 0", "User 1"]
+        )
+        self.assertEqual(response.data['results'][0]['team_name'], "Query Team")
+
+
+class IncrementalLeaderboardTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(
+            name="Runner",
+            email="runner@example.com",
+            password="testpass123",
+            team_id="7"
+        )
+        self.url = reverse('activity-list')
+        leaderboard_ranks.invalidate()
+
+    def _post(self, **overrides):
+        data = {
+            'user_id': str(self.user.id),
+            'activity_type': 'Running',
+            'duration': 30,
+            'calories_burned': 300,
+            'date': '2024-01-01T08:00:00Z',
+            'notes': ''
+        }
+        data.update(overrides)
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def _entry(self):
+        return Leaderboard.objects.get(user_id=str(self.user.id))
+
+    def test_create_adds_to_totals(self):
+        self._post()
+        self._post(activity_type='Cycling', duration=60, calories_burned=500)
+        entry = self._entry()
+        self.assertEqual(entry.team_id, "7")
+        self.assertEqual(entry.total_activities, 2)
+        self.assertEqual(entry.total_calories, 800)
+        self.assertEqual(entry.total_duration, 90)
+        self.assertAlmostEqual(entry.total_distance, 4.5 + 19.8)
+
+    def test_update_replaces_contribution(self):
+        activity_id = self._post()
+        url = reverse('activity-detail', args=[activity_id])
+        response = self.client.patch(url, {'calories_burned': 450, 'duration': 40}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        entry = self._entry()
+        self.assertEqual(entry.total_activities, 1)
+        self.assertEqual(entry.total_calories, 450)
+        self.assertEqual(entry.total_duration, 40)
+        self.assertAlmostEqual(entry.total_distance, 6.0)
+
+    def test_delete_retracts_contribution(self):
+        activity_id = self._post()
+        self._post(calories_burned=100)
+        response = self.client.delete(reverse('activity-detail', args=[activity_id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        entry = self._entry()
+        self.assertEqual(entry.total_activities, 1)
+        self.assertEqual(entry.total_calories, 100)
+
+
+class NativeCounterWritesTest(APITestCase):
+    """Counter writes as issued on MongoDB: native $inc, never the F() SQL djongo cannot translate"""
+
+    def setUp(self):
+        self.team = Team.objects.create(name="Counters", description="")
+        self.user = User.objects.create(name="Counter", email="counter@example.com", password="pw", team_id="")
+
+    def _native_writes(self):
+        """Run with djongo's collections replaced by a recorder; yields (collection, filter, update) calls"""
+        from contextlib import ExitStack
+        from types import SimpleNamespace
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        calls = []
+
+        class Collection:
+            def __init__(self, name):
+                self.name = name
+
+            def update_one(self, lookup, update):
+                calls.append((self.name, lookup, update))
+                return SimpleNamespace(matched_count=1)
+
+        stack = ExitStack()
+        stack.enter_context(mock.patch('octofit_tracker.mongo.uses_mongo', return_value=True))
+        stack.enter_context(mock.patch('octofit_tracker.mongo.collection', lambda name, alias='default': Collection(name)))
+        self.queries = stack.enter_context(CaptureQueriesContext(connection))
+        self.calls = calls
+        return stack
+
+    def _arithmetic_updates(self, table):
+        return [
+            query['sql'] for query in self.queries.captured_queries
+            if query['sql'].startswith(f'UPDATE "{table}"') and ' + ' in query['sql']
+        ]
+
+    def _inc(self, collection):
+        return [(lookup, update['$inc']) for name, lookup, update in self.calls if name == collection]
+
+    def _log(self, date='2024-06-03T08:00:00Z'):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user.id), 'activity_type': 'Running', 'duration': 30,
+            'calories_burned': 250, 'date': date, 'notes': ''
+        }, format='json')
+
+    def test_leaderboard_totals_use_inc(self):
+        with self._native_writes():
+            self.assertEqual(self._log().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self._inc('leaderboard'), [({'user_id': str(self.user.id)}, {
+            'total_activities': 1, 'total_calories': 250, 'total_duration': 30, 'total_distance': 4.5
+        })])
+        self.assertIn('updated_at', next(update for name, _, update in self.calls if name == 'leaderboard')['$set'])
+        self.assertEqual(self._arithmetic_updates('leaderboard'), [])
+
+    def test_daily_rollups_use_inc(self):
+        from datetime import date
+        from django.db import connection
+        with self._native_writes():
+            self._log()
+        day = ActivityDailyRollup._meta.get_field('day').get_db_prep_value(date(2024, 6, 3), connection)
+        self.assertEqual(self._inc('activity_daily_rollups'), [(
+            {'user_id': str(self.user.id), 'day': day, 'activity_type': 'Running'},
+            {'total_activities': 1, 'total_calories': 250, 'total_duration': 30, 'total_distance': 4.5}
+        )])
+        self.assertEqual(self._arithmetic_updates('activity_daily_rollups'), [])
+
+    def test_period_buckets_use_inc(self):
+        from django.db import connection
+        from .models import LeaderboardPeriod
+        today = timezone.localdate()
+        with self._native_writes():
+            self._log(timezone.now().isoformat())
+        start = LeaderboardPeriod._meta.get_field('start')
+        self.assertEqual([(lookup['period'], lookup['start'], inc['total_calories'])
+                          for lookup, inc in self._inc('leaderboard_periods')], [
+            ('week', start.get_db_prep_value(today - timedelta(days=today.weekday()), connection), 250),
+            ('month', start.get_db_prep_value(today.replace(day=1), connection), 250),
+        ])
+        self.assertEqual(self._arithmetic_updates('leaderboard_periods'), [])
+
+    def test_team_aggregates_use_inc(self):
+        Leaderboard.objects.create(user_id=str(self.user.id), team_id=str(self.team.id))
+        with self._native_writes():
+            self._log()
+        self.assertEqual(self._inc('team_leaderboard'), [({'team_id': str(self.team.id)}, {
+            'total_activities': 1, 'total_calories': 250, 'total_duration': 30, 'total_distance': 4.5
+        })])
+        self.assertEqual(self._arithmetic_updates('team_leaderboard'), [])
+
+    def test_member_counts_use_inc(self):
+        other = Team.objects.create(name="Others", description="")
+        with self._native_writes():
+            url = reverse('user-detail', args=[self.user.id])
+            self.client.patch(url, {'team_id': str(self.team.id)}, format='json')
+            self.client.patch(url, {'team_id': str(other.id)}, format='json')
+        self.assertEqual(self._inc('teams'), [
+            ({'id': self.team.id}, {'member_count': 1}),
+            ({'id': self.team.id}, {'member_count': -1}),
+            ({'id': other.id}, {'member_count': 1}),
+        ])
+        self.assertEqual(self._arithmetic_updates('teams'), [])
+
+
+class RankIndexTest(TestCase):
+    def test_matches_sorted_order(self):
+        import random
+        rng = random.Random(3)
+        index = RankIndex()
+        scores = {}
+        for step in range(2000):
+            member = str(rng.randrange(300))
+            if step % 7 == 0:
+                index.remove(member)
+                scores.pop(member, None)
+            else:
+                scores[member] = rng.randrange(1000)
+                index.update(member, scores[member], int(member))
+        expected = sorted(scores, key=lambda m: (-scores[m], int(m)))
+        self.assertEqual(len(index), len(expected))
+        self.assertEqual([m for _, m, _ in index.top(len(expected))], expected)
+        for rank, member in enumerate(expected, start=1):
+            self.assertEqual(index.rank(member), rank)
+
+    def test_around(self):
+        index = RankIndex()
+        for i, score in enumerate([50, 40, 30, 20, 10]):
+            index.update(str(i), score)
+        self.assertEqual([m for _, m, _ in index.around('0', 1)], ['0', '1'])
+        self.assertEqual([r for r, _, _ in index.around('2', 1)], [2, 3, 4])
+        self.assertEqual(index.around('missing', 1), [])
+
+
+class LeaderboardRankAPITest(APITestCase):
+    def setUp(self):
+        for i, calories in enumerate([300, 900, 600]):
+            Leaderboard.objects.create(user_id=str(i + 1), team_id="1", total_calories=calories)
+        leaderboard_ranks.invalidate()
+
+    def test_rank_is_computed_on_read(self):
+        response = self.client.get(reverse('leaderboard-list'))
+        self.assertEqual(
+            [(row['user_id'], row['rank']) for row in response.data['results']],
+            [("2", 1), ("3", 2), ("1", 3)]
+        )
+
+    def test_rank_follows_activity_writes(self):
+        self.client.get(reverse('leaderboard-list'))
+        self.client.post(reverse('activity-list'), {
+            'user_id': '1',
+            'activity_type': 'Yoga',
+            'duration': 60,
+            'calories_burned': 700,
+            'date': '2024-01-01T08:00:00Z',
+            'notes': ''
+        }, format='json')
+        response = self.client.get(reverse('leaderboard-top'), {'k': 1})
+        self.assertEqual([(row['user_id'], row['rank']) for row in response.data], [("1", 1)])
+
+    def test_around(self):
+        response = self.client.get(reverse('leaderboard-around'), {'user_id': '1', 'radius': 1})
+        self.assertEqual([row['rank'] for row in response.data], [2, 3])
+
+    @override_settings(OCTOFIT_MAX_PAGE_SIZE=2)
+    def test_top_and_around_are_bounded(self):
+        self.assertEqual(len(self.client.get(reverse('leaderboard-top'), {'k': 100000}).data), 2)
+        response = self.client.get(reverse('leaderboard-around'), {'user_id': '3', 'radius': 100000})
+        self.assertEqual(len(response.data), 3)
+        for name, params in (('leaderboard-top', {'k': -1}), ('leaderboard-top', {'k': 'x'}),
+                             ('leaderboard-around', {'user_id': '1', 'radius': -2})):
+            self.assertEqual(self.client.get(reverse(name), params).status_code, status.HTTP_400_BAD_REQUEST, params)
+
+
+class CursorPaginationTest(APITestCase):
+    def setUp(self):
+        for day in range(1, 8):
+            Activity.objects.create(
+                user_id="1",
+                activity_type="Running",
+                duration=30,
+                calories_burned=300,
+                date=f"2024-01-0{day}T08:00:00Z",
+                notes=""
+            )
+
+    def test_walks_activities_newest_first(self):
+        url = reverse('activity-list') + '?page_size=3'
+        dates = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            dates.extend(row['date'][:10] for row in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(dates, [f"2024-01-0{day}" for day in range(7, 0, -1)])
+
+    def test_page_size_is_capped(self):
+        with self.settings(OCTOFIT_MAX_PAGE_SIZE=2):
+            response = self.client.get(reverse('activity-list'), {'page_size': 100})
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class TeamMemberCountTest(APITestCase):
+    def setUp(self):
+        self.red = Team.objects.create(name="Red", description="")
+        self.blue = Team.objects.create(name="Blue", description="")
+
+    def _count(self, team):
+        team.refresh_from_db()
+        return team.member_count
+
+    def test_user_writes_maintain_counts(self):
+        response = self.client.post(reverse('user-list'), {
+            'name': 'Member',
+            'email': 'member@example.com',
+            'password': 'testpass123',
+            'team_id': str(self.red.id)
+        }, format='json')
+        self.assertEqual(self._count(self.red), 1)
+
+        url = reverse('user-detail', args=[response.data['id']])
+        self.client.patch(url, {'team_id': str(self.blue.id)}, format='json')
+        self.assertEqual((self._count(self.red), self._count(self.blue)), (0, 1))
+
+        self.client.delete(url)
+        self.assertEqual(self._count(self.blue), 0)
+
+    def test_teams_list_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse('team-list'))
+
+    def test_reconcile_command_fixes_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+        User.objects.create(name="A", email="a@example.com", password="x", team_id=str(self.red.id))
+        out = StringIO()
+        call_command('reconcile_team_counts', stdout=out)
+        self.assertIn('Fixed 1', out.getvalue())
+        self.assertEqual(self._count(self.red), 1)
+
+
+class ActivityStatsTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('activity-list')
+        for day, activity_type, calories in [
+            ('2024-01-01', 'Running', 300),  # Monday
+            ('2024-01-01', 'Running', 200),
+            ('2024-01-03', 'Cycling', 400),
+            ('2024-01-08', 'Running', 100),  # next Monday
+            ('2024-02-01', 'Yoga', 50),
+        ]:
+            self.client.post(self.url, {
+                'user_id': '1',
+                'activity_type': activity_type,
+                'duration': 30,
+                'calories_burned': calories,
+                'date': f'{day}T08:00:00Z',
+                'notes': ''
+            }, format='json')
+
+    def _stats(self, **params):
+        params = {'user_id': '1', 'start': '2024-01-01', 'end': '2024-02-29', **params}
+        response = self.client.get(reverse('activity-stats'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(str(row['period']), row['total_activities'], row['total_calories']) for row in response.data['results']]
+
+    def test_rollups_are_maintained_on_write(self):
+        rollup = ActivityDailyRollup.objects.get(user_id='1', day='2024-01-01', activity_type='Running')
+        self.assertEqual((rollup.total_activities, rollup.total_calories), (2, 500))
+
+    def test_buckets(self):
+        self.assertEqual(self._stats(bucket='day'), [
+            ('2024-01-01', 2, 500), ('2024-01-03', 1, 400), ('2024-01-08', 1, 100), ('2024-02-01', 1, 50)
+        ])
+        self.assertEqual(self._stats(bucket='week'), [
+            ('2024-01-01', 3, 900), ('2024-01-08', 1, 100), ('2024-01-29', 1, 50)
+        ])
+        self.assertEqual(self._stats(bucket='month'), [('2024-01-01', 4, 1000), ('2024-02-01', 1, 50)])
+
+    def test_range_and_type_filters(self):
+        self.assertEqual(self._stats(end='2024-01-07', activity_type='Running'), [('2024-01-01', 2, 500)])
+
+    def test_delete_updates_rollups(self):
+        activity = Activity.objects.get(calories_burned=400)
+        self.client.delete(reverse('activity-detail', args=[activity.id]))
+        self.assertEqual(self._stats(bucket='month'), [('2024-01-01', 3, 600), ('2024-02-01', 1, 50)])
+
+    def test_invalid_parameters(self):
+        response = self.client.get(reverse('activity-stats'), {'bucket': 'year', 'start': 'soon'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data), {'user_id', 'bucket', 'start'})
+
+    def test_rebuild_matches_incremental(self):
+        from .aggregates import rebuild_daily_rollups
+        fields = ('user_id', 'day', 'activity_type', 'total_activities', 'total_calories', 'total_duration')
+        incremental = sorted(ActivityDailyRollup.objects.values_list(*fields))
+        rebuild_daily_rollups()
+        self.assertEqual(sorted(ActivityDailyRollup.objects.values_list(*fields)), incremental)
+
+
+class BulkActivityIngestTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('activity-bulk')
+        leaderboard_ranks.invalidate()
+
+    def _item(self, user_id, calories=100, **overrides):
+        item = {
+            'user_id': user_id,
+            'activity_type': 'Running',
+            'duration': 20,
+            'calories_burned': calories,
+            'date': '2024-03-01T07:00:00Z',
+            'notes': ''
+        }
+        item.update(overrides)
+        return item
+
+    @override_settings(OCTOFIT_BULK_BATCH_SIZE=2)
+    def test_failed_batch_is_rolled_back_with_its_totals(self):
+        from unittest import mock
+        from . import aggregates
+        record = aggregates.record_activities
+        calls = []
+
+        def fail_second_batch(batch):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                aggregates._Changes().add(batch[:1], 1).apply()  # partway through
+                raise RuntimeError('lost connection')
+            record(batch)
+
+        payload = [self._item('1', calories=10 * (i + 1)) for i in range(4)]
+        with mock.patch.object(aggregates, 'record_activities', fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.url, payload, format='json')
+        self.assertEqual(sorted(Activity.objects.values_list('calories_burned', flat=True)), [10, 20])
+        entry = Leaderboard.objects.get(user_id='1')
+        self.assertEqual((entry.total_activities, entry.total_calories), (2, 30))
+
+    def test_json_array_with_per_item_errors(self):
+        payload = [self._item('1'), self._item('1', duration='long'), self._item('2'), {}]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 3])
+        self.assertIn('duration', response.data['errors'][0]['errors'])
+        self.assertEqual(Activity.objects.count(), 2)
+
+    def test_ndjson_stream_updates_totals_once_per_user(self):
+        import json
+        lines = [json.dumps(self._item(str(i % 3), calories=10)) for i in range(30)]
+        for user_id in '012':
+            Leaderboard.objects.create(user_id=user_id, team_id='')
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, '\n'.join(lines) + '\n', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 30, 'errors': []})
+        leaderboard_updates = [q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "leaderboard"')]
+        self.assertEqual(len(leaderboard_updates), 3)
+        self.assertEqual(
+            sorted(Leaderboard.objects.values_list('user_id', 'total_activities', 'total_calories')),
+            [('0', 10, 100), ('1', 10, 100), ('2', 10, 100)]
+        )
+
+    def test_rejects_non_list_payload(self):
+        response = self.client.post(self.url, self._item('1'), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batches(self):
+        with self.settings(OCTOFIT_BULK_BATCH_SIZE=2):
+            response = self.client.post(self.url, [self._item('1') for _ in range(5)], format='json')
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual(Leaderboard.objects.get(user_id='1').total_activities, 5)
+
+
+class ActivityExportTest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Exporters", description="")
+        self.member = User.objects.create(
+            name="Member", email="member@example.com", password="x", team_id=str(self.team.id)
+        )
+        self.outsider = User.objects.create(name="Outsider", email="outsider@example.com", password="x")
+        for user, day in [(self.member, 1), (self.outsider, 2), (self.member, 3), (self.member, 5)]:
+            Activity.objects.create(
+                user_id=str(user.id),
+                activity_type="Cycling",
+                duration=10,
+                calories_burned=80,
+                date=f"2024-04-0{day}T12:00:00Z",
+                notes=f"day {day}"
+            )
+
+    def _export(self, **params):
+        response = self.client.get(reverse('activity-export'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson_matches_serializer_fields(self):
+        import json
+        with self.settings(OCTOFIT_EXPORT_CHUNK_SIZE=2):
+            rows = [json.loads(line) for line in self._export().splitlines()]
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(list(rows[0]), ActivitySerializer.Meta.fields)
+        self.assertEqual([row['notes'] for row in rows], ["day 1", "day 2", "day 3", "day 5"])
+        self.assertEqual(rows[0]['user_username'], "Member")
+        self.assertEqual(rows[0]['distance'], 3.3)
+
+    def test_csv_with_team_and_date_filters(self):
+        import csv
+        content = self._export(output='csv', team_id=str(self.team.id), start='2024-04-02', end='2024-04-03')
+        rows = list(csv.DictReader(content.splitlines()))
+        self.assertEqual([row['notes'] for row in rows], ["day 3"])
+
+    def test_rejects_unknown_output(self):
+        response = self.client.get(reverse('activity-export'), {'output': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryPlanTest(QueryPlanAssertionsMixin, TestCase):
+    """The filters and sorts on the hot paths must be served by an index"""
+
+    def test_activities_for_user_newest_first(self):
+        self.assertNoCollectionScan(
+            Activity.objects.filter(user_id='1').order_by('-date'),
+            mongo=('activities', {'user_id': '1'}, [('date', -1)])
+        )
+
+    def test_activity_pages_by_date(self):
+        self.assertNoCollectionScan(
+            Activity.objects.filter(date__lt=datetime(2024, 1, 1)).order_by('-date', '-id')[:50],
+            mongo=('activities', {'date': {'$lt': datetime(2024, 1, 1)}}, [('date', -1), ('id', -1)])
+        )
+
+    def test_team_members(self):
+        self.assertNoCollectionScan(
+            User.objects.filter(team_id='1'),
+            mongo=('users', {'team_id': '1'}, None)
+        )
+
+    def test_leaderboard_page(self):
+        self.assertNoCollectionScan(
+            Leaderboard.objects.order_by('-total_calories', 'id')[:50],
+            mongo=('leaderboard', {}, [('total_calories', -1), ('id', 1)])
+        )
+
+    def test_leaderboard_entry_for_user(self):
+        self.assertNoCollectionScan(
+            Leaderboard.objects.filter(user_id='1').order_by(),
+            mongo=('leaderboard', {'user_id': '1'}, None)
+        )
+
+    def test_activities_by_type(self):
+        self.assertNoCollectionScan(
+            Activity.objects.filter(activity_type='Running').order_by('-date', '-id')[:50],
+            mongo=('activities', {'activity_type': 'Running'}, [('date', -1), ('id', -1)])
+        )
+
+    def test_leaderboard_page_by_each_metric(self):
+        for metric in Leaderboard.METRICS:
+            self.assertNoCollectionScan(
+                Leaderboard.objects.order_by(f'-{metric}', 'id')[:50],
+                mongo=('leaderboard', {}, [(metric, -1), ('id', 1)])
+            )
+
+    def test_leaderboard_page_for_team(self):
+        self.assertNoCollectionScan(
+            Leaderboard.objects.filter(team_id='1').order_by('-total_calories', 'id')[:50],
+            mongo=('leaderboard', {'team_id': '1'}, [('total_calories', -1), ('id', 1)])
+        )
+
+    def test_daily_rollups_for_user(self):
+        self.assertNoCollectionScan(
+            ActivityDailyRollup.objects.filter(user_id='1', day__gte='2024-01-01'),
+            mongo=('activity_daily_rollups', {'user_id': '1'}, None)
+        )
+
+    def test_detects_scans(self):
+        self.assertEqual(plan_problems('2 0 0 SCAN activities'), ['2 0 0 SCAN activities'])
+        self.assertEqual(plan_problems('5 0 0 SCAN leaderboard USING INDEX leaderboard_calories_idx'), [])
+        self.assertEqual(len(plan_problems('35 0 0 USE TEMP B-TREE FOR ORDER BY')), 1)
+        self.assertEqual(plan_problems('35 0 0 USE TEMP B-TREE FOR ORDER BY', allow_sort=True), [])
+
+
+class ActivityMetricsTest(TestCase):
+    def test_batch_matches_scalar(self):
+        from . import metrics
+        types = ['Running', 'Cycling', 'Swimming', 'Yoga', 'Unknown', 'Running']
+        durations = [30, 45, 20, 60, 10, 7]
+        self.assertEqual(
+            metrics.batch_distances(types, durations).tolist(),
+            [metrics.estimate_distance(t, d) for t, d in zip(types, durations)]
+        )
+        self.assertEqual(
+            metrics.batch_calories(types, durations).tolist(),
+            [metrics.estimate_calories(t, d) for t, d in zip(types, durations)]
+        )
+
+    def test_user_totals(self):
+        from .metrics import user_totals
+        totals = user_totals(['1', '2', '1'], ['Running', 'Yoga', 'Cycling'], [30, 60, 10], [300, 150, 90])
+        self.assertEqual(totals['1'], {
+            'total_activities': 2, 'total_calories': 390, 'total_duration': 40, 'total_distance': 7.8
+        })
+        self.assertEqual(totals['2']['total_distance'], 0.0)
+        self.assertEqual(user_totals([], [], [], []), {})
+
+
+class ResponseCacheTest(APITestCase):
+    def setUp(self):
+        from .cache import response_cache
+        response_cache.clear()
+        Leaderboard.objects.create(user_id="1", team_id="1", total_calories=100)
+        leaderboard_ranks.invalidate()
+        self.url = reverse('leaderboard-list')
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_activity_write_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(reverse('activity-list'), {
+            'user_id': '1',
+            'activity_type': 'Yoga',
+            'duration': 10,
+            'calories_burned': 50,
+            'date': '2024-01-01T08:00:00Z',
+            'notes': ''
+        }, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['total_calories'], 150)
+
+    def test_team_write_invalidates(self):
+        teams_url = reverse('team-list')
+        self.client.get(teams_url)
+        self.client.post(teams_url, {'name': 'New', 'description': 'Fresh team'}, format='json')
+        self.assertEqual([team['name'] for team in self.client.get(teams_url).data['results']], ['New'])
+
+    def test_lru_versions_expire_after_timeout(self):
+        from unittest import mock
+        from .cache import LRUBackend
+        backend = LRUBackend(timeout=300)
+        with mock.patch('octofit_tracker.cache.time.time', return_value=1000.0):
+            version = backend.version('leaderboard')
+            self.assertEqual(backend.version('leaderboard'), version)
+        with mock.patch('octofit_tracker.cache.time.time', return_value=1300.0):
+            self.assertNotEqual(backend.version('leaderboard'), version)
+
+    def test_pages_are_cached_per_host(self):
+        Leaderboard.objects.create(user_id="2", team_id="1", total_calories=50)
+        first = self.client.get(self.url, {'page_size': 1}, HTTP_HOST='localhost')
+        second = self.client.get(self.url, {'page_size': 1}, HTTP_HOST='127.0.0.1')
+        self.assertTrue(first.data['next'].startswith('http://localhost/'))
+        self.assertTrue(second.data['next'].startswith('http://127.0.0.1/'))
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_lru_evicts_oldest(self):
+        from .cache import LRUBackend
+        backend = LRUBackend(max_entries=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual((backend.get('a'), backend.get('b'), backend.get('c')), (1, None, 3))
+
+
+class BulkPopulateTest(TestCase):
+    def test_generates_consistent_dataset(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db.models import Sum
+        call_command(
+            'populate_db', users=30, activities_per_user=4, teams=3, seed=1,
+            batch_size=25, fast_hasher=True, stdout=StringIO()
+        )
+        self.assertEqual(User.objects.count(), 30)
+        self.assertEqual(Activity.objects.count(), 120)
+        self.assertEqual(Leaderboard.objects.count(), 30)
+        self.assertEqual(sorted(Team.objects.values_list('member_count', flat=True)), [10, 10, 10])
+        self.assertEqual(
+            Leaderboard.objects.aggregate(total=Sum('total_calories'))['total'],
+            Activity.objects.aggregate(total=Sum('calories_burned'))['total']
+        )
+        self.assertEqual(
+            ActivityDailyRollup.objects.aggregate(total=Sum('total_activities'))['total'], 120
+        )
+        self.assertEqual(len(set(User.objects.values_list('password', flat=True))), 1)
+
+
+class RebuildLeaderboardCommandTest(TestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Rebuilders", description="")
+        self.users = [
+            User.objects.create(name=f"R{i}", email=f"r{i}@example.com", password="x", team_id=str(self.team.id))
+            for i in range(3)
+        ]
+        for user, day, calories in [(self.users[0], 1, 100), (self.users[0], 9, 50), (self.users[1], 2, 70)]:
+            Activity.objects.create(
+                user_id=str(user.id),
+                activity_type="Running",
+                duration=10,
+                calories_burned=calories,
+                date=f"2024-05-0{day}T10:00:00Z",
+                notes=""
+            )
+
+    def _run(self, **options):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        call_command('rebuild_leaderboard', stdout=out, **options)
+        return out.getvalue()
+
+    def _totals(self):
+        return dict(Leaderboard.objects.values_list('user_id', 'total_calories'))
+
+    def test_full_rebuild_upserts_and_keeps_ids(self):
+        drifted = Leaderboard.objects.create(user_id=str(self.users[0].id), team_id="", total_calories=9999)
+        gone = Leaderboard.objects.create(user_id="gone", team_id="", total_calories=5)
+        self.assertIn('Rebuilt 3', self._run())
+        ids = [str(user.id) for user in self.users]
+        self.assertEqual(self._totals(), {ids[0]: 150, ids[1]: 70, ids[2]: 0})
+        entry = Leaderboard.objects.get(user_id=ids[0])
+        self.assertEqual(entry.id, drifted.id)
+        self.assertEqual(entry.team_id, str(self.team.id))
+        self.assertAlmostEqual(entry.total_distance, 3.0)
+        from .models import Tombstone
+        self.assertEqual(
+            list(Tombstone.objects.filter(resource='leaderboard').values_list('object_id', 'user_id')),
+            [(gone.id, 'gone')]
+        )
+
+    def test_full_rebuild_removes_stale_rows_in_batches(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .aggregates import rebuild_leaderboard
+        from .models import Tombstone
+        for i in range(3):
+            Leaderboard.objects.create(user_id=f"stale-{i}", team_id="")
+        with CaptureQueriesContext(connection) as queries:
+            rebuild_leaderboard(batch_size=2)
+        self.assertFalse([query['sql'] for query in queries.captured_queries if 'NOT ("leaderboard"."user_id" IN' in query['sql']])
+        self.assertFalse(Leaderboard.objects.filter(user_id__startswith="stale-").exists())
+        self.assertEqual(
+            sorted(Tombstone.objects.filter(resource='leaderboard').values_list('user_id', flat=True)),
+            ['stale-0', 'stale-1', 'stale-2']
+        )
+
+    def test_aggregation_aliases_do_not_shadow_collections(self):
+        import re
+        from django.apps import apps
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .aggregates import grouped_user_totals
+        tables = {model._meta.db_table for model in apps.get_app_config('octofit_tracker').get_models()}
+        with CaptureQueriesContext(connection) as queries:
+            grouped_user_totals()
+        aliases = set(re.findall(r'AS "(\w+)"', ' '.join(query['sql'] for query in queries.captured_queries)))
+        self.assertTrue(aliases)
+        self.assertEqual(aliases & tables, set())
+
+    def test_since_reprocesses_users_with_activities_written_or_deleted_since(self):
+        self._run()
+        since = timezone.now()
+        ids = [str(user.id) for user in self.users]
+        # Backdated, but ingested after the watermark
+        Activity.objects.create(
+            user_id=ids[2], activity_type="Running", duration=10, calories_burned=30,
+            date="2024-01-01T10:00:00Z", notes=""
+        )
+        Activity.objects.filter(user_id=ids[1]).delete()
+        Leaderboard.objects.update(total_calories=1)
+        output = self._run(since=since.isoformat())
+        self.assertIn('2 user(s)', output)
+        self.assertEqual(self._totals(), {ids[0]: 1, ids[1]: 0, ids[2]: 30})
+
+    def test_since_past_tombstone_retention_rebuilds_everyone(self):
+        self._run()
+        Leaderboard.objects.update(total_calories=1)
+        output = self._run(since='2024-05-05')
+        self.assertIn('rebuilding every user', output)
+        ids = [str(user.id) for user in self.users]
+        self.assertEqual(self._totals(), {ids[0]: 150, ids[1]: 70, ids[2]: 0})
+
+
+class TeamLeaderboardTest(APITestCase):
+    def setUp(self):
+        self.red = Team.objects.create(name="Red", description="Red team")
+        self.blue = Team.objects.create(name="Blue", description="Blue team")
+        self.users = []
+        for i, team in enumerate([self.red, self.red, self.blue]):
+            response = self.client.post(reverse('user-list'), {
+                'name': f'Player {i}',
+                'email': f'player{i}@example.com',
+                'password': 'testpass123',
+                'team_id': str(team.id)
+            }, format='json')
+            self.users.append(response.data['id'])
+        for user_id, calories in zip(self.users, [100, 300, 250]):
+            self._log(user_id, calories)
+
+    def _log(self, user_id, calories):
+        self.client.post(reverse('activity-list'), {
+            'user_id': str(user_id),
+            'activity_type': 'Running',
+            'duration': 20,
+            'calories_burned': calories,
+            'date': '2024-06-01T08:00:00Z',
+            'notes': ''
+        }, format='json')
+
+    def _standings(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('leaderboard-teams'))
+        return [(row['team_name'], row['rank'], row['member_count'], row['total_calories'], row['average_calories'])
+                for row in response.data]
+
+    def test_standings_follow_activity_writes(self):
+        self.assertEqual(self._standings(), [("Red", 1, 2, 400, 200.0), ("Blue", 2, 1, 250, 250.0)])
+        self._log(self.users[2], 500)
+        self.assertEqual(self._standings(), [("Blue", 1, 1, 750, 750.0), ("Red", 2, 2, 400, 200.0)])
+
+    def test_team_change_moves_totals(self):
+        url = reverse('user-detail', args=[self.users[1]])
+        self.client.patch(url, {'team_id': str(self.blue.id)}, format='json')
+        self.assertEqual(self._standings(), [("Blue", 1, 2, 550, 275.0), ("Red", 2, 1, 100, 100.0)])
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.users[1])).team_id, str(self.blue.id))
+
+    def test_team_delete_detaches_members(self):
+        self.client.delete(reverse('team-detail', args=[self.red.id]))
+        self.assertEqual(self._standings(), [("Blue", 1, 1, 250, 250.0)])
+        for user_id in self.users[:2]:
+            self.assertEqual(User.objects.get(id=user_id).team_id, '')
+            self.assertEqual(Leaderboard.objects.get(user_id=str(user_id)).team_id, '')
+
+    def test_rebuild_rounds_distances(self):
+        from .aggregates import rebuild_team_leaderboard
+        Leaderboard.objects.filter(user_id=str(self.users[0])).update(total_distance=0.1)
+        Leaderboard.objects.filter(user_id=str(self.users[1])).update(total_distance=0.2)
+        rebuild_team_leaderboard()
+        self.assertEqual(TeamLeaderboard.objects.get(team_id=str(self.red.id)).total_distance, 0.3)
+
+    def test_member_delete_removes_totals(self):
+        self.client.delete(reverse('user-detail', args=[self.users[0]]))
+        self.assertEqual(self._standings(), [("Red", 1, 1, 300, 300.0), ("Blue", 2, 1, 250, 250.0)])
+
+    def test_rebuild_matches_incremental(self):
+        from .aggregates import rebuild_team_leaderboard
+        fields = ('team_id', 'total_activities', 'total_calories', 'total_duration')
+        incremental = sorted(TeamLeaderboard.objects.values_list(*fields))
+        rebuild_team_leaderboard()
+        self.assertEqual(sorted(TeamLeaderboard.objects.values_list(*fields)), incremental)
+
+
+class WindowedLeaderboardTest(APITestCase):
+    def setUp(self):
+        self.alice = User.objects.create(name="Alice", email="alice@example.com", password="testpass123")
+        self.bob = User.objects.create(name="Bob", email="bob@example.com", password="testpass123")
+        for user, days_ago, calories in [
+            (self.alice, 0, 100), (self.alice, 20, 500), (self.alice, 60, 900),
+            (self.bob, 0, 300), (self.bob, 45, 50),
+        ]:
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(user.id),
+                'activity_type': 'Running',
+                'duration': 30,
+                'calories_burned': calories,
+                'date': (timezone.now() - timedelta(days=days_ago)).isoformat(),
+                'notes': ''
+            }, format='json')
+
+    def _window(self, window):
+        response = self.client.get(reverse('leaderboard-list'), {'window': window})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(row['rank'], row['username'], row['total_calories']) for row in response.data['results']]
+
+    def _expected(self, window):
+        from .aggregates import window_bounds
+        start, end = window_bounds(window)
+        totals = {}
+        for activity in Activity.objects.all():
+            if start <= timezone.localtime(activity.date).date() <= end:
+                name = User.objects.get(id=activity.user_id).name
+                totals[name] = totals.get(name, 0) + activity.calories_burned
+        ranked = sorted(totals.items(), key=lambda item: -item[1])
+        return [(rank, name, calories) for rank, (name, calories) in enumerate(ranked, start=1)]
+
+    def test_windows_match_activities(self):
+        self.assertEqual(self._window('week'), [(1, "Bob", 300), (2, "Alice", 100)])
+        self.assertEqual(self._window('30d'), [(1, "Alice", 600), (2, "Bob", 300)])
+        self.assertEqual(self._window('month'), self._expected('month'))
+
+    def test_window_follows_deletes(self):
+        recent = Activity.objects.get(user_id=str(self.bob.id), calories_burned=300)
+        self.client.delete(reverse('activity-detail', args=[recent.id]))
+        self.assertEqual(self._window('week'), [(1, "Alice", 100)])
+
+    def test_invalid_window(self):
+        response = self.client.get(reverse('leaderboard-list'), {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('window', response.data)
+
+    def test_rebuild_and_expiry(self):
+        from .aggregates import expire_leaderboard_periods, rebuild_leaderboard_periods
+        from .models import LeaderboardPeriod
+        fields = ('user_id', 'period', 'start', 'total_activities', 'total_calories')
+        incremental = sorted(LeaderboardPeriod.objects.filter(total_activities__gt=0).values_list(*fields))
+        rebuild_leaderboard_periods()
+        self.assertEqual(sorted(LeaderboardPeriod.objects.values_list(*fields)), incremental)
+
+        with self.settings(OCTOFIT_WINDOW_RETENTION_WEEKS=1, OCTOFIT_WINDOW_RETENTION_MONTHS=0):
+            self.assertGreater(expire_leaderboard_periods(), 0)
+            self.assertEqual(self._window('week'), [(1, "Bob", 300), (2, "Alice", 100)])
+            oldest = timezone.localdate() - timedelta(days=timezone.localdate().weekday(), weeks=1)
+            self.assertFalse(LeaderboardPeriod.objects.filter(period='week', start__lt=oldest).exists())
+
+
+class PerformanceMiddlewareTest(APITestCase):
+    def setUp(self):
+        from .instrumentation import route_metrics
+        route_metrics.reset()
+        User.objects.create(name="Metric", email="metric@example.com", password="testpass123")
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse('user-list'))
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'total', 'db', 'serialize'})
+        self.assertRegex(timing['db'], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+
+    def test_metrics_aggregated_per_route(self):
+        for _ in range(3):
+            self.client.get(reverse('user-list'))
+        self.client.get(reverse('team-list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('# TYPE octofit_request_duration_seconds histogram', body)
+        self.assertIn('octofit_request_duration_seconds_count{route="user-list"} 3', body)
+        self.assertIn('octofit_request_duration_seconds_bucket{route="user-list",le="+Inf"} 3', body)
+        self.assertIn('octofit_db_queries_count{route="team-list"} 1', body)
+        self.assertIn('octofit_serialize_duration_seconds_sum{route="user-list"}', body)
+
+    def test_nested_serialization_counted_once(self):
+        from .instrumentation import RequestTimings, _current, timed_serialization
+        timings = RequestTimings()
+        token = _current.set(timings)
+        try:
+            with timed_serialization():
+                with timed_serialization():
+                    pass
+        finally:
+            _current.reset(token)
+        self.assertEqual(timings._depth, 0)
+        self.assertGreater(timings.serialize_seconds, 0)
+
+
+class BenchmarkCommandTest(TestCase):
+    def test_writes_results_and_flags_regressions(self):
+        import json
+        import tempfile
+        from pathlib import Path
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / 'results.json'
+            call_command(
+                'benchmark_api', sizes=[40], iterations=3, warmup=0, force=True,
+                output=str(output), stdout=StringIO()
+            )
+            report = json.loads(output.read_text())
+            self.assertEqual(set(report['results']['40']), {
+                'activity-list', 'activity-detail', 'leaderboard-list', 'leaderboard-detail', 'team-list', 'team-detail'
+            })
+            row = report['results']['40']['activity-list']
+            self.assertGreater(row['queries'], 0)
+            self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+
+            # A baseline that needed fewer queries makes the comparison fail
+            for measured in report['results']['40'].values():
+                measured['queries'] -= 1
+            output.write_text(json.dumps(report))
+            with self.assertRaises(CommandError):
+                call_command(
+                    'benchmark_api', sizes=[40], iterations=3, warmup=0, force=True, baseline=str(output),
+                    output=str(Path(tmp) / 'second.json'), stdout=StringIO()
+                )
+
+
+class AsyncReadPathTest(APITestCase):
+    """The async views against the DRF viewsets, with Mongo reads served by the ORM"""
+
+    def setUp(self):
+        team = Team.objects.create(name="Async Team", description="Async team")
+        self.user = User.objects.create(name="Async User", email="async@example.com", password="pw", team_id=str(team.id))
+        for i in range(3):
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(self.user.id),
+                'activity_type': 'Running',
+                'duration': 30 + i,
+                'calories_burned': 200 + i,
+                'date': f'2024-06-0{i + 1}T08:00:00Z',
+                'notes': ''
+            }, format='json')
+        Workout.objects.create(
+            name="Async Workout", description="Async", difficulty="Beginner", duration=20, calories_estimate=100,
+            exercises=[{'name': 'Squats', 'reps': 10}]
+        )
+
+    def _patched(self):
+        from unittest import mock
+        from asgiref.sync import sync_to_async
+        from django.apps import apps
+        from django.db.models import Q
+
+        operators = {'$in': 'in', '$lt': 'lt', '$lte': 'lte', '$gt': 'gt', '$gte': 'gte'}
+
+        def to_q(query):
+            """The Mongo filter document as a Q, for the operators the async views use"""
+            q = Q()
+            for field, condition in query.items():
+                if field == '$or':
+                    alternatives = Q()
+                    for part in condition:
+                        alternatives |= to_q(part)
+                    q &= alternatives
+                elif isinstance(condition, dict):
+                    q &= Q(**{f'{field}__{operators[op]}': value for op, value in condition.items()})
+                else:
+                    q &= Q(**{field: condition})
+            return q
+
+        def find(collection, query, projection, sort, limit, read_preference=None):
+            model = next(m for m in apps.get_app_config('octofit_tracker').get_models() if m._meta.db_table == collection)
+            rows = model.objects.filter(to_q(query))
+            fields = [field for field, include in projection.items() if include and field != '_id']
+            ordering = [('-' if direction < 0 else '') + field for field, direction in sort]
+            return [dict(row) for row in rows.order_by(*ordering).values(*fields)[:limit]]
+
+        async def find_one(collection, query, projection):
+            rows = await sync_to_async(find)(collection, query, projection, [('id', 1)], 1)
+            return rows[0] if rows else None
+
+        return mock.patch.multiple('octofit_tracker.mongo', find=sync_to_async(find), find_one=find_one)
+
+    def test_matches_sync_endpoints(self):
+        activity = Activity.objects.first()
+        entry = Leaderboard.objects.first()
+        workout = Workout.objects.first()
+        pairs = [
+            (reverse('activity-list'), reverse('async-activity-list')),
+            (reverse('activity-detail', args=[activity.id]), reverse('async-activity-detail', args=[activity.id])),
+            (reverse('leaderboard-list'), reverse('async-leaderboard-list')),
+            (reverse('leaderboard-detail', args=[entry.id]), reverse('async-leaderboard-detail', args=[entry.id])),
+            (reverse('workout-list'), reverse('async-workout-list')),
+            (reverse('workout-detail', args=[workout.id]), reverse('async-workout-detail', args=[workout.id])),
+        ]
+        with self._patched():
+            for sync_url, async_url in pairs:
+                expected = self.client.get(sync_url).json()
+                actual = self.client.get(async_url).json()
+                if 'results' in expected:
+                    expected, actual = expected['results'], actual['results']
+                self.assertEqual(actual, expected, async_url)
+
+    def test_pagination_and_errors(self):
+        with self._patched():
+            response = self.client.get(reverse('async-activity-list'), {'page_size': 2})
+            self.assertEqual(len(response.json()['results']), 2)
+            self.assertIn('cursor=', response.json()['next'])
+            self.assertEqual(self.client.get(reverse('async-activity-list'), {'page_size': 'x'}).status_code, 400)
+            self.assertEqual(self.client.get(reverse('async-activity-list'), {'cursor': 'nope'}).status_code, 400)
+            self.assertEqual(self.client.get(reverse('async-workout-detail', args=[999])).status_code, 404)
+
+    def _follow(self, url, **params):
+        pages, response = [], self.client.get(url, {'page_size': 1, **params}).json()
+        for _ in range(20):
+            pages.append([row['id'] for row in response['results']])
+            if response['next'] is None:
+                return pages
+            response = self.client.get(response['next']).json()
+        self.fail(f'{url} kept returning next links: {pages}')
+
+    def test_keyset_cursor_crosses_ties(self):
+        tied = User.objects.create(name="Tied User", email="tied@example.com", password="pw", team_id="")
+        Leaderboard.objects.create(user_id=str(tied.id), team_id="", total_calories=603)
+        Activity.objects.create(
+            user_id=str(self.user.id), activity_type="Running", duration=5, calories_burned=5,
+            date="2024-06-02T08:00:00Z", notes=""
+        )
+        leaderboard_ranks.invalidate()
+        with self._patched():
+            for sync_name, async_name in (
+                ('leaderboard-list', 'async-leaderboard-list'), ('activity-list', 'async-activity-list')
+            ):
+                expected = [row['id'] for row in self.client.get(reverse(sync_name), {'page_size': 50}).json()['results']]
+                pages = self._follow(reverse(async_name))
+                self.assertEqual([pk for page in pages for pk in page], expected, async_name)
+                self.assertTrue(all(len(page) == 1 for page in pages))
+
+    def test_serializers_use_resolved_context(self):
+        from .serializers import LeaderboardSerializer
+        entry = Leaderboard.objects.first()
+        context = {'identity_names': {'users': {entry.user_id: 'Given'}, 'teams': {}}, 'ranks': {entry.user_id: 7}}
+        with self.assertNumQueries(0):
+            data = LeaderboardSerializer([entry], many=True, context=context).data
+        self.assertEqual((data[0]['username'], data[0]['team_name'], data[0]['rank']), ('Given', 'No Team', 7))
+
+    def test_async_middleware_counts_queries(self):
+        from asgiref.sync import async_to_sync
+        from django.test import AsyncClient
+        async def fetch():
+            return await AsyncClient().get(reverse('async-workout-list'))
+
+        with self._patched():
+            response = async_to_sync(fetch)()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+
+class MongoPoolTest(TestCase):
+    def setUp(self):
+        from .mongo import pool_stats
+        pool_stats.reset()
+
+    def test_pool_listener_counts_usage(self):
+        from pymongo import monitoring
+        from .mongo import pool_stats
+        address = ('db.example', 27017)
+        pool_stats.pool_created(monitoring.PoolCreatedEvent(address, {'maxPoolSize': 50, 'minPoolSize': 5}))
+        for connection_id in (1, 2):
+            pool_stats.connection_created(monitoring.ConnectionCreatedEvent(address, connection_id))
+            pool_stats.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+            pool_stats.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, connection_id))
+        pool_stats.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+        pool_stats.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+        pool_stats.connection_check_out_failed(monitoring.ConnectionCheckOutFailedEvent(address, 'timeout'))
+
+        pool = self.client.get(reverse('pool-stats')).json()['pools']['db.example:27017']
+        self.assertEqual(
+            (pool['max_pool_size'], pool['open'], pool['in_use'], pool['peak_in_use'], pool['waiting'], pool['checkouts']),
+            (50, 2, 1, 2, 0, 2)
+        )
+        self.assertEqual(pool['checkout_failures'], {'timeout': 1})
+
+    def test_pool_endpoint_reports_configuration(self):
+        response = self.client.get(reverse('pool-stats'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.json()['configured']),
+            {'maxPoolSize', 'minPoolSize', 'asyncMaxPoolSize', 'readPreference', 'listReadPreference', 'w'}
+        )
+
+    def test_startup_probe_modes(self):
+        from unittest import mock
+        from django.conf import settings
+        from .mongo import startup_probe
+        unreachable = {'ENGINE': 'djongo', 'CLIENT': {'host': '127.0.0.1', 'port': 1}}
+        with mock.patch.dict(settings.DATABASES['default'], unreachable), self.settings(OCTOFIT_MONGO_PROBE_TIMEOUT_MS=50):
+            with self.settings(OCTOFIT_MONGO_STARTUP_PROBE='warn'), self.assertLogs('octofit_tracker.mongo', 'WARNING'):
+                self.assertFalse(startup_probe())
+            with self.settings(OCTOFIT_MONGO_STARTUP_PROBE='fail'), self.assertRaises(RuntimeError):
+                startup_probe()
+            with self.settings(OCTOFIT_MONGO_STARTUP_PROBE='off'):
+                self.assertIsNone(startup_probe())
+
+
+class SparseFieldsetTest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Sparse Team", description="A long description")
+        self.user = User.objects.create(
+            name="Sparse User", email="sparse@example.com", password="testpass123", team_id=str(self.team.id)
+        )
+        self.activity = Activity.objects.create(
+            user_id=str(self.user.id), activity_type="Running", duration=30, calories_burned=300,
+            date=timezone.now(), notes="Long notes"
+        )
+        Workout.objects.create(
+            name="Sparse Workout", description="Full body", difficulty="Easy", duration=20,
+            calories_estimate=150, exercises=["squats"]
+        )
+
+    def _queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, ctx.captured_queries
+
+    def test_fields_narrow_output_and_projection(self):
+        response, queries = self._queries(reverse('activity-list') + '?fields=id,activity_type,calories_burned')
+        self.assertEqual(
+            response.data['results'], [{'id': self.activity.id, 'activity_type': 'Running', 'calories_burned': 300}]
+        )
+        # No user name lookup, and the notes column is not loaded
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('notes', queries[0]['sql'])
+
+    def test_exclude_drops_fields(self):
+        row = self.client.get(reverse('workout-list') + '?exclude=exercises,description').data['results'][0]
+        self.assertNotIn('exercises', row)
+        self.assertNotIn('description', row)
+        self.assertEqual(row['name'], "Sparse Workout")
+
+        team = self.client.get(reverse('team-detail', args=[self.team.id]) + '?exclude=description').data
+        self.assertEqual(set(team), {'id', 'name', 'created_at', 'member_count', 'updated_at'})
+
+    def test_computed_fields_keep_their_sources(self):
+        row = self.client.get(reverse('activity-list') + '?fields=distance,user_username').data['results'][0]
+        from .metrics import estimate_distance
+        self.assertEqual(row, {'distance': estimate_distance("Running", 30), 'user_username': "Sparse User"})
+
+        row = self.client.get(reverse('user-list') + '?fields=name,team_name').data['results'][0]
+        self.assertEqual(row, {'name': "Sparse User", 'team_name': "Sparse Team"})
+
+    def test_unknown_or_write_only_fields_are_rejected(self):
+        for query in ('?fields=id,bogus', '?exclude=password', '?fields=password'):
+            response = self.client.get(reverse('user-list') + query)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_team_standings_fields(self):
+        from . import aggregates
+        aggregates.rebuild_leaderboard()
+        response, queries = self._queries(reverse('leaderboard-teams') + '?fields=team_id,rank')
+        self.assertEqual(response.data, [{'team_id': str(self.team.id), 'rank': 1}])
+        self.assertEqual(len(queries), 1)
+
+    def test_writes_ignore_fields(self):
+        response = self.client.post(
+            reverse('team-list') + '?fields=id',
+            {'name': "Another Team", 'description': "Kept"}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['description'], "Kept")
+
+
+class ListFilterTest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Filters", description="")
+        self.member = User.objects.create(
+            name="Member", email="member@example.com", password="x", team_id=str(self.team.id)
+        )
+        self.outsider = User.objects.create(name="Outsider", email="outsider@example.com", password="x")
+        for user, kind, calories, day in [
+            (self.member, "Running", 300, 1), (self.member, "Cycling", 100, 2),
+            (self.outsider, "Running", 500, 3), (self.member, "Running", 50, 4),
+        ]:
+            Activity.objects.create(
+                user_id=str(user.id), activity_type=kind, duration=30, calories_burned=calories,
+                date=f"2024-04-0{day}T12:00:00Z", notes=f"day {day}"
+            )
+        from . import aggregates
+        aggregates.rebuild_leaderboard()
+        leaderboard_ranks.invalidate()
+
+    def _notes(self, **params):
+        response = self.client.get(reverse('activity-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return [row['notes'] for row in response.data['results']]
+
+    def test_activity_filters(self):
+        self.assertEqual(self._notes(user_id=str(self.outsider.id)), ["day 3"])
+        self.assertEqual(self._notes(team_id=str(self.team.id)), ["day 4", "day 2", "day 1"])
+        self.assertEqual(self._notes(activity_type="Running", date__lte="2024-04-03"), ["day 3", "day 1"])
+        self.assertEqual(self._notes(date__gte="2024-04-02", date__lte="2024-04-03"), ["day 3", "day 2"])
+        self.assertEqual(self._notes(team_id=str(self.team.id), min_calories=100), ["day 2", "day 1"])
+        self.assertEqual(self._notes(team_id=str(self.team.id), user_id=str(self.outsider.id)), [])
+
+    def test_leaderboard_filters(self):
+        response = self.client.get(reverse('leaderboard-list'), {'team_id': str(self.team.id)})
+        self.assertEqual([row['user_id'] for row in response.data['results']], [str(self.member.id)])
+        # Ranks stay global
+        self.assertEqual(response.data['results'][0]['rank'], 2)
+
+        response = self.client.get(reverse('leaderboard-list'), {'min_calories': 460})
+        self.assertEqual([row['user_id'] for row in response.data['results']], [str(self.outsider.id)])
+
+    def test_rejects_unindexed_or_invalid_filters(self):
+        for name, params in [
+            ('activity-list', {'min_calories': 100}),
+            ('activity-list', {'notes': 'day 1'}),
+            ('activity-list', {'duration__gte': 10}),
+            ('activity-list', {'user_id': '1', 'min_calories': 'lots'}),
+            ('activity-list', {'date__gte': '04/01/2024'}),
+            ('activity-export', {'calories_burned': 300}),
+            ('leaderboard-list', {'total_distance': 1}),
+            ('leaderboard-list', {'window': 'week', 'team_id': '1'}),
+        ]:
+            response = self.client.get(reverse(name), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, (name, params))
+            self.assertTrue(set(response.data) & {*params, 'window'}, response.data)
+
+    def test_export_uses_the_same_filters(self):
+        response = self.client.get(reverse('activity-export'), {'activity_type': 'Running', 'start': '2024-04-02'})
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 2)
+
+
+class LeaderboardSortTest(APITestCase):
+    def setUp(self):
+        leaderboard_ranks.invalidate()
+        # (user, calories, duration, distance, activities)
+        for user, calories, duration, distance, activities in [
+            ("1", 900, 30, 2.0, 1), ("2", 500, 120, 9.5, 3), ("3", 700, 60, 9.5, 2),
+        ]:
+            Leaderboard.objects.create(
+                user_id=user, team_id="1", total_calories=calories, total_duration=duration,
+                total_distance=distance, total_activities=activities
+            )
+
+    def _ranked(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        rows = response.data['results'] if 'results' in response.data else response.data
+        return [(row['user_id'], row['rank']) for row in rows]
+
+    def test_list_sorted_and_ranked_by_metric(self):
+        url = reverse('leaderboard-list')
+        self.assertEqual(self._ranked(url), [("1", 1), ("3", 2), ("2", 3)])
+        self.assertEqual(self._ranked(url, sort_by='total_duration'), [("2", 1), ("3", 2), ("1", 3)])
+        # Ties are broken by id, like the calories ranking
+        self.assertEqual(self._ranked(url, sort_by='total_distance'), [("2", 1), ("3", 2), ("1", 3)])
+        self.assertEqual(
+            self._ranked(url, sort_by='total_activities', page_size=2, fields='user_id,rank'),
+            [("2", 1), ("3", 2)]
+        )
+
+    def test_cursor_pages_follow_the_metric(self):
+        url = reverse('leaderboard-list')
+        first = self.client.get(url, {'sort_by': 'total_duration', 'page_size': 2}).data
+        second = self.client.get(first['next']).data
+        self.assertEqual([row['user_id'] for row in second['results']], ["1"])
+
+    def test_top_and_around_by_metric(self):
+        self.assertEqual(self._ranked(reverse('leaderboard-top'), k=1, sort_by='total_activities'), [("2", 1)])
+        self.assertEqual(
+            self._ranked(reverse('leaderboard-around'), user_id="3", radius=1, sort_by='total_duration'),
+            [("2", 1), ("3", 2), ("1", 3)]
+        )
+
+    def test_rank_indexes_follow_writes(self):
+        self._ranked(reverse('leaderboard-list'), sort_by='total_distance')
+        entry = Leaderboard.objects.get(user_id="1")
+        response = self.client.patch(
+            reverse('leaderboard-detail', args=[entry.id]), {'total_distance': 20.0}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(leaderboard_ranks.top(1, 'total_distance'), [(1, "1", 20.0)])
+
+    def test_rejects_unknown_metric_and_unindexed_range(self):
+        url = reverse('leaderboard-list')
+        for params in ({'sort_by': 'rank'}, {'sort_by': 'total_distance', 'min_calories': 100}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        response = self.client.get(url, {'sort_by': 'total_distance', 'min_calories': 100, 'team_id': '1'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class DeltaSyncTest(APITestCase):
+    def setUp(self):
+        self.team = Team.objects.create(name="Syncers", description="")
+        self.user = User.objects.create(
+            name="Syncer", email="syncer@example.com", password="x", team_id=str(self.team.id)
+        )
+
+    def _sync(self, name, since, **params):
+        response = self.client.get(reverse(name), {'since': since, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data
+
+    def _backdate(self, seconds=60):
+        # Move every existing change behind the next watermark
+        earlier = timezone.now() - timedelta(seconds=seconds)
+        for model in (User, Team, Activity, Leaderboard, Workout):
+            model.objects.update(updated_at=earlier)
+
+    def test_initial_sync_then_only_changes(self):
+        data = self._sync('team-list', 0)
+        self.assertEqual([row['name'] for row in data['results']], ["Syncers"])
+        self.assertEqual(data['deleted'], [])
+
+        self._backdate()
+        watermark = self._sync('team-list', 0)['watermark']
+        self.assertEqual(self._sync('team-list', watermark)['results'], [])
+
+        other = Team.objects.create(name="Newcomers", description="")
+        data = self._sync('team-list', watermark)
+        self.assertEqual([row['id'] for row in data['results']], [other.id])
+
+    def test_deletes_are_reported_as_tombstones(self):
+        self._backdate()
+        watermark = self._sync('user-list', 0)['watermark']
+        user_id = self.user.id
+        response = self.client.delete(reverse('user-detail', args=[user_id]))
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        data = self._sync('user-list', watermark)
+        self.assertEqual((data['results'], data['deleted']), ([], [user_id]))
+        # Tombstones are per resource
+        self.assertEqual(self._sync('team-list', watermark)['deleted'], [])
+
+    def test_derived_writes_move_updated_at(self):
+        from . import aggregates
+        aggregates.rebuild_leaderboard()
+        self._backdate()
+        watermark = self._sync('leaderboard-list', 0)['watermark']
+        response = self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user.id), 'activity_type': "Running", 'duration': 30,
+            'calories_burned': 300, 'date': '2024-04-01T12:00:00Z',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        rows = self._sync('leaderboard-list', watermark)['results']
+        self.assertEqual([(row['user_id'], row['total_calories']) for row in rows], [(str(self.user.id), 300)])
+        self.assertEqual(len(self._sync('activity-list', watermark)['results']), 1)
+
+        # Member counts are F-updates on Team (the setUp user was not counted)
+        self.client.post(reverse('user-list'), {
+            'name': "Second", 'email': "second@example.com", 'password': "x", 'team_id': str(self.team.id),
+        }, format='json')
+        rows = self._sync('team-list', watermark)['results']
+        self.assertEqual([(row['id'], row['member_count']) for row in rows], [(self.team.id, 1)])
+
+    def test_pages_in_change_order_with_deletes_on_the_last_page(self):
+        for i in range(3):
+            Workout.objects.create(
+                name=f"Workout {i}", description="", difficulty="Easy", duration=10,
+                calories_estimate=50, exercises=[]
+            )
+        Workout.objects.filter(name="Workout 2").delete()
+        from .sync import to_watermark
+        first = self._sync('workout-list', to_watermark(timezone.now() - timedelta(minutes=1)), page_size=1)
+        self.assertEqual([row['name'] for row in first['results']], ["Workout 0"])
+        self.assertEqual(first['deleted'], [])
+        last = self.client.get(first['next']).data
+        self.assertEqual([row['name'] for row in last['results']], ["Workout 1"])
+        self.assertIsNone(last['next'])
+        self.assertEqual(len(last['deleted']), 1)
+
+    def test_rejects_bad_watermarks_and_combinations(self):
+        for params in (
+            {'since': 'yesterday'}, {'since': -1}, {'since': 0, 'user_id': '1'}, {'since': 0, 'sort_by': 'total_duration'}
+        ):
+            response = self.client.get(reverse('leaderboard-list'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        from .sync import to_watermark
+        expired = to_watermark(timezone.now() - timedelta(days=31))
+        response = self.client.get(reverse('activity-list'), {'since': expired})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+    def test_prune_tombstones(self):
+        from .models import Tombstone
+        from .sync import prune_tombstones
+        Workout.objects.create(
+            name="Gone", description="", difficulty="Easy", duration=1, calories_estimate=1, exercises=[]
+        ).delete()
+        Tombstone.objects.update(deleted_at=timezone.now() - timedelta(days=31))
+        Team.objects.create(name="Also gone", description="").delete()
+        self.assertEqual(prune_tombstones(), 1)
+        self.assertEqual(list(Tombstone.objects.values_list('resource', flat=True)), ['teams'])
+
+
+@override_settings(OCTOFIT_EVENTS={'BACKEND': 'memory'})
+class LeaderboardEventsTest(APITestCase):
+    """Rank events published by activity writes and the SSE route that streams them"""
+
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.user = User.objects.create(name="Live User", email="live@example.com", password="pw", team_id="")
+        leaderboard_ranks.invalidate()
+
+    def _events_app(self, django_application=None):
+        from .events import sse_router
+        return sse_router(django_application)
+
+    def _stream(self, app, method='GET', until=None):
+        """Run the route until `until(sent)` holds, then disconnect; returns the ASGI messages sent"""
+        import asyncio
+        sent, closed = [], asyncio.Event()
+
+        async def receive():
+            await closed.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            scope = {'type': 'http', 'method': method, 'path': '/api/leaderboard/events/', 'headers': []}
+            task = asyncio.ensure_future(app(scope, receive, send))
+            while until is not None and not until(sent) and not task.done():
+                await asyncio.sleep(0.01)
+            closed.set()
+            await asyncio.wait_for(task, 1)
+
+        self.loop.run_until_complete(run())
+        return sent
+
+    def test_activity_write_publishes_rank_event(self):
+        import asyncio
+        from .events import broadcaster
+
+        async def subscribe():
+            return broadcaster.subscribe()
+
+        queue = self.loop.run_until_complete(subscribe())
+        self.addCleanup(broadcaster.unsubscribe, queue)
+        self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user.id), 'activity_type': 'Running', 'duration': 30,
+            'calories_burned': 250, 'date': '2024-06-01T08:00:00Z', 'notes': ''
+        }, format='json')
+        message = self.loop.run_until_complete(asyncio.wait_for(queue.get(), 1))
+        self.assertEqual(
+            message,
+            'event: rank\ndata: {"user_id":"%s","rank":1,"previous_rank":null,"total_calories":250}\n\n'
+            % self.user.id
+        )
+
+    def _write_queries(self, calories):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        leaderboard_ranks.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('activity-list'), {
+                'user_id': str(self.user.id), 'activity_type': 'Running', 'duration': 30,
+                'calories_burned': calories, 'date': '2024-06-01T08:00:00Z', 'notes': ''
+            }, format='json')
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_writes_without_subscribers_skip_the_rank_index(self):
+        from .events import broadcaster
+        self.assertEqual(broadcaster.subscriber_count(), 0)
+        self._write_queries(50)  # creates the user's aggregates
+        queries = self._write_queries(100)
+        with self.settings(OCTOFIT_EVENTS={'BACKEND': 'off'}):
+            self.assertEqual(len(queries), len(self._write_queries(200)))
+        self.assertFalse([sql for sql in queries if 'FROM "leaderboard"' in sql and 'WHERE' not in sql])
+
+    def test_default_backend_follows_the_sse_route(self):
+        from .events import Broadcaster
+        local = Broadcaster()
+        with self.settings(OCTOFIT_EVENTS={'BACKEND': ''}):
+            self.assertFalse(local.enabled)
+            local.mount()
+            self.assertTrue(local.enabled)
+            self.assertFalse(local.listening)
+
+    def test_streams_events_until_disconnect(self):
+        from .events import broadcaster
+
+        def published(sent):
+            if len(sent) == 2:
+                broadcaster.publish('rank', {'user_id': '1', 'rank': 2})
+            return len(sent) > 2
+
+        sent = self._stream(self._events_app(), until=published)
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(sent[1]['body'], b'retry: 5000\n\n')
+        self.assertEqual(sent[2]['body'], b'event: rank\ndata: {"user_id":"1","rank":2}\n\n')
+        self.assertEqual(broadcaster.subscriber_count(), 0)
+
+    @override_settings(OCTOFIT_SSE_HEARTBEAT_SECONDS=0.01)
+    def test_heartbeat_comments(self):
+        sent = self._stream(self._events_app(), until=lambda sent: len(sent) > 2)
+        self.assertEqual(sent[2]['body'], b': keep-alive\n\n')
+
+    @override_settings(OCTOFIT_SSE_QUEUE_SIZE=1)
+    def test_slow_client_is_disconnected(self):
+        from .events import broadcaster
+
+        def flooded(sent):
+            if len(sent) == 2:
+                for rank in range(3):
+                    broadcaster.publish('rank', {'rank': rank})
+            return False
+
+        sent = self._stream(self._events_app(), until=flooded)
+        self.assertEqual(len(sent), 3)
+        self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b''})
+
+    @override_settings(OCTOFIT_SSE_MAX_CLIENTS=0)
+    def test_connection_cap(self):
+        sent = self._stream(self._events_app())
+        self.assertEqual(sent[0]['status'], 503)
+        self.assertIn((b'retry-after', b'30'), sent[0]['headers'])
+
+    @override_settings(OCTOFIT_EVENTS={'BACKEND': 'off'})
+    def test_disabled_backend(self):
+        from .events import broadcaster
+        self.assertFalse(broadcaster.enabled)
+        self.assertEqual(self._stream(self._events_app())[0]['status'], 404)
+        self.assertEqual(self._stream(self._events_app(), method='POST')[0]['status'], 405)
+
+    def test_other_paths_go_to_django(self):
+        calls = []
+
+        async def django_application(scope, receive, send):
+            calls.append(scope['path'])
+
+        app = self._events_app(django_application)
+        self.loop.run_until_complete(app({'type': 'http', 'path': '/api/users/'}, None, None))
+        self.assertEqual(calls, ['/api/users/'])
+
+
+@override_settings(
+    OCTOFIT_WRITE_BEHIND=True, OCTOFIT_WRITE_BEHIND_QUEUE_SIZE=1,
+    OCTOFIT_WRITE_BEHIND_BATCH_SIZE=2, OCTOFIT_WRITE_BEHIND_FLUSH_MS=10000
+)
+class WriteBehindIngestTest(APITestCase):
+    """Queued activity creates; the flusher thread hands batches to a recorder instead of the database"""
+
+    def setUp(self):
+        import threading
+        from unittest import mock
+        from . import ingest
+        self.buffer = ingest.WriteBehindBuffer()
+        self.batches, self.flushing, self.release = [], threading.Event(), threading.Event()
+
+        def record(batch):
+            self.batches.append(batch)
+            self.flushing.set()
+            self.release.wait(5)
+
+        patcher = mock.patch.object(ingest, 'write_behind', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer.flush = record
+        self.addCleanup(self.buffer.drain, 5)
+        self.addCleanup(self.release.set)
+        self.user = User.objects.create(name="Queued User", email="queued@example.com", password="pw", team_id="")
+
+    def _post(self, calories):
+        return self.client.post(reverse('activity-list'), {
+            'user_id': str(self.user.id), 'activity_type': 'Running', 'duration': 30,
+            'calories_burned': calories, 'date': '2024-06-01T08:00:00Z', 'notes': ''
+        }, format='json')
+
+    @override_settings(OCTOFIT_WRITE_BEHIND_QUEUE_SIZE=10)
+    def test_batches_are_written_once_per_flush(self):
+        from .ingest import WriteBehindBuffer
+        first = self._post(100)
+        self.assertEqual(first.status_code, status.HTTP_202_ACCEPTED)
+        self.assertIsNone(first.data['id'])
+        self.assertEqual(first.data['calories_burned'], 100)
+        self._post(150)
+        self.assertTrue(self.flushing.wait(5))
+        self.release.set()
+        self.buffer.drain(5)
+        self.assertEqual([[a.calories_burned for a in batch] for batch in self.batches], [[100, 150]])
+        self.assertEqual(Activity.objects.count(), 0)
+
+        WriteBehindBuffer.flush(self.buffer, self.batches[0])
+        self.assertEqual(Activity.objects.count(), 2)
+        self.assertEqual(Leaderboard.objects.get(user_id=str(self.user.id)).total_calories, 250)
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('octofit_write_behind_flushed_total 2\n', metrics)
+        self.assertIn('octofit_write_behind_batch_size_count 1\n', metrics)
+        self.assertIn('octofit_write_behind_queue_depth 0\n', metrics)
+
+    @override_settings(OCTOFIT_WRITE_BEHIND_BATCH_SIZE=1)
+    def test_full_queue_answers_503(self):
+        self.assertEqual(self._post(100).status_code, status.HTTP_202_ACCEPTED)
+        self.assertTrue(self.flushing.wait(5))
+        self.assertEqual(self._post(110).status_code, status.HTTP_202_ACCEPTED)
+        response = self._post(120)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.buffer.rejected, 1)
+
+        self.release.set()
+        self.buffer.drain(5)
+        self.assertEqual([[a.calories_burned for a in batch] for batch in self.batches], [[100], [110]])
+        self.assertEqual(self._post(130).status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_invalid_activities_are_rejected_before_queueing(self):
+        response = self.client.post(reverse('activity-list'), {'user_id': str(self.user.id)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.buffer.depth(), 0)
@@ -12,8 +12,30 @@ API Endpoints:
     - /api/users/ - User management
     - /api/teams/ - Team management
     - /api/activities/ - Activity tracking
+      - ?user_id=, ?team_id=, ?activity_type=, ?date__gte=/?date__lte=, ?min_calories=
+      - POST answers 202 and writes in batches when OCTOFIT_WRITE_BEHIND is on (see ingest.py)
+    - /api/activities/stats/?user_id=1&bucket=week - Activity totals over time
+    - /api/activities/bulk/ - Bulk activity ingest (JSON array or NDJSON)
+    - /api/activities/export/?output=csv - Streaming activity export (NDJSON or CSV)
     - /api/leaderboard/ - Leaderboard rankings
+      - ?user_id=, ?team_id=, ?min_calories=
+      - ?sort_by=total_calories|total_duration|total_distance|total_activities
+        (also on top/ and around/)
+    - /api/leaderboard/top/?k=10 - Top entries by rank
+    - /api/leaderboard/around/?user_id=1&radius=5 - Entries ranked around a user
+    - /api/leaderboard/?window=week|month|30d - Top users within a time window
+    - /api/leaderboard/teams/ - Team standings
+    - /api/leaderboard/events/ - Live rank changes as Server-Sent Events (ASGI only, see asgi.py)
     - /api/workouts/ - Workout suggestions
+    - /api/_metrics/ - Per-route request and write-behind metrics (Prometheus text format)
+    - /api/_pool/ - MongoDB connection pool usage of the serving worker
+    - /api/async/activities/, /api/async/leaderboard/, /api/async/workouts/ (and /<id>/)
+      - Async read-only variants of the list/retrieve endpoints, for ASGI servers
+
+    Every GET accepts `?fields=id,name` or `?exclude=notes` to return (and
+    load) only some of the fields. The users, teams, activities, leaderboard
+    and workouts lists accept `?since=<watermark>` (start with 0) and return
+    only what changed, see sync.py.
 
 Examples:
 Function views
@@ -29,6 +51,9 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
+from .instrumentation import metrics_view
+from .mongo import pool_stats_view
 from .views import (
     api_root,
     UserViewSet,
@@ -48,6 +73,14 @@ router.register(r'workouts', WorkoutViewSet, basename='workout')
 
 urlpatterns = [
     path('', api_root, name='api-root'),
+    path('api/_metrics/', metrics_view, name='metrics'),
+    path('api/_pool/', pool_stats_view, name='pool-stats'),
+    path('api/async/activities/', async_views.activity_list, name='async-activity-list'),
+    path('api/async/activities/<int:pk>/', async_views.activity_detail, name='async-activity-detail'),
+    path('api/async/leaderboard/', async_views.leaderboard_list, name='async-leaderboard-list'),
+    path('api/async/leaderboard/<int:pk>/', async_views.leaderboard_detail, name='async-leaderboard-detail'),
+    path('api/async/workouts/', async_views.workout_list, name='async-workout-list'),
+    path('api/async/workouts/<int:pk>/', async_views.workout_detail, name='async-workout-detail'),
     path('api/', include(router.urls)),
     path('admin/', admin.site.urls),
 ]
@@ -1,13 +1,33 @@
+from copy import copy
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
-from .models import User, Team, Activity, Leaderboard, Workout
+from . import aggregates, exports, filters, ingest
+from .cache import CachedListMixin
+from .sync import DeltaSyncMixin
+from .filters import Filter, IndexedFilterBackend, MetricOrderingBackend, at_least, date_from, date_until, exact, team_members
+from .models import User, Team, Activity, Leaderboard, TeamLeaderboard, Workout
+from .pagination import ActivityCursorPagination, LeaderboardCursorPagination
+from .parsers import NDJSONParser
+from .ranking import leaderboard_ranks
 from .serializers import (
+    sparse_fieldset_requested,
     UserSerializer,
     TeamSerializer,
     ActivitySerializer,
     LeaderboardSerializer,
+    LeaderboardPeriodSerializer,
+    TeamLeaderboardSerializer,
     WorkoutSerializer
 )
 
@@ -26,39 +46,385 @@ def api_root(request, format=None):
     })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def _parse_date_param(params, name, errors):
+    """Parse an optional YYYY-MM-DD query parameter, recording errors by name"""
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        errors[name] = 'Must be a date in YYYY-MM-DD format.'
+    return parsed
+
+
+def _parse_count_param(params, name, default, errors):
+    """Parse a non-negative integer query parameter capped at OCTOFIT_MAX_PAGE_SIZE, recording errors by name"""
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        value = -1
+    if value < 0:
+        errors[name] = 'Must be a non-negative integer.'
+    return min(value, settings.OCTOFIT_MAX_PAGE_SIZE)
+
+
+class ProjectedQuerysetMixin:
+    """
+    Loads only the columns a sparse fieldset (`?fields=`/`?exclude=`) renders.
+
+    list and retrieve are narrowed through `get_queryset`; custom actions
+    pass their querysets through `project`.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = self.project(queryset)
+        return queryset
+
+    def project(self, queryset, serializer_class=None):
+        if not sparse_fieldset_requested(self.request):
+            return queryset
+        serializer_class = serializer_class or self.get_serializer_class()
+        columns = serializer_class(context=self.get_serializer_context()).model_fields()
+        # The pagination cursor and the ordering read their fields too
+        get_ordering = getattr(self.paginator, 'get_ordering', None)
+        ordering = get_ordering(self.request, queryset, self) if get_ordering else ()
+        if isinstance(ordering, str):
+            ordering = (ordering,)
+        ordering = [*ordering, *queryset.query.order_by]
+        return queryset.only(*columns, *(field.lstrip('-') for field in ordering))
+
+
+class UserViewSet(DeltaSyncMixin, ProjectedQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for User model providing CRUD operations.
+
+    Every write keeps the affected teams' member_count current.
     """
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
+    def perform_create(self, serializer):
+        user = serializer.save()
+        aggregates.move_member(None, user.team_id)
+
+    def perform_update(self, serializer):
+        previous_team_id = serializer.instance.team_id
+        user = serializer.save()
+        aggregates.move_member(previous_team_id, user.team_id, user_id=user.id)
+
+    def perform_destroy(self, instance):
+        aggregates.move_member(instance.team_id, None, user_id=instance.id)
+        instance.delete()
 
-class TeamViewSet(viewsets.ModelViewSet):
+
+class TeamViewSet(DeltaSyncMixin, CachedListMixin, ProjectedQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for Team model providing CRUD operations.
+
+    The list is served from the versioned response cache. Deleting a team
+    leaves its members without a team.
     """
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
+    cache_scope = 'teams'
+
+    def perform_destroy(self, instance):
+        aggregates.disband_team(instance.id)
+        instance.delete()
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(DeltaSyncMixin, ProjectedQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for Activity model providing CRUD operations.
+
+    Every write also adjusts the author's leaderboard totals incrementally.
+    The list filters on `user_id`, `team_id`, `activity_type`,
+    `date__gte`/`date__lte` (YYYY-MM-DD, inclusive) and `min_calories`; the
+    last one only together with one of the others. With OCTOFIT_WRITE_BEHIND
+    on, creates are queued and written in batches, see ingest.py.
     """
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    pagination_class = ActivityCursorPagination
+    filter_backends = [IndexedFilterBackend]
+    index_filters = {
+        'user_id': Filter(exact('user_id'), index='activity_user_date_idx'),
+        'team_id': Filter(team_members('user_id'), index='activity_user_date_idx'),
+        'activity_type': Filter(exact('activity_type'), index='activity_type_date_idx'),
+        'date__gte': Filter(date_from('date'), index='activity_date_idx'),
+        'date__lte': Filter(date_until('date'), index='activity_date_idx'),
+        'min_calories': Filter(at_least('calories_burned')),
+    }
+
+    def create(self, request, *args, **kwargs):
+        if not settings.OCTOFIT_WRITE_BEHIND:
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        activity = Activity(**serializer.validated_data)
+        if not ingest.write_behind.submit(activity):
+            return Response(
+                {'detail': 'Too many activities waiting to be written; retry shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(ingest.RETRY_AFTER_SECONDS)}
+            )
+        return Response(self.get_serializer(activity).data, status=status.HTTP_202_ACCEPTED)
+
+    def perform_create(self, serializer):
+        activity = serializer.save()
+        aggregates.record_activities([activity])
+
+    def perform_update(self, serializer):
+        previous = copy(serializer.instance)
+        activity = serializer.save()
+        aggregates.replace_activity(previous, activity)
+
+    def perform_destroy(self, instance):
+        aggregates.retract_activities([instance])
+        instance.delete()
+
+    @action(detail=False)
+    def stats(self, request):
+        """
+        Totals per day, week or month for one user, read from the daily rollups.
 
+        Query parameters: `user_id` (required), `bucket` (day|week|month),
+        `start`/`end` (YYYY-MM-DD, default the last 90 days) and `activity_type`.
+        """
+        params = request.query_params
+        errors = {}
+        user_id = params.get('user_id')
+        if not user_id:
+            errors['user_id'] = 'This parameter is required.'
+        bucket = params.get('bucket', 'day')
+        if bucket not in aggregates.BUCKETS:
+            errors['bucket'] = f"Must be one of: {', '.join(aggregates.BUCKETS)}."
+        end = _parse_date_param(params, 'end', errors) or timezone.localdate()
+        start = _parse_date_param(params, 'start', errors) or end - timedelta(days=89)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+        results = aggregates.activity_stats(
+            user_id, start, end, bucket=bucket, activity_type=params.get('activity_type')
+        )
+        return Response({
+            'user_id': user_id,
+            'bucket': bucket,
+            'start': start,
+            'end': end,
+            'results': results,
+        })
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many activities from a JSON array or an NDJSON stream.
+
+        Valid items are inserted with bulk_create in batches of
+        OCTOFIT_BULK_BATCH_SIZE and each batch updates the derived totals once
+        per user, in the same transaction. Invalid items are reported by their position in the payload.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response(
+                {'detail': 'Expected a JSON array or an NDJSON stream of activities.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.OCTOFIT_BULK_MAX_ITEMS:
+            return Response(
+                {'detail': f'At most {settings.OCTOFIT_BULK_MAX_ITEMS} activities per request.'},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        serializer = self.get_serializer(data=items, many=True)
+        errors = []
+        if not serializer.is_valid():
+            errors = [
+                {'index': index, 'errors': item_errors}
+                for index, item_errors in enumerate(serializer.errors)
+                if item_errors
+            ]
+            failed = {error['index'] for error in errors}
+            serializer = self.get_serializer(
+                data=[item for index, item in enumerate(items) if index not in failed], many=True
+            )
+            serializer.is_valid(raise_exception=True)
+
+        activities = [Activity(**data) for data in serializer.validated_data]
+        batch_size = settings.OCTOFIT_BULK_BATCH_SIZE
+        for offset in range(0, len(activities), batch_size):
+            batch = activities[offset:offset + batch_size]
+            # Inserted only together with their totals
+            with transaction.atomic():
+                Activity.objects.bulk_create(batch)
+                aggregates.record_activities(batch)
+
+        if not activities and errors:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': len(activities), 'errors': errors}, status=response_status)
+
+    EXPORT_FORMATS = {
+        'ndjson': ('application/x-ndjson', 'activities.ndjson'),
+        'csv': ('text/csv', 'activities.csv'),
+    }
+    export_filters = {
+        **index_filters,
+        'start': index_filters['date__gte'],
+        'end': index_filters['date__lte'],
+    }
+
+    @action(detail=False)
+    def export(self, request):
+        """
+        Stream activities as NDJSON or CSV with the same fields as the API.
+
+        Query parameters: `output` (ndjson|csv), the list filters, and
+        `start`/`end` as aliases of `date__gte`/`date__lte`. Rows are streamed
+        oldest first.
+        """
+        params = request.query_params
+        errors = {}
+        output = params.get('output', 'ndjson')
+        if output not in self.EXPORT_FORMATS:
+            errors['output'] = f"Must be one of: {', '.join(self.EXPORT_FORMATS)}."
+        try:
+            queryset = filters.filter_queryset(Activity.objects.order_by('date', 'id'), params, self.export_filters)
+        except ValidationError as error:
+            errors.update(error.detail)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+
+        rows = exports.serialize_in_chunks(
+            self.project(queryset),
+            lambda chunk: self.get_serializer(chunk, many=True),
+            settings.OCTOFIT_EXPORT_CHUNK_SIZE
+        )
+        content_type, filename = self.EXPORT_FORMATS[output]
+        if output == 'csv':
+            lines = exports.csv_lines(rows, list(self.get_serializer().fields))
+        else:
+            lines = exports.ndjson_lines(rows)
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class LeaderboardViewSet(DeltaSyncMixin, CachedListMixin, ProjectedQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for Leaderboard model providing CRUD operations.
+
+    Ranks come from the rank index, which also serves `top/` and `around/`.
+    The list is served from the versioned response cache. `?window=week`,
+    `month` or `30d` ranks the top `page_size` users by calories burned in
+    that window instead of all time. The all-time list filters on `user_id`,
+    `team_id` and `min_calories`.
+
+    `?sort_by=` orders and ranks the list, `top/` and `around/` by any of
+    Leaderboard.METRICS (default total_calories); each metric has its own
+    index and rank index.
     """
-    queryset = Leaderboard.objects.all().order_by('-total_calories')
+    queryset = Leaderboard.objects.all().order_by('-total_calories', 'id')
     serializer_class = LeaderboardSerializer
+    pagination_class = LeaderboardCursorPagination
+    cache_scope = 'leaderboard'
+    filter_backends = [MetricOrderingBackend, IndexedFilterBackend]
+    sort_metrics = Leaderboard.METRICS
+    index_filters = {
+        'user_id': Filter(exact('user_id'), index='leaderboard_user_idx'),
+        # Served in rank order by leaderboard_team_idx when sorted by calories;
+        # other metrics sort the team's rows only
+        'team_id': Filter(exact('team_id'), index='leaderboard_team_idx'),
+        'min_calories': Filter(
+            at_least('total_calories'), index='leaderboard_calories_idx', sorted_by='total_calories'
+        ),
+    }
+
+    def get_sort_metric(self):
+        return filters.sort_metric(self.request.query_params, self.sort_metrics)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['sort_by'] = self.get_sort_metric()
+        return context
+
+    def perform_create(self, serializer):
+        leaderboard_ranks.sync([serializer.save()])
+
+    def perform_update(self, serializer):
+        leaderboard_ranks.sync([serializer.save()])
+
+    def perform_destroy(self, instance):
+        leaderboard_ranks.discard(instance.user_id)
+        instance.delete()
+
+    def uncached_list(self, request, *args, **kwargs):
+        window = request.query_params.get('window')
+        if window is None:
+            return super().uncached_list(request, *args, **kwargs)
+        if window not in aggregates.WINDOWS:
+            return Response(
+                {'window': f"Must be one of: {', '.join(aggregates.WINDOWS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if any(request.query_params.get(param) for param in [*self.index_filters, 'sort_by']):
+            return Response(
+                {'window': 'Cannot be combined with filters or sort_by.'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end, entries = aggregates.windowed_leaderboard(window, self.paginator.get_page_size(request))
+        context = self.get_serializer_context()
+        context['ranks'] = {entry.user_id: rank for rank, entry in enumerate(entries, start=1)}
+        results = LeaderboardPeriodSerializer(entries, many=True, context=context).data
+        return Response({'window': window, 'start': start, 'end': end, 'results': results})
+
+    def _ranked_response(self, ranked):
+        entries = self.project(Leaderboard.objects.filter(user_id__in=[member for _, member, _ in ranked]))
+        by_user = {entry.user_id: entry for entry in entries}
+        rows = [by_user[member] for _, member, _ in ranked if member in by_user]
+        return Response(self.get_serializer(rows, many=True).data)
+
+    @action(detail=False)
+    def top(self, request):
+        """The top `k` entries (default 10, at most OCTOFIT_MAX_PAGE_SIZE)"""
+        errors = {}
+        k = _parse_count_param(request.query_params, 'k', 10, errors)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return self._ranked_response(leaderboard_ranks.top(k, self.get_sort_metric()))
+
+    @action(detail=False)
+    def around(self, request):
+        """The entry for `user_id` and up to `radius` (at most OCTOFIT_MAX_PAGE_SIZE) neighbours on each side"""
+        user_id = request.query_params.get('user_id')
+        errors = {}
+        radius = _parse_count_param(request.query_params, 'radius', 5, errors)
+        if not user_id:
+            errors['user_id'] = 'This parameter is required.'
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        ranked = leaderboard_ranks.around(user_id, radius, self.get_sort_metric())
+        if not ranked:
+            return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return self._ranked_response(ranked)
+
+    @action(detail=False, url_path='teams')
+    def teams(self, request):
+        """Team standings from the maintained per-team aggregates"""
+        entries = list(self.project(TeamLeaderboard.objects.order_by('-total_calories', 'id'), TeamLeaderboardSerializer))
+        context = self.get_serializer_context()
+        context['ranks'] = {entry.team_id: rank for rank, entry in enumerate(entries, start=1)}
+        return Response(TeamLeaderboardSerializer(entries, many=True, context=context).data)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(DeltaSyncMixin, ProjectedQuerysetMixin, viewsets.ModelViewSet):
     """
     ViewSet for Workout model providing CRUD operations.
     """
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'octofit_tracker.settings')
 
 application = get_wsgi_application()
+
+# Ping MongoDB once per worker, see OCTOFIT_MONGO_STARTUP_PROBE
+from octofit_tracker.mongo import startup_probe  # noqa: E402
+
+startup_probe()